@@ -0,0 +1 @@
+Reduced the number of database queries made while saving advisories during sync to a constant number per batch.
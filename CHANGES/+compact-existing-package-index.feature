@@ -0,0 +1,3 @@
+Reduced the memory used to keep track of the packages already present in a repository during
+sync. Only a few fields are loaded for each of them now, rather than mostly-complete package
+objects.
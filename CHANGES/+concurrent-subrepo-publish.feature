@@ -0,0 +1 @@
+Added the `RPM_PUBLISH_SUBREPO_WORKERS` setting, which lets publishing generate the metadata of the sub-repositories of a distribution tree in several worker processes.
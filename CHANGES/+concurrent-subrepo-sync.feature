@@ -0,0 +1,2 @@
+The sync pipelines of the variant and addon sub-repositories of distribution trees now run
+concurrently, bounded by the new `RPM_SYNC_SUBREPO_CONCURRENCY` setting.
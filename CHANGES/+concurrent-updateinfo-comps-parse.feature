@@ -0,0 +1,2 @@
+updateinfo.xml and comps.xml are now parsed in worker processes during sync, while the packages are
+being parsed.
@@ -0,0 +1,3 @@
+Optimized syncs now check whether repomd.xml and treeinfo have changed since the previous sync with
+conditional HTTP requests, and skip the sync on a "304 Not Modified" reply. The metadata files are
+also only downloaded once per sync.
@@ -0,0 +1,2 @@
+When re-syncing a repository, filelists.xml and other.xml are now only parsed for packages which
+are not already present in the repository.
@@ -0,0 +1,2 @@
+Packages which were already synced or uploaded into another repository in the same domain are now
+looked up in batches during sync and reused, instead of being rebuilt from the metadata.
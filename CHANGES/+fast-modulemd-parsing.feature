@@ -0,0 +1 @@
+Sped up the parsing of modular metadata, by using the libyaml based YAML loader and validating the modulemd documents against a schema which is only compiled once.
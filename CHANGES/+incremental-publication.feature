@@ -0,0 +1 @@
+Added the opt-in `RPM_PUBLISH_INCREMENTAL` setting, with which publications reuse the unchanged metadata and packages of the latest earlier publication of the same repository, so that republishing a repository after a small change is much faster.
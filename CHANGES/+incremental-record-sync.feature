@@ -0,0 +1,2 @@
+Optimized syncs now only download and parse the repository metadata which changed since the
+previous sync, e.g. just updateinfo.xml, and carry forward the rest of the content.
@@ -0,0 +1,2 @@
+Added the `RPM_METADATA_CACHE_DIR` and `RPM_METADATA_CACHE_MAX_SIZE` settings for a local cache of
+repository metadata files which is shared by syncs and alternate content source refreshes.
@@ -0,0 +1,3 @@
+The data about metadata files and package locations, which is kept for mirror_complete syncs, is now
+stored in a temporary SQLite database in the task's working directory rather than in worker memory,
+and isn't collected at all for other sync policies.
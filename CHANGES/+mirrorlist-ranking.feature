@@ -0,0 +1 @@
+Mirrorlists are now probed concurrently, the fastest valid mirror is used for sync, and packages whose download fails fall back to the next fastest mirrors.
@@ -0,0 +1 @@
+Added the opt-in `RPM_PUBLISH_METADATA_FRAGMENTS` setting, with which publishing stores the rendered repository metadata of each package, and reuses it when the package is published the same way again. Stored metadata unused for `RPM_PUBLISH_METADATA_FRAGMENTS_MAX_AGE` days is pruned.
@@ -0,0 +1,2 @@
+Added the `RPM_SYNC_PARSE_WORKERS` setting, which lets sync convert the packages from the
+repository metadata in a pool of worker processes.
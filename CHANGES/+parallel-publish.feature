@@ -0,0 +1 @@
+Added the `RPM_PUBLISH_WORKERS` setting, which lets publishing compress the package metadata in several worker processes, and generate the rest of the metadata concurrently.
@@ -0,0 +1 @@
+Publishing now loads only the metadata columns of the packages it renders, without instantiating the models.
@@ -0,0 +1,3 @@
+Added a `shards` option to sync, which splits the packages of a very large repository into shards
+that are downloaded and saved by parallel tasks before the repository version is created. The tasks
+of a sharded sync run in a task group, which is returned alongside the task.
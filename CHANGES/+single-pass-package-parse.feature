@@ -0,0 +1,3 @@
+Package metadata is now parsed in a single pass during sync. Packages are spooled to disk while the
+skip, retention and duplicate-NEVRA decisions are collected and replayed afterwards, instead of
+parsing primary.xml a second time.
@@ -0,0 +1,2 @@
+The published artifacts of mirror_complete publications are now saved in fixed-size batches while the
+repository content is iterated, instead of all of them being built in memory first.
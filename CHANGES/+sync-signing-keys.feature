@@ -0,0 +1 @@
+Added the opt-in `RPM_SYNC_EXTRACT_SIGNING_KEYS` setting, which extracts the signing keys of synced packages from their RPM headers, fetching them with range requests for on-demand syncs.
@@ -0,0 +1 @@
+ULN downloaders now share one session key per ULN account, so a ULN sync logs in once instead of once per download.
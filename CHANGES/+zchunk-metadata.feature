@@ -0,0 +1 @@
+Added the opt-in RPM_SYNC_ZCHUNK_METADATA setting, which makes sync download only the changed chunks of zchunk package metadata.
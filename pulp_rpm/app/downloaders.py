@@ -1,5 +1,8 @@
 import asyncio
+import hashlib
 import os
+import time
+import weakref
 from logging import getLogger
 from urllib.parse import quote, unquote, urlparse
 
@@ -13,6 +16,20 @@ from pulp_rpm.app.shared_utils import urlpath_sanitize
 
 log = getLogger(__name__)
 
+# How long a ULN session key is reused for, in seconds
+ULN_SESSION_KEY_LIFETIME = 30 * 60
+# The ULN session keys shared by all of the downloaders of the process, and the locks which make
+# sure that only one of them logs in at a time, per event loop. Both are keyed by the ULN account.
+# Session keys are dropped once they expire or are renewed.
+ULN_SESSION_KEYS = {}
+ULN_LOGIN_LOCKS = weakref.WeakKeyDictionary()
+
+
+class NotModified(Exception):
+    """
+    Raised when a conditional request finds that the requested file hasn't changed.
+    """
+
 
 class RpmFileDownloader(FileDownloader):
     """
@@ -96,7 +113,11 @@ class RpmDownloader(HttpDownloader):
         Raises:
             FileNotFoundError: If aiohttp response status is 403 or 404 and silenced.
             aiohttp.ClientResponseError: If the response status is 400 or higher and not silenced.
+            NotModified: If the response status is 304, in reply to a conditional request.
         """
+        if response.status == 304:
+            raise NotModified(self.url)
+
         silenced = response.status in self.silence_errors_for_response_status_codes
 
         if not silenced:
@@ -111,10 +132,15 @@ class RpmDownloader(HttpDownloader):
 
         This method provides the same return object type and documented in
         :meth:`~pulpcore.plugin.download.BaseDownloader._run`.
+
+        Args:
+            extra_data (dict): Extra data passed by the downloader:
+                request_kwargs: Additional arguments for the request, e.g. `headers`.
         """
-        async with self.session.get(
-            self.url, proxy=self.proxy, proxy_auth=self.proxy_auth, auth=self.auth
-        ) as response:
+        request_kwargs = {"proxy": self.proxy, "proxy_auth": self.proxy_auth, "auth": self.auth}
+        if extra_data and extra_data.get("request_kwargs"):
+            request_kwargs.update(extra_data["request_kwargs"])
+        async with self.session.get(self.url, **request_kwargs) as response:
             self.raise_for_status(response)
             to_return = await self._handle_response(response)
             await response.release()
@@ -157,46 +183,113 @@ class UlnDownloader(RpmDownloader):
         """
         Download, validate, and compute digests on the `url`. This is a coroutine.
 
-        Once per session the coroutine logs into the ULN account using the
-        ULN username and password. The returned key is used for authentification
-        for all other downloads.
+        The coroutine logs into the ULN account using the ULN username and password, unless
+        another downloader has already done so. The returned key is shared by all of the
+        downloaders using the same account, and used for authentification for all other downloads.
 
         This method provides the same return object type and documented in
         :meth:`~pulpcore.plugin.download.BaseDownloader._run`.
+
+        Args:
+            extra_data (dict): Extra data passed by the downloader:
+                request_kwargs: Additional arguments for the request, e.g. `headers`.
         """
         parsed = urlparse(self.url)
+        url = self.url
 
-        if parsed.scheme == "uln":
-            # get ULN Session-key
-            SERVER_URL = os.path.join(self.uln_server_base_url, "rpc/api")
-
-            # set proxy for authentification
-            client = AllowProxyServerProxy(
-                SERVER_URL, proxy=self.proxy, proxy_auth=self.proxy_auth, auth=self.auth
-            )
-            if not self.session_key:
-                self.session_key = await self._login_and_retry(client)
-                if len(self.session_key) != 43:
-                    raise UlnCredentialsError()
+        # If the shared session key turns out to have expired early, log in again once
+        for attempt in range(2):
+            if parsed.scheme == "uln":
+                self.session_key = await self._get_session_key(renew=attempt > 0)
                 self.headers = {"X-ULN-API-User-Key": self.session_key}
-                await client.close()
-            # build request url from input uri
-            channelLabel = parsed.netloc
-            path = parsed.path.lstrip("/")
-            url = os.path.join(self.uln_server_base_url, "XMLRPC/GET-REQ", channelLabel, path)
-        async with self.session.get(
-            url, proxy=self.proxy, proxy_auth=self.proxy_auth, auth=self.auth, headers=self.headers
-        ) as response:
-            self.raise_for_status(response)
-            to_return = await self._handle_response(response)
-            await response.release()
-            self.response_headers = response.headers
+                # build request url from input uri
+                channelLabel = parsed.netloc
+                path = parsed.path.lstrip("/")
+                url = os.path.join(self.uln_server_base_url, "XMLRPC/GET-REQ", channelLabel, path)
+            headers = self.headers
+            if extra_data and extra_data.get("request_kwargs", {}).get("headers"):
+                headers = {**(self.headers or {}), **extra_data["request_kwargs"]["headers"]}
+            async with self.session.get(
+                url, proxy=self.proxy, proxy_auth=self.proxy_auth, auth=self.auth, headers=headers
+            ) as response:
+                if parsed.scheme == "uln" and response.status in (401, 403) and attempt == 0:
+                    continue
+                self.raise_for_status(response)
+                to_return = await self._handle_response(response)
+                await response.release()
+                self.response_headers = response.headers
+            break
 
         if self._close_session_on_finalize:
             self.session.close()
-            client.close()
         return to_return
 
+    async def _get_session_key(self, renew=False):
+        """
+        Get a session key for the ULN account, logging in only if there's no valid one yet.
+
+        The session keys are cached per account for the whole process, and only one downloader
+        at a time logs in for each account, while the others wait for its result.
+
+        Args:
+            renew (bool): Whether to log in again even though there is a cached session key.
+
+        Returns:
+            str: The session key.
+
+        Raises:
+            UlnCredentialsError: If the ULN credentials aren't valid.
+        """
+        cache_key = (
+            self.uln_server_base_url,
+            self.username,
+            hashlib.sha256((self.password or "").encode()).hexdigest(),
+        )
+        stale_session_key = self.session_key if renew else None
+
+        def cached_session_key():
+            session_key, expires = ULN_SESSION_KEYS.get(cache_key, (None, 0))
+            if session_key is None:
+                return None
+            if session_key == stale_session_key or expires <= time.monotonic():
+                # don't keep the credentials around any longer than the session key is of use
+                ULN_SESSION_KEYS.pop(cache_key, None)
+                return None
+            return session_key
+
+        if session_key := cached_session_key():
+            return session_key
+
+        loop = asyncio.get_running_loop()
+        lock = ULN_LOGIN_LOCKS.setdefault(loop, {}).setdefault(cache_key, asyncio.Lock())
+        async with lock:
+            # Another downloader may have logged in while this one was waiting
+            if session_key := cached_session_key():
+                return session_key
+
+            # set proxy for authentification
+            client = AllowProxyServerProxy(
+                os.path.join(self.uln_server_base_url, "rpc/api"),
+                proxy=self.proxy,
+                proxy_auth=self.proxy_auth,
+                auth=self.auth,
+            )
+            try:
+                session_key = await self._login_and_retry(client)
+            finally:
+                await client.close()
+            if len(session_key) != 43:
+                raise UlnCredentialsError()
+
+            now = time.monotonic()
+            # Drop the expired session keys of the other accounts as well, which may not be used
+            # anymore at all
+            for account, (_session_key, expires) in list(ULN_SESSION_KEYS.items()):
+                if expires <= now:
+                    ULN_SESSION_KEYS.pop(account, None)
+            ULN_SESSION_KEYS[cache_key] = (session_key, now + ULN_SESSION_KEY_LIFETIME)
+            return session_key
+
     async def _login_and_retry(self, client, max_attempts=4, delay=1):
         """
         Attempts to log in using the provided client. Retries up to `max_attempts`
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from logging import getLogger
+
+from django.conf import settings
+
+from pulpcore.plugin.download import DownloadResult
+
+log = getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+HEX_DIGEST = re.compile(r"^[0-9a-f]+$")
+
+
+class MetadataCache:
+    """
+    A local, size-bounded cache of repository metadata files, keyed by their checksum.
+
+    The checksums are the ones listed in repomd.xml, so a file which is published by several
+    repositories (or sub-repositories, or alternate content sources) pointing at the same
+    upstream only needs to be downloaded once. When the cache grows beyond its maximum size, the
+    least recently used files are evicted first.
+
+    The cache may be shared by all of the workers on a host, so files are only ever added to
+    it atomically, and files which vanish because another worker evicted them are just misses.
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        Create the cache.
+
+        Args:
+            directory (str): The directory to keep the cached files in
+            max_size (int): The maximum total size of the cached files, in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Create the cache configured by `RPM_METADATA_CACHE_DIR`.
+
+        Returns:
+            MetadataCache: The cache, or None if it's disabled
+        """
+        if not settings.RPM_METADATA_CACHE_DIR:
+            return None
+        return cls(settings.RPM_METADATA_CACHE_DIR, settings.RPM_METADATA_CACHE_MAX_SIZE)
+
+    def _path(self, checksum_type, checksum):
+        # The checksums come from remote metadata, don't let them point outside of the cache
+        checksum = checksum.lower()
+        if checksum_type not in hashlib.algorithms_available or not HEX_DIGEST.match(checksum):
+            return None
+        return os.path.join(self.directory, f"{checksum_type}-{checksum}")
+
+    def get(self, checksum_type, checksum, url):
+        """
+        Copy a file out of the cache into the current working directory.
+
+        Args:
+            checksum_type (str): The type of the checksum, e.g. "sha256"
+            checksum (str): The checksum of the file
+            url (str): The URL the file would otherwise have been downloaded from
+
+        Returns:
+            pulpcore.plugin.download.DownloadResult: The cached file, or None on a cache miss
+        """
+        path = self._path(checksum_type, checksum)
+        if path is None:
+            return None
+
+        destination = tempfile.NamedTemporaryFile(dir=".", delete=False).name
+        try:
+            os.unlink(destination)
+            try:
+                os.link(path, destination)
+            except OSError as exc:
+                if not os.path.exists(path):
+                    raise FileNotFoundError(path) from exc
+                shutil.copyfile(path, destination)
+            # Mark the file as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        digest = hashlib.new(checksum_type)
+        with open(destination, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+        if digest.hexdigest() != checksum.lower():
+            log.warning(f"Discarding corrupted metadata file from the cache: {path}")
+            os.unlink(destination)
+            self.discard(checksum_type, checksum)
+            return None
+
+        return DownloadResult(
+            url=url,
+            artifact_attributes={checksum_type: checksum, "size": os.path.getsize(destination)},
+            path=destination,
+            headers=None,
+        )
+
+    def put(self, checksum_type, checksum, source_path):
+        """
+        Add a (verified) file to the cache, evicting the least recently used files if needed.
+
+        Args:
+            checksum_type (str): The type of the checksum, e.g. "sha256"
+            checksum (str): The checksum of the file
+            source_path (str): The path to the file
+        """
+        path = self._path(checksum_type, checksum)
+        if path is None or os.path.getsize(source_path) > self.max_size:
+            return
+
+        # Files which are still being added are hidden from eviction
+        with tempfile.NamedTemporaryFile(dir=self.directory, prefix=".", delete=False) as tmp_file:
+            tmp_path = tmp_file.name
+        try:
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            log.warning(f"Unable to add a metadata file to the cache: {exc}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+        self.evict()
+
+    def discard(self, checksum_type, checksum):
+        """
+        Remove a file from the cache.
+
+        Args:
+            checksum_type (str): The type of the checksum, e.g. "sha256"
+            checksum (str): The checksum of the file
+        """
+        path = self._path(checksum_type, checksum)
+        if path is not None and os.path.exists(path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Remove the least recently used files until the cache fits within its maximum size."""
+        entries = []
+        total_size = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:12
+
+import django.db.models.deletion
+import django_lifecycle.mixins
+import pulpcore.app.models.base
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rpm', '0072_fix_evr_version_sorting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackageMetadataFragment',
+            fields=[
+                ('pulp_id', models.UUIDField(default=pulpcore.app.models.base.pulp_uuid, editable=False, primary_key=True, serialize=False)),
+                ('pulp_created', models.DateTimeField(auto_now_add=True)),
+                ('pulp_last_updated', models.DateTimeField(auto_now=True, null=True)),
+                ('digest', models.TextField(unique=True)),
+                ('primary', models.TextField()),
+                ('filelists', models.TextField()),
+                ('other', models.TextField()),
+                ('package', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metadata_fragments', to='rpm.package')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['pulp_last_updated'], name='rpm_package_pulp_la_0f2889_idx')],
+            },
+            bases=(django_lifecycle.mixins.LifecycleModelMixin, models.Model),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import hashlib
 from logging import getLogger
 
 import createrepo_c as cr
@@ -5,7 +6,7 @@ from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
 from django.db import models
 
-from pulpcore.plugin.models import Content
+from pulpcore.plugin.models import BaseModel, Content
 from pulpcore.plugin.util import get_domain_pk
 
 from pulp_rpm.app.constants import (
@@ -214,6 +215,59 @@ class Package(Content):
     # E.g. glibc-2.26.11.3.2.nosrc.rpm vs glibc-2.26.11.3.2.src.rpm
     repo_key_fields = ("name", "epoch", "version", "release", "arch", "location_href")
 
+    # The fields which are converted to the createrepo_c package attributes of the same name, and
+    # those of them which hold lists of tuples
+    createrepo_c_fields = (
+        PULP_PACKAGE_ATTRS.ARCH,
+        PULP_PACKAGE_ATTRS.CHANGELOGS,
+        PULP_PACKAGE_ATTRS.CHECKSUM_TYPE,
+        PULP_PACKAGE_ATTRS.CONFLICTS,
+        PULP_PACKAGE_ATTRS.DESCRIPTION,
+        PULP_PACKAGE_ATTRS.ENHANCES,
+        PULP_PACKAGE_ATTRS.EPOCH,
+        PULP_PACKAGE_ATTRS.FILES,
+        PULP_PACKAGE_ATTRS.LOCATION_HREF,
+        PULP_PACKAGE_ATTRS.NAME,
+        PULP_PACKAGE_ATTRS.OBSOLETES,
+        PULP_PACKAGE_ATTRS.PKGID,
+        PULP_PACKAGE_ATTRS.PROVIDES,
+        PULP_PACKAGE_ATTRS.RECOMMENDS,
+        PULP_PACKAGE_ATTRS.RELEASE,
+        PULP_PACKAGE_ATTRS.REQUIRES,
+        PULP_PACKAGE_ATTRS.RPM_BUILDHOST,
+        PULP_PACKAGE_ATTRS.RPM_GROUP,
+        PULP_PACKAGE_ATTRS.RPM_HEADER_END,
+        PULP_PACKAGE_ATTRS.RPM_HEADER_START,
+        PULP_PACKAGE_ATTRS.RPM_LICENSE,
+        PULP_PACKAGE_ATTRS.RPM_PACKAGER,
+        PULP_PACKAGE_ATTRS.RPM_SOURCERPM,
+        PULP_PACKAGE_ATTRS.RPM_VENDOR,
+        PULP_PACKAGE_ATTRS.SIZE_ARCHIVE,
+        PULP_PACKAGE_ATTRS.SIZE_INSTALLED,
+        PULP_PACKAGE_ATTRS.SIZE_PACKAGE,
+        PULP_PACKAGE_ATTRS.SUGGESTS,
+        PULP_PACKAGE_ATTRS.SUMMARY,
+        PULP_PACKAGE_ATTRS.SUPPLEMENTS,
+        PULP_PACKAGE_ATTRS.TIME_BUILD,
+        PULP_PACKAGE_ATTRS.TIME_FILE,
+        PULP_PACKAGE_ATTRS.URL,
+        PULP_PACKAGE_ATTRS.VERSION,
+    )
+    createrepo_c_list_fields = frozenset(
+        (
+            PULP_PACKAGE_ATTRS.CHANGELOGS,
+            PULP_PACKAGE_ATTRS.CONFLICTS,
+            PULP_PACKAGE_ATTRS.ENHANCES,
+            PULP_PACKAGE_ATTRS.FILES,
+            PULP_PACKAGE_ATTRS.OBSOLETES,
+            PULP_PACKAGE_ATTRS.PROVIDES,
+            PULP_PACKAGE_ATTRS.RECOMMENDS,
+            PULP_PACKAGE_ATTRS.REQUIRES,
+            PULP_PACKAGE_ATTRS.SUGGESTS,
+            PULP_PACKAGE_ATTRS.SUPPLEMENTS,
+        )
+    )
+
     _pulp_domain = models.ForeignKey("core.Domain", default=get_domain_pk, on_delete=models.PROTECT)
 
     @property
@@ -407,67 +461,90 @@ class Package(Content):
             createrepo_c.Package: package itself in a format of a createrepo_c package object
 
         """
+        return self.values_to_createrepo_c(
+            {field: getattr(self, field) for field in self.createrepo_c_fields}
+        )
 
-        def list_to_createrepo_c(lst):
-            """
-            Convert list to createrepo_c format.
-
-            Createrepo_c expects list of tuples, not list of lists.
-            The assumption is that there are no nested lists, which is true for the data on the
-            Package model at the moment.
-
-            Args:
-                lst(list): a list
+    @classmethod
+    def values_to_createrepo_c(cls, values):
+        """
+        Convert the values of a Package's fields to a createrepo_c package object.
 
-            Returns:
-                list: list of strings and/or tuples
+        This converts rows queried with `values()` without instantiating the models. Only the
+        attributes of the fields in `values` are set, so that the query may leave out the ones
+        which are going to be set to something else anyway.
 
-            """
-            createrepo_c_list = []
-            for item in lst:
-                if isinstance(item, list):
-                    createrepo_c_list.append(tuple(item))
-                else:
-                    createrepo_c_list.append(item)
+        Args:
+            values(dict): Values of (some of) the fields in `createrepo_c_fields`, by field name
 
-            return createrepo_c_list
+        Returns:
+            createrepo_c.Package: the package in a format of a createrepo_c package object
 
+        """
         package = cr.Package()
-        package.arch = getattr(self, PULP_PACKAGE_ATTRS.ARCH)
-        package.changelogs = list_to_createrepo_c(getattr(self, PULP_PACKAGE_ATTRS.CHANGELOGS))
-        package.checksum_type = getattr(
-            CHECKSUM_TYPES, getattr(self, PULP_PACKAGE_ATTRS.CHECKSUM_TYPE).upper()
-        )
-        package.conflicts = list_to_createrepo_c(getattr(self, PULP_PACKAGE_ATTRS.CONFLICTS))
-        package.description = getattr(self, PULP_PACKAGE_ATTRS.DESCRIPTION)
-        package.enhances = list_to_createrepo_c(getattr(self, PULP_PACKAGE_ATTRS.ENHANCES))
-        package.epoch = getattr(self, PULP_PACKAGE_ATTRS.EPOCH)
-        package.files = list_to_createrepo_c(getattr(self, PULP_PACKAGE_ATTRS.FILES))
         package.location_base = ""  # TODO: delete this entirely
-        package.location_href = getattr(self, PULP_PACKAGE_ATTRS.LOCATION_HREF)
-        package.name = getattr(self, PULP_PACKAGE_ATTRS.NAME)
-        package.obsoletes = list_to_createrepo_c(getattr(self, PULP_PACKAGE_ATTRS.OBSOLETES))
-        package.pkgId = getattr(self, PULP_PACKAGE_ATTRS.PKGID)
-        package.provides = list_to_createrepo_c(getattr(self, PULP_PACKAGE_ATTRS.PROVIDES))
-        package.recommends = list_to_createrepo_c(getattr(self, PULP_PACKAGE_ATTRS.RECOMMENDS))
-        package.release = getattr(self, PULP_PACKAGE_ATTRS.RELEASE)
-        package.requires = list_to_createrepo_c(getattr(self, PULP_PACKAGE_ATTRS.REQUIRES))
-        package.rpm_buildhost = getattr(self, PULP_PACKAGE_ATTRS.RPM_BUILDHOST)
-        package.rpm_group = getattr(self, PULP_PACKAGE_ATTRS.RPM_GROUP)
-        package.rpm_header_end = getattr(self, PULP_PACKAGE_ATTRS.RPM_HEADER_END)
-        package.rpm_header_start = getattr(self, PULP_PACKAGE_ATTRS.RPM_HEADER_START)
-        package.rpm_license = getattr(self, PULP_PACKAGE_ATTRS.RPM_LICENSE)
-        package.rpm_packager = getattr(self, PULP_PACKAGE_ATTRS.RPM_PACKAGER)
-        package.rpm_sourcerpm = getattr(self, PULP_PACKAGE_ATTRS.RPM_SOURCERPM)
-        package.rpm_vendor = getattr(self, PULP_PACKAGE_ATTRS.RPM_VENDOR)
-        package.size_archive = getattr(self, PULP_PACKAGE_ATTRS.SIZE_ARCHIVE)
-        package.size_installed = getattr(self, PULP_PACKAGE_ATTRS.SIZE_INSTALLED)
-        package.size_package = getattr(self, PULP_PACKAGE_ATTRS.SIZE_PACKAGE)
-        package.suggests = list_to_createrepo_c(getattr(self, PULP_PACKAGE_ATTRS.SUGGESTS))
-        package.summary = getattr(self, PULP_PACKAGE_ATTRS.SUMMARY)
-        package.supplements = list_to_createrepo_c(getattr(self, PULP_PACKAGE_ATTRS.SUPPLEMENTS))
-        package.time_build = getattr(self, PULP_PACKAGE_ATTRS.TIME_BUILD)
-        package.time_file = getattr(self, PULP_PACKAGE_ATTRS.TIME_FILE)
-        package.url = getattr(self, PULP_PACKAGE_ATTRS.URL)
-        package.version = getattr(self, PULP_PACKAGE_ATTRS.VERSION)
+        for field, value in values.items():
+            if field in cls.createrepo_c_list_fields:
+                # Createrepo_c expects list of tuples, not list of lists. The assumption is that
+                # there are no nested lists, which is true for the data on the model at the moment.
+                value = [tuple(item) if isinstance(item, list) else item for item in value]
+            elif field == PULP_PACKAGE_ATTRS.CHECKSUM_TYPE:
+                value = getattr(CHECKSUM_TYPES, value.upper())
+            setattr(package, field, value)
         return package
+
+
+class PackageMetadataFragment(BaseModel):
+    """
+    The primary.xml, filelists.xml and other.xml snippets of a package, as rendered when publishing.
+
+    A package is rendered the same way in every publication which publishes it with the same
+    checksum, location_href and time_file, so the snippets are stored and reused by all of them.
+    The pulp_last_updated timestamp is refreshed when they are reused, so that those which haven't
+    been published for a while can be pruned.
+
+    Fields:
+        digest (Text):
+            A digest of the package and the values which are overridden when publishing it
+        primary (Text):
+            The <package> element of primary.xml
+        filelists (Text):
+            The <package> element of filelists.xml
+        other (Text):
+            The <package> element of other.xml
+
+    Relations:
+        package (models.ForeignKey): The package the snippets were rendered from
+    """
+
+    # Increase this to stop using the stored snippets when the way packages are rendered changes
+    VERSION = 1
+
+    digest = models.TextField(unique=True)
+    primary = models.TextField()
+    filelists = models.TextField()
+    other = models.TextField()
+    package = models.ForeignKey(
+        Package, on_delete=models.CASCADE, related_name="metadata_fragments"
+    )
+
+    class Meta:
+        indexes = [models.Index(fields=["pulp_last_updated"])]
+
+    @classmethod
+    def calculate_digest(cls, package_id, checksum_type, checksum, location_href, time_file=None):
+        """
+        Calculate the digest of the snippets of a package.
+
+        Args:
+            package_id (uuid.UUID): The id of the package
+            checksum_type (str): The type of the checksum the package is published with
+            checksum (str): The checksum the package is published with
+            location_href (str): The location the package is published at
+            time_file (int): The time_file the package is published with, if it's overridden
+
+        Returns:
+            str: The digest
+        """
+        fields = [cls.VERSION, package_id, checksum_type, checksum, location_href, time_file]
+        return hashlib.sha256("\0".join(map(str, fields)).encode()).hexdigest()
@@ -1,8 +1,10 @@
 import hashlib
 import logging
+import multiprocessing
 import os
 import tempfile
-from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
 from gettext import gettext as _  # noqa:F401
 
 import createrepo_c as cr
@@ -21,6 +23,32 @@ from pulp_rpm.app.schema import MODULEMD_SCHEMA
 
 log = logging.getLogger(__name__)
 
+FLOAT_TAG = "tag:yaml.org,2002:float"
+INT_TAG = "tag:yaml.org,2002:int"
+
+
+def string_constructor(loader, node):
+    """Construct the plain string value of a scalar, instead of casting it."""
+    return node.value
+
+
+class ModulemdLoader(getattr(yaml, "CSafeLoader", yaml.SafeLoader)):
+    """
+    A YAML loader for modular metadata, which doesn't cast unquoted values to numbers.
+
+    It loads the same as `yaml.SafeLoader` within `disable_pyyaml_magic_casting`, but uses the
+    libyaml based parser when PyYAML is built with it, and doesn't affect any other loader.
+    """
+
+
+ModulemdLoader.add_constructor(FLOAT_TAG, string_constructor)
+ModulemdLoader.add_constructor(INT_TAG, string_constructor)
+
+# Compiling the schema is expensive, so only do it once
+MODULEMD_VALIDATOR = Draft7Validator(MODULEMD_SCHEMA)
+# How many documents to send to a worker process at a time
+PARSE_WORKER_CHUNK_SIZE = 100
+
 
 def resolve_module_packages(version, previous_version):
     """
@@ -179,44 +207,80 @@ def create_modulemd_obsoletes(obsolete, snippet):
     return new_obsolete
 
 
-def parse_modular(file: str):
+def parse_modular_document(module):
+    """
+    Parse a single modular metadata document.
+
+    Args:
+        module: The text of the document
+
+    Returns:
+        tuple: The type of the document, and its data to be saved to DB, or None if the type of
+            the document is unknown
+    """
+    parsed_data = yaml.load(module, Loader=ModulemdLoader)
+    # here we check the modulemd document as we don't store all info, so serializers
+    # are not enough then we only need to take required data from dict which is
+    # parsed by pyyaml library
+    if parsed_data["document"] == "modulemd":
+        # the validator currently accepts formatting slightly different to the
+        # spec due to the misconfiguration of some Rocky Linux 9 repositories
+        # https://bugs.rockylinux.org/view.php?id=2575
+        # further discussion on this issue can be found here:
+        # https://github.com/pulp/pulp_rpm/issues/2998
+        err = []
+        for error in sorted(MODULEMD_VALIDATOR.iter_errors(parsed_data["data"]), key=str):
+            err.append(error.message)
+        if err:
+            raise ValueError(_("Provided modular data is invalid:'{}'").format(err))
+        return "modulemd", create_modulemd(parsed_data, module)
+    elif parsed_data["document"] == "modulemd-defaults":
+        check_mandatory_module_fields(parsed_data, YAML_MODULEMD_DEFAULTS_REQUIRED_ATTR)
+        return "modulemd-defaults", create_modulemd_defaults(parsed_data, module)
+    elif parsed_data["document"] == "modulemd-obsoletes":
+        check_mandatory_module_fields(parsed_data, YAML_MODULEMD_OBSOLETES_REQUIRED_ATTR)
+        return "modulemd-obsoletes", create_modulemd_obsoletes(parsed_data, module)
+    else:
+        logging.warning(f"Unknown modular document type found: {parsed_data.get('document')}")
+        return parsed_data.get("document"), None
+
+
+def parse_modular(file: str, workers=0):
     """
     Parse all modular metadata.
 
     Args:
         file: Absolute path to file
+        workers: When more than 1, the number of worker processes to parse the documents in
     """
     modulemd_all = []
     modulemd_defaults_all = []
     modulemd_obsoletes_all = []
-
-    for module in split_modulemd_file(file):
-        with disable_pyyaml_magic_casting():
-            parsed_data = yaml.load(module, Loader=yaml.SafeLoader)
-        # here we check the modulemd document as we don't store all info, so serializers
-        # are not enough then we only need to take required data from dict which is
-        # parsed by pyyaml library
-        if parsed_data["document"] == "modulemd":
-            # the validator currently accepts formatting slightly different to the
-            # spec due to the misconfiguration of some Rocky Linux 9 repositories
-            # https://bugs.rockylinux.org/view.php?id=2575
-            # further discussion on this issue can be found here:
-            # https://github.com/pulp/pulp_rpm/issues/2998
-            validator = Draft7Validator(MODULEMD_SCHEMA)
-            err = []
-            for error in sorted(validator.iter_errors(parsed_data["data"]), key=str):
-                err.append(error.message)
-            if err:
-                raise ValueError(_("Provided modular data is invalid:'{}'").format(err))
-            modulemd_all.append(create_modulemd(parsed_data, module))
-        elif parsed_data["document"] == "modulemd-defaults":
-            check_mandatory_module_fields(parsed_data, YAML_MODULEMD_DEFAULTS_REQUIRED_ATTR)
-            modulemd_defaults_all.append(create_modulemd_defaults(parsed_data, module))
-        elif parsed_data["document"] == "modulemd-obsoletes":
-            check_mandatory_module_fields(parsed_data, YAML_MODULEMD_OBSOLETES_REQUIRED_ATTR)
-            modulemd_obsoletes_all.append(create_modulemd_obsoletes(parsed_data, module))
+    documents = {
+        "modulemd": modulemd_all,
+        "modulemd-defaults": modulemd_defaults_all,
+        "modulemd-obsoletes": modulemd_obsoletes_all,
+    }
+
+    with ExitStack() as stack:
+        if workers > 1:
+            # The workers rely on Django having been set up already, so they need to be forked
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context("fork")
+                )
+            )
+            results = executor.map(
+                parse_modular_document,
+                split_modulemd_file(file),
+                chunksize=PARSE_WORKER_CHUNK_SIZE,
+            )
         else:
-            logging.warning(f"Unknown modular document type found: {parsed_data.get('document')}")
+            results = map(parse_modular_document, split_modulemd_file(file))
+
+        for document, data in results:
+            if data is not None:
+                documents[document].append(data)
 
     return modulemd_all, modulemd_defaults_all, modulemd_obsoletes_all
 
@@ -230,14 +294,8 @@ def disable_pyyaml_magic_casting():
     # It's implemented in a context manager to avoid surprise side-effects if
     # by any chance the loader is called in other context where the default
     # pyyaml behavior is expected.
-    FLOAT_TAG = "tag:yaml.org,2002:float"
-    INT_TAG = "tag:yaml.org,2002:int"
     float_old_constructor = yaml.SafeLoader.yaml_constructors[FLOAT_TAG]
     int_old_constructor = yaml.SafeLoader.yaml_constructors[INT_TAG]
-
-    def string_constructor(self, node):
-        return node.value
-
     yaml.SafeLoader.yaml_constructors[FLOAT_TAG] = string_constructor
     yaml.SafeLoader.yaml_constructors[INT_TAG] = string_constructor
     yield
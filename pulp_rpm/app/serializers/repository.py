@@ -637,6 +637,17 @@ class RpmRepositorySyncURLSerializer(RepositorySyncURLSerializer):
     optimize = serializers.BooleanField(
         help_text=_("Whether or not to optimize sync."), required=False, default=True
     )
+    shards = serializers.IntegerField(
+        help_text=_(
+            "Split the packages of the repository into this many shards, which are downloaded "
+            "and saved by separate tasks in parallel, before the sync task creates the new "
+            "repository version from them. Useful for very large repositories synced with the "
+            "'immediate' download policy. Default: 1."
+        ),
+        required=False,
+        default=1,
+        min_value=1,
+    )
 
     def validate(self, data):
         """
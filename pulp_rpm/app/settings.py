@@ -21,3 +21,15 @@ PRUNE_WORKERS_MAX = 5
 SPECTACULAR_SETTINGS__OAS_VERSION = "3.0.1"
 MAX_PACKAGE_SIGNING_WORKERS = 5
 RPM_SIGNING_COPY_LABELS = True
+RPM_SYNC_DELTA_PARSE_MAX_NEW_PACKAGES = 5000
+RPM_SYNC_PARSE_WORKERS = 0
+RPM_METADATA_CACHE_DIR = None
+RPM_METADATA_CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+RPM_SYNC_SUBREPO_CONCURRENCY = 4
+RPM_SYNC_ZCHUNK_METADATA = False
+RPM_SYNC_EXTRACT_SIGNING_KEYS = False
+RPM_PUBLISH_INCREMENTAL = False
+RPM_PUBLISH_METADATA_FRAGMENTS = False
+RPM_PUBLISH_METADATA_FRAGMENTS_MAX_AGE = 30
+RPM_PUBLISH_WORKERS = 0
+RPM_PUBLISH_SUBREPO_WORKERS = 0
@@ -89,6 +89,12 @@ def extract_signing_keys(path):
     return format_signing_keys(pkg.signatures())
 
 
+def extract_signing_keys_from_header(data):
+    """Extract signing key fingerprints from the start of an RPM file, up to its header end."""
+    pkg = rpm_rs.PackageMetadata.from_bytes(data)
+    return format_signing_keys(pkg.signatures())
+
+
 def read_crpackage_from_artifact(artifact, working_dir="."):
     """
     Helper function for creating package.
@@ -1,5 +1,5 @@
 from .publishing import publish  # noqa
-from .synchronizing import synchronize  # noqa
+from .synchronizing import synchronize, synchronize_shard  # noqa
 from .signing import sign_and_create  # noqa
 from .copy import copy_content  # noqa
 from .comps import upload_comps  # noqa
@@ -1,7 +1,12 @@
 import logging
+import multiprocessing
 import os
 import shutil
 import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from functools import partial
 from gettext import gettext as _
 from typing import NamedTuple
 from uuid import UUID
@@ -10,10 +15,13 @@ import createrepo_c as cr
 import libcomps
 from django.conf import settings
 from django.core.files import File
+from django.db import connection, connections
 from django.db.models import Q
+from django.utils import timezone
 
 from pulpcore.plugin.models import (
     AsciiArmoredDetachedSigningService,
+    Content,
     ContentArtifact,
     ProgressReport,
     PublishedArtifact,
@@ -47,6 +55,7 @@ from pulp_rpm.app.models import (
     PackageEnvironment,
     PackageGroup,
     PackageLangpacks,
+    PackageMetadataFragment,
     RepoMetadataFile,
     RpmPublication,
     UpdateRecord,
@@ -57,10 +66,27 @@ from pulp_rpm.app.shared_utils import format_nevra
 log = logging.getLogger(__name__)
 
 REPODATA_PATH = "repodata"
+PACKAGE_METADATA_TYPES = ("primary", "filelists", "other")
+# the package fields which the metadata is rendered from, except for those which are taken from the
+# PackageInfo of the package being published instead
+PACKAGE_METADATA_FIELDS = tuple(
+    field
+    for field in Package.createrepo_c_fields
+    if field not in ("checksum_type", "pkgId", "location_href")
+)
+# how often the pulp_last_updated timestamp of the PackageMetadataFragments in use is refreshed
+METADATA_FRAGMENT_REFRESH_INTERVAL = timedelta(days=1)
+# the (uncompressed) size of the chunks which package metadata files are compressed in by workers
+METADATA_CHUNK_SIZE = 4 * 1024 * 1024
 
 # lift dynaconf lookups outside of loops
 ALLOWED_CONTENT_CHECKSUMS = settings.ALLOWED_CONTENT_CHECKSUMS
 RPM_METADATA_USE_REPO_PACKAGE_TIME = settings.RPM_METADATA_USE_REPO_PACKAGE_TIME
+RPM_PUBLISH_INCREMENTAL = settings.RPM_PUBLISH_INCREMENTAL
+RPM_PUBLISH_METADATA_FRAGMENTS = settings.RPM_PUBLISH_METADATA_FRAGMENTS
+RPM_PUBLISH_METADATA_FRAGMENTS_MAX_AGE = settings.RPM_PUBLISH_METADATA_FRAGMENTS_MAX_AGE
+RPM_PUBLISH_WORKERS = settings.RPM_PUBLISH_WORKERS
+RPM_PUBLISH_SUBREPO_WORKERS = settings.RPM_PUBLISH_SUBREPO_WORKERS
 
 
 class PackageInfo(NamedTuple):
@@ -522,6 +548,379 @@ class PublicationData:
             setattr(self, f"{name}_packages", self.publish_artifacts(content, prefix=name))
 
 
+class ReusedPackages:
+    """
+    The packages of the package metadata of an earlier publication, parsed one at a time.
+
+    The packages are looked up by pkgId and location_href, in (roughly) the order in which they
+    appear in the metadata, so that only a few of them need to be held in memory at once.
+    """
+
+    def __init__(self, packages, keys):
+        """
+        Args:
+            packages (iterable): The createrepo_c packages, in the order of the metadata.
+            keys (set): The (pkgId, location_href) of the packages which are going to be looked up.
+        """
+        self._packages = iter(packages)
+        self._keys = keys
+        self._buffer = {}
+
+    def get(self, pkgId, location_href):
+        """
+        Get a package from the metadata.
+
+        Returns:
+            createrepo_c.Package: The package, or None if the metadata doesn't contain it.
+        """
+        key = (pkgId, location_href)
+        if key not in self._keys:
+            return None
+        if key in self._buffer:
+            return self._buffer.pop(key)
+        for package in self._packages:
+            package_key = (package.pkgId, package.location_href)
+            if package_key == key:
+                return package
+            if package_key in self._keys:
+                self._buffer[package_key] = package
+        return None
+
+    def discard(self, pkgId, location_href):
+        """
+        Stop looking for a package in the metadata, because it isn't going to be looked up.
+        """
+        key = (pkgId, location_href)
+        self._keys.discard(key)
+        self._buffer.pop(key, None)
+
+
+class BasePublication:
+    """
+    An earlier publication of the same repository, which an incremental publication copies the
+    unchanged repository metadata of.
+
+    Attributes:
+        publication (RpmPublication): The earlier publication.
+        changed_types (set): The pulp_types of the content added or removed since then.
+        added_packages (set): The ids of the packages added since then.
+        records (dict): The location_href of each of its metadata files, keyed by record type.
+    """
+
+    def __init__(self, publication, repository_version):
+        """
+        Args:
+            publication (RpmPublication): The earlier publication.
+            repository_version (RepositoryVersion): The repository version being published.
+        """
+        self.publication = publication
+        base_version = publication.repository_version
+        added = repository_version.added(base_version=base_version).order_by()
+        removed = repository_version.removed(base_version=base_version).order_by()
+        self.changed_types = set(added.values_list("pulp_type", flat=True).distinct())
+        self.changed_types.update(removed.values_list("pulp_type", flat=True).distinct())
+        self.added_packages = set(
+            added.filter(pulp_type=Package.get_pulp_type()).values_list("pk", flat=True)
+        )
+        self.directory = tempfile.mkdtemp(dir=".")
+        self.records = {}
+        self._paths = {}
+
+        repomd_path = self._fetch(os.path.join(REPODATA_PATH, "repomd.xml"))
+        if repomd_path:
+            repomd = cr.Repomd(repomd_path)
+            self.records = {record.type: record.location_href for record in repomd.records}
+
+    @classmethod
+    def find(cls, publication):
+        """
+        Find the latest earlier publication of the same repository with the same settings.
+
+        Args:
+            publication (RpmPublication): The publication being created.
+
+        Returns:
+            BasePublication: The earlier publication, or None if there is none.
+        """
+        repository_version = publication.repository_version
+        base_publication = (
+            RpmPublication.objects.filter(
+                repository_version__repository=repository_version.repository,
+                complete=True,
+                checksum_type=publication.checksum_type,
+                compression_type=publication.compression_type,
+                layout=publication.layout,
+            )
+            .exclude(pk=publication.pk)
+            .select_related("repository_version")
+            .order_by("-repository_version__number", "-pulp_created")
+            .first()
+        )
+        if not base_publication:
+            return None
+        log.info(
+            _("Reusing the metadata of publication {publication} (version {version})").format(
+                publication=base_publication.pk,
+                version=base_publication.repository_version.number,
+            )
+        )
+        return cls(base_publication, repository_version)
+
+    def _fetch(self, relative_path):
+        published_metadata = PublishedMetadata.objects.filter(
+            publication=self.publication, relative_path=relative_path
+        ).first()
+        if not published_metadata:
+            return None
+        artifact = published_metadata.contentartifact_set.get().artifact
+        path = os.path.join(self.directory, os.path.basename(relative_path))
+        artifact_file = artifact.pulp_domain.get_storage().open(artifact.file.name)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(artifact_file, f)
+        artifact_file.close()
+        return path
+
+    def fetch(self, record_type):
+        """
+        Copy a metadata file of the publication to the working directory.
+
+        Args:
+            record_type (str): The repomd record type of the file, e.g. "updateinfo".
+
+        Returns:
+            str: The path to the copy, or None if the publication has no such file.
+        """
+        if record_type not in self._paths:
+            location_href = self.records.get(record_type)
+            self._paths[record_type] = location_href and self._fetch(
+                os.path.join(REPODATA_PATH, os.path.basename(location_href))
+            )
+        return self._paths[record_type]
+
+    def changed(self, *models):
+        """
+        Whether content of any of the given types was added or removed since the publication.
+        """
+        return any(model.get_pulp_type() in self.changed_types for model in models)
+
+    def copy(self, record_type, path):
+        """
+        Copy a metadata file of the publication.
+
+        Args:
+            record_type (str): The repomd record type of the file, e.g. "updateinfo".
+            path (str): Where to copy it to.
+
+        Returns:
+            bool: Whether the publication has the file.
+        """
+        base_path = self.fetch(record_type)
+        if not base_path:
+            return False
+        shutil.copyfile(base_path, path)
+        return True
+
+    def package_keys(self):
+        """
+        Get the pkgId, location_href and time_file of the packages of the publication.
+
+        Returns:
+            dict: The time_file of each package, keyed by its (pkgId, location_href), or None if
+                the publication has no package metadata.
+        """
+        if not all(self.fetch(record_type) for record_type in PACKAGE_METADATA_TYPES):
+            return None
+        keys = {}
+
+        def pkgcb(pkg):
+            keys[(pkg.pkgId, pkg.location_href)] = pkg.time_file
+            return True
+
+        cr.xml_parse_primary(self.fetch("primary"), pkgcb=pkgcb, do_files=False)
+        return keys
+
+    def reused_packages(self, keys):
+        """
+        Parse the packages of the package metadata of the publication.
+
+        Args:
+            keys (set): The (pkgId, location_href) of the packages which are going to be reused.
+                All of them need to be in the metadata, or else the rest of it is parsed and
+                held in memory while looking for them.
+
+        Returns:
+            ReusedPackages: The packages.
+        """
+        packages = cr.PackageIterator(*(self.fetch(name) for name in PACKAGE_METADATA_TYPES))
+        return ReusedPackages(packages, keys)
+
+    def reuse_package_metadata(self, retained_packages, repo_pkg_times, metadata_files):
+        """
+        Reuse the package metadata of the publication for the packages being published.
+
+        If the same packages are published, the metadata files are copied as they are. Otherwise
+        the packages which were already published are parsed from them, instead of being rendered
+        again.
+
+        Args:
+            retained_packages (dict): The PackageInfo of the packages being published, keyed by
+                their ids.
+            repo_pkg_times (dict): The time the packages were added to the repository, keyed by
+                their ids, if it's used as their time_file.
+            metadata_files (dict): The paths of the package metadata files being written, keyed
+                by record type.
+
+        Returns:
+            tuple: Whether the metadata files were copied, and the ReusedPackages to parse the
+                rest of the packages from (or None).
+        """
+        base_package_keys = self.package_keys()
+        if base_package_keys is None:
+            return False, None
+        package_keys = {
+            (pkg_info.checksum, pkg_info.path): repo_pkg_times.get(pk)
+            for pk, pkg_info in retained_packages.items()
+        }
+        if not RPM_METADATA_USE_REPO_PACKAGE_TIME:
+            base_package_keys = dict.fromkeys(base_package_keys)
+
+        if base_package_keys == package_keys:
+            for name in PACKAGE_METADATA_TYPES:
+                self.copy(name, metadata_files[name])
+            return True, None
+        if not base_package_keys:
+            return False, None
+
+        keys = {
+            (pkg_info.checksum, pkg_info.path)
+            for pk, pkg_info in retained_packages.items()
+            if pk not in self.added_packages
+        }
+        return False, self.reused_packages(keys & base_package_keys.keys())
+
+
+def compress_metadata_chunk(path, compression_type):
+    """
+    Compress a chunk of a metadata file into a file of its own, and remove the uncompressed one.
+
+    Runs in a worker process.
+
+    Args:
+        path (str): The path of the uncompressed chunk.
+        compression_type (int): The createrepo_c compression type to compress it with.
+
+    Returns:
+        str: The path of the compressed chunk.
+    """
+    compressed_path = f"{path}.compressed"
+    cr.compress_file(path, compressed_path, compression_type)
+    os.unlink(path)
+    return compressed_path
+
+
+class ChunkedXmlFile:
+    """
+    A package metadata file, written like with the createrepo_c XmlFile classes, but compressed in
+    chunks by worker processes.
+
+    Gzip members and zstd frames can be concatenated, and are read back as one stream, so the
+    compressed chunks are appended to the file in order as they are done. The chunks are spooled
+    to `directory` while they wait for a worker.
+    """
+
+    def __init__(
+        self,
+        path,
+        xml_file_class,
+        compression_type,
+        num_of_pkgs,
+        executor,
+        workers,
+        directory,
+        chunk_size=METADATA_CHUNK_SIZE,
+    ):
+        """
+        Args:
+            path (str): The path of the metadata file.
+            xml_file_class (type): The createrepo_c XmlFile class of the metadata, e.g.
+                cr.PrimaryXmlFile, which the header and footer are taken from.
+            compression_type (int): The createrepo_c compression type of the file.
+            num_of_pkgs (int): The number of packages which are going to be written.
+            executor (concurrent.futures.Executor): The executor to compress the chunks in.
+            workers (int): The number of workers of the executor, which is also how many chunks
+                may be waiting for one at a time.
+            directory (str): The directory to spool the chunks to.
+            chunk_size (int): The uncompressed size of the chunks.
+        """
+        self._compression_type = compression_type
+        self._executor = executor
+        self._workers = workers
+        self._chunk_size = chunk_size
+        # without the extension, which createrepo_c would take the compression type from
+        self._chunk_prefix = os.path.join(directory, os.path.basename(path).split(".")[0])
+        self._chunk_number = 0
+        self._buffer = []
+        self._buffer_size = 0
+        self._pending = deque()
+        self._file = open(path, "wb")
+
+        empty_path = f"{self._chunk_prefix}.empty"
+        empty_file = xml_file_class(empty_path, compressiontype=cr.NO_COMPRESSION)
+        empty_file.set_num_of_pkgs(num_of_pkgs)
+        empty_file.close()
+        with open(empty_path, encoding="utf-8") as f:
+            empty = f.read()
+        os.unlink(empty_path)
+        footer_start = empty.rindex("</")
+        self._footer = empty[footer_start:]
+        # The header is submitted right away, which also starts all of the workers of a forked
+        # executor - they can't be forked anymore once other threads are running.
+        self.add_chunk(empty[:footer_start])
+        self._flush()
+
+    def add_chunk(self, chunk):
+        """
+        Add the XML snippet of a package to the file.
+        """
+        self._buffer.append(chunk)
+        self._buffer_size += len(chunk)
+        if self._buffer_size >= self._chunk_size:
+            self._flush()
+
+    def close(self):
+        """
+        Add the footer, and wait for all of the chunks to be appended to the file.
+        """
+        self.add_chunk(self._footer)
+        self._flush()
+        while self._pending:
+            self._append(self._pending.popleft().result())
+        self._file.close()
+
+    def _flush(self):
+        chunk_path = f"{self._chunk_prefix}.{self._chunk_number}"
+        self._chunk_number += 1
+        with open(chunk_path, "w", encoding="utf-8") as f:
+            f.writelines(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+        if self._compression_type == cr.NO_COMPRESSION:
+            self._append(chunk_path)
+            return
+
+        self._pending.append(
+            self._executor.submit(compress_metadata_chunk, chunk_path, self._compression_type)
+        )
+        # don't let the chunks pile up if the workers can't keep up
+        while self._pending and (self._pending[0].done() or len(self._pending) > self._workers):
+            self._append(self._pending.popleft().result())
+
+    def _append(self, chunk_path):
+        with open(chunk_path, "rb") as chunk:
+            shutil.copyfileobj(chunk, self._file)
+        os.unlink(chunk_path)
+
+
 def get_checksum_type(checksum_types, default=CHECKSUM_TYPES.SHA256):
     """
     Get checksum algorithm for publishing metadata.
@@ -610,6 +1009,10 @@ def publish(
             publication_data = PublicationData(publication, checksum_types)
             publication_data.populate()
 
+            base_publication = None
+            if RPM_PUBLISH_INCREMENTAL:
+                base_publication = BasePublication.find(publication)
+
             total_repos = 1 + len(publication_data.sub_repos)
             pb_data = dict(
                 message="Generating repository metadata",
@@ -620,7 +1023,7 @@ def publish(
                 content = publication.repository_version.content
 
                 # Main repo
-                generate_repo_metadata(
+                published_files = generate_repo_metadata(
                     content,
                     publication,
                     checksum_types,
@@ -628,33 +1031,384 @@ def publish(
                     metadata_signing_service=metadata_signing_service,
                     compression_type=compression_type,
                     retained_packages=publication_data.packages,
+                    base_publication=base_publication,
                 )
+                publish_repo_metadata(publication, published_files)
                 publish_pb.increment()
 
+                sub_repo_args = []
                 for sub_repo in publication_data.sub_repos:
                     name = sub_repo[0]
-                    content = getattr(publication_data, f"{name}_content")
-                    extra_repomdrecords = getattr(publication_data, f"{name}_repomdrecords")
-                    packages = getattr(publication_data, f"{name}_packages")
-                    generate_repo_metadata(
-                        content,
-                        publication,
-                        checksum_types,
-                        extra_repomdrecords,
-                        name,
-                        metadata_signing_service=metadata_signing_service,
-                        compression_type=compression_type,
-                        retained_packages=packages,
+                    sub_repo_args.append(
+                        (
+                            getattr(publication_data, f"{name}_content"),
+                            publication,
+                            checksum_types,
+                            getattr(publication_data, f"{name}_repomdrecords"),
+                            name,
+                            metadata_signing_service,
+                            compression_type,
+                            getattr(publication_data, f"{name}_packages"),
+                        )
                     )
-                    publish_pb.increment()
+
+                sub_repo_files = generate_sub_repos_metadata(sub_repo_args, publish_pb)
+                for published_files in sub_repo_files:
+                    publish_repo_metadata(publication, published_files)
 
             log.info(_("Publication: {publication} created").format(publication=publication.pk))
+            if RPM_PUBLISH_METADATA_FRAGMENTS:
+                prune_metadata_fragments()
             serialized_pub = RpmPublicationSerializer(
                 instance=publication, context={"request": None}
             ).data
             return serialized_pub
 
 
+def iter_package_metadata(content, retained_packages, package_times=None, reused_packages=None):
+    """
+    Render the packages to publish, in the order of the package metadata.
+
+    The snippets of a package are taken from the PackageMetadataFragment stored when it was last
+    published the same way, if there is one. Otherwise the package is taken from
+    `reused_packages`, or converted from the database, and rendered, and its snippets are stored
+    for the next publications.
+
+    Args:
+        content(app.models.Content): A DB Content set of all original artifacts in the publication.
+        retained_packages(dict): A dictionary of content_id to PackageInfo for the packages which
+            should be included in the repository metadata.
+        package_times(dict): The time_file to publish each package with, keyed by content_id, if
+            it's overridden.
+        reused_packages(ReusedPackages): Packages of an earlier publication, which are used instead
+            of converting the ones in the database wherever they are found.
+
+    Yields:
+        tuple: The primary.xml, filelists.xml and other.xml snippets of each package.
+    """
+    package_times = package_times or {}
+    pks = [
+        pk
+        for pk in Package.objects.filter(pk__in=content)
+        .order_by("name", "evr")
+        .values_list("pk", flat=True)
+        .iterator(chunk_size=2000)
+        if pk in retained_packages
+    ]
+    for start in range(0, len(pks), 200):
+        batch = pks[start : start + 200]
+        digests = {}
+        fragments = {}
+        if RPM_PUBLISH_METADATA_FRAGMENTS:
+            for pk in batch:
+                pkg_info = retained_packages[pk]
+                digests[pk] = PackageMetadataFragment.calculate_digest(
+                    pk,
+                    pkg_info.checksum_type,
+                    pkg_info.checksum,
+                    pkg_info.path,
+                    package_times.get(pk),
+                )
+            now = timezone.now()
+            stale = []
+            rows = PackageMetadataFragment.objects.filter(digest__in=digests.values()).values_list(
+                "digest", "primary", "filelists", "other", "pulp_last_updated"
+            )
+            for digest, primary, filelists, other, last_updated in rows:
+                fragments[digest] = (primary, filelists, other)
+                if last_updated is None or last_updated < now - METADATA_FRAGMENT_REFRESH_INTERVAL:
+                    stale.append(digest)
+            if stale:
+                # keep the fragments which are still published from being pruned
+                PackageMetadataFragment.objects.filter(digest__in=stale).update(
+                    pulp_last_updated=now
+                )
+
+        pkgs = {}
+        for pk in batch:
+            pkg_info = retained_packages[pk]
+            if digests.get(pk) in fragments:
+                if reused_packages:
+                    reused_packages.discard(pkg_info.checksum, pkg_info.path)
+            elif reused_packages:
+                pkg = reused_packages.get(pkg_info.checksum, pkg_info.path)
+                if pkg is not None:
+                    pkgs[pk] = pkg
+        missing = [pk for pk in batch if pk not in pkgs and digests.get(pk) not in fragments]
+        if missing:
+            # only the columns which are rendered are fetched, and no models are instantiated
+            rows = Package.objects.filter(pk__in=missing).values("pk", *PACKAGE_METADATA_FIELDS)
+            for row in rows.iterator():
+                pk = row.pop("pk")
+                pkgs[pk] = Package.values_to_createrepo_c(row)
+
+        new_fragments = []
+        for pk in batch:
+            digest = digests.get(pk)
+            if digest in fragments:
+                yield fragments[digest]
+                continue
+
+            # rewrite these fields with the desired ones
+            pkg = pkgs[pk]
+            retained_pkg_info = retained_packages[pk]
+            pkg.checksum_type = retained_pkg_info.checksum_type
+            pkg.pkgId = retained_pkg_info.checksum
+            pkg.location_href = retained_pkg_info.path
+            if pk in package_times:
+                pkg.time_file = package_times[pk]
+
+            primary, filelists, other = cr.xml_dump(pkg)
+            if digest:
+                new_fragments.append(
+                    PackageMetadataFragment(
+                        digest=digest,
+                        package_id=pk,
+                        primary=primary,
+                        filelists=filelists,
+                        other=other,
+                    )
+                )
+            yield primary, filelists, other
+        if new_fragments:
+            PackageMetadataFragment.objects.bulk_create(new_fragments, ignore_conflicts=True)
+
+
+def prune_metadata_fragments():
+    """
+    Delete the PackageMetadataFragments which haven't been published for a while.
+
+    The fragments in use are refreshed by every publication, so only those of packages which
+    haven't been published the same way for `RPM_PUBLISH_METADATA_FRAGMENTS_MAX_AGE` days, e.g.
+    because the repositories which published them have moved on, are deleted.
+
+    Returns:
+        int: The number of fragments deleted
+    """
+    max_age = timedelta(days=RPM_PUBLISH_METADATA_FRAGMENTS_MAX_AGE)
+    deleted, _details = PackageMetadataFragment.objects.filter(
+        pulp_last_updated__lt=timezone.now() - max_age
+    ).delete()
+    if deleted:
+        log.debug(_("Pruned {} unused package metadata fragments.").format(deleted))
+    return deleted
+
+
+def write_package_metadata(package_writers, package_snippets):
+    """
+    Write the primary.xml, filelists.xml and other.xml snippets of the packages, and close the
+    files.
+
+    Args:
+        package_writers (list): The primary.xml, filelists.xml and other.xml files.
+        package_snippets (iterable): The snippets of each package, as yielded by
+            iter_package_metadata().
+    """
+    for snippets in package_snippets:
+        for package_writer, snippet in zip(package_writers, snippets):
+            package_writer.add_chunk(snippet)
+    for package_writer in package_writers:
+        package_writer.close()
+
+
+def write_updateinfo(content, path, cr_compression_type, base_publication=None):
+    """
+    Write the updateinfo.xml of the advisories in the publication.
+
+    Args:
+        content(app.models.Content): A DB Content set of all original artifacts in the publication.
+        path(str): The path to write the updateinfo.xml to.
+        cr_compression_type(int): The createrepo_c compression type to compress it with.
+        base_publication(BasePublication): An earlier publication to copy it from, if no
+            advisories were added or removed since then.
+
+    Returns:
+        bool: Whether the file was written, i.e. whether there are any advisories.
+    """
+    if base_publication and not base_publication.changed(UpdateRecord):
+        return base_publication.copy("updateinfo", path)
+
+    update_records = UpdateRecord.objects.filter(pk__in=content).order_by("id", "digest")
+    if not update_records.exists():
+        return False
+    updateinfo = cr.UpdateInfoXmlFile(path, compressiontype=cr_compression_type)
+    for update_record in update_records.iterator():
+        updateinfo.add_chunk(cr.xml_dump_updaterecord(update_record.to_createrepo_c()))
+    updateinfo.close()
+    return True
+
+
+def write_modules_yaml(content, path, base_publication=None):
+    """
+    Write the modules.yaml of the modulemds, modulemd defaults and obsoletes in the publication.
+
+    Args:
+        content(app.models.Content): A DB Content set of all original artifacts in the publication.
+        path(str): The path to write the modules.yaml to.
+        base_publication(BasePublication): An earlier publication to copy it from, if no modular
+            content was added or removed since then.
+
+    Returns:
+        bool: Whether the file was written, i.e. whether there is any modular content.
+    """
+    if base_publication and not base_publication.changed(
+        Modulemd, ModulemdDefaults, ModulemdObsolete
+    ):
+        return base_publication.copy("modules", path)
+
+    has_modules = False
+    with open(path, "ab") as mod_yml:
+        for model in (Modulemd, ModulemdDefaults, ModulemdObsolete):
+            objects = model.objects.filter(pk__in=content).order_by(*model.natural_key_fields())
+            for obj in objects.iterator():
+                mod_yml.write(obj.snippet.encode())
+                mod_yml.write(b"\n")
+                has_modules = True
+    return has_modules
+
+
+def write_comps_xml(content, path, base_publication=None):
+    """
+    Write the comps.xml of the package groups, categories, environments and langpacks in the
+    publication.
+
+    Args:
+        content(app.models.Content): A DB Content set of all original artifacts in the publication.
+        path(str): The path to write the comps.xml to.
+        base_publication(BasePublication): An earlier publication to copy it from, if no comps
+            content was added or removed since then.
+
+    Returns:
+        bool: Whether the file was written, i.e. whether there is any comps content.
+    """
+    if base_publication and not base_publication.changed(
+        PackageGroup, PackageCategory, PackageEnvironment, PackageLangpacks
+    ):
+        return base_publication.copy("group", path)
+
+    has_comps = False
+    comps = libcomps.Comps()
+    for pkg_grp in PackageGroup.objects.filter(pk__in=content).order_by("id").iterator():
+        group = pkg_grp.pkg_grp_to_libcomps()
+        comps.groups.append(group)
+        has_comps = True
+    for pkg_cat in PackageCategory.objects.filter(pk__in=content).order_by("id").iterator():
+        cat = pkg_cat.pkg_cat_to_libcomps()
+        comps.categories.append(cat)
+        has_comps = True
+    for pkg_env in PackageEnvironment.objects.filter(pk__in=content).order_by("id").iterator():
+        env = pkg_env.pkg_env_to_libcomps()
+        comps.environments.append(env)
+        has_comps = True
+    package_langpacks = PackageLangpacks.objects.filter(pk__in=content).order_by(
+        *PackageLangpacks.natural_key_fields()
+    )
+    for pkg_lng in package_langpacks.iterator():
+        comps.langpacks = dict_to_strdict(pkg_lng.matches)
+        has_comps = True
+
+    comps.toxml_f(
+        path,
+        xml_options={
+            "default_explicit": True,
+            "empty_groups": True,
+            "empty_packages": True,
+            "uservisible_explicit": True,
+        },
+    )
+    return has_comps
+
+
+def call_closing_connection(func):
+    """
+    Call a function in a thread, and close the thread's database connection afterwards.
+
+    Django opens a separate connection for each thread which uses the database, which would
+    otherwise be left open once the thread is done.
+    """
+    try:
+        return func()
+    finally:
+        connection.close()
+
+
+def detach_database_connections():
+    """
+    Make a forked worker process open database connections of its own.
+
+    The connections inherited from the task are dropped rather than closed, which would end the
+    sessions of the task as well.
+    """
+    for conn in connections.all(initialized_only=True):
+        conn.connection = None
+
+
+def generate_sub_repo_metadata(content_query, *args):
+    """
+    Write the repository metadata of a sub-repo in a worker process.
+
+    The content is passed as its query, because pickling a QuerySet would evaluate it.
+
+    Args:
+        content_query(django.db.models.sql.Query): The query of the content of the sub-repo.
+        args: The rest of the arguments of generate_repo_metadata().
+
+    Returns:
+        list: The (relative_path, path) of each of the files to add to the publication.
+    """
+    content = Content.objects.all()
+    content.query = content_query
+    return call_closing_connection(partial(generate_repo_metadata, content, *args))
+
+
+def generate_sub_repos_metadata(sub_repo_args, progress_report):
+    """
+    Write the repository metadata of the sub-repos of a distribution tree.
+
+    With `RPM_PUBLISH_SUBREPO_WORKERS` and more than one sub-repo, the sub-repos are written in
+    forked worker processes, each of which opens database connections of its own. The connections
+    of the task are left open and untouched. The workers can't see what the task hasn't committed
+    yet though, so when publishing within a transaction the sub-repos are written by the task
+    itself, one after another, just like when there's a single sub-repo or a single worker.
+
+    Args:
+        sub_repo_args(list): The arguments of generate_repo_metadata() for each sub-repo.
+        progress_report(pulpcore.plugin.models.ProgressReport): The progress report to increment
+            as each sub-repo is done.
+
+    Returns:
+        list: The (relative_path, path) of each of the files to add to the publication, for each
+            sub-repo.
+    """
+    if (
+        RPM_PUBLISH_SUBREPO_WORKERS > 1
+        and len(sub_repo_args) > 1
+        and not connection.in_atomic_block
+    ):
+        # The workers rely on Django having been set up already, so they need to be forked. They
+        # can't share the database connections of the task though, so they drop the ones they
+        # inherit, and open connections of their own.
+        with ProcessPoolExecutor(
+            max_workers=min(RPM_PUBLISH_SUBREPO_WORKERS, len(sub_repo_args)),
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=detach_database_connections,
+        ) as executor:
+            futures = [
+                executor.submit(generate_sub_repo_metadata, content.query, *args)
+                for content, *args in sub_repo_args
+            ]
+            for future in as_completed(futures):
+                future.result()
+                progress_report.increment()
+        return [future.result() for future in futures]
+
+    sub_repo_files = []
+    for args in sub_repo_args:
+        sub_repo_files.append(generate_repo_metadata(*args))
+        progress_report.increment()
+    return sub_repo_files
+
+
 def generate_repo_metadata(
     content,
     publication,
@@ -664,10 +1418,14 @@ def generate_repo_metadata(
     metadata_signing_service=None,
     compression_type=COMPRESSION_TYPES.GZ,
     retained_packages: dict[UUID, PackageInfo] = {},
+    base_publication=None,
 ):
     """
     Creates a repomd.xml file.
 
+    The metadata files are only written to the working directory, and need to be added to the
+    publication with publish_repo_metadata().
+
     Args:
         content(app.models.Content): A DB Content set of all original artifacts in the publication.
         publication(pulpcore.plugin.models.Publication): the publication
@@ -680,19 +1438,22 @@ def generate_repo_metadata(
         retained_packages(dict):
             A dictionary of content_id to PackageInfo for packages that should actually be included
             in the repository metadata. Will be used to filter `content` and add additional info.
+        base_publication(BasePublication):
+            An earlier publication of the same repository. The metadata of the types of content
+            which didn't change since then is copied from it, and so are the packages which are
+            still published.
+
+    Returns:
+        list: The (relative_path, path) of each of the files to add to the publication.
 
     """
-    cwd = os.getcwd()
     repodata_path = REPODATA_PATH
-    has_modules = False
-    has_comps = False
     requested_checksum_type = get_checksum_type(checksum_types)
 
     if requested_checksum_type not in ALLOWED_CONTENT_CHECKSUMS:
         raise ForbiddenChecksumTypeError(requested_checksum_type, ALLOWED_CHECKSUM_ERROR_MSG)
 
     if sub_folder:
-        cwd = os.path.join(cwd, sub_folder)
         repodata_path = os.path.join(sub_folder, repodata_path)
 
     # Prepare metadata files
@@ -705,6 +1466,7 @@ def generate_repo_metadata(
         cr_compression_type = cr.GZ
     total_packages = len(retained_packages)
 
+    repo_pkg_times = {}
     if RPM_METADATA_USE_REPO_PACKAGE_TIME:
         # gather the times the packages were added to the repo
         repo_content = (
@@ -715,119 +1477,128 @@ def generate_repo_metadata(
             .exclude(version_removed__number__lte=publication.repository_version.number)
             .values_list("content", "pulp_created")
         )
-        repo_pkg_times = {pk: created.timestamp() for pk, created in repo_content}
+        repo_pkg_times = {pk: int(created.timestamp()) for pk, created in repo_content}
 
     repomd_path = os.path.join(repodata_path, "repomd.xml")
-    mod_yml_path = os.path.join(repodata_path, "modules.yaml")
-    comps_xml_path = os.path.join(repodata_path, "comps.xml")
 
     cr_checksum_type = cr_checksum_type_from_string(publication.checksum_type)
+    compression_suffix = cr.compression_suffix(cr_compression_type) or ""
+    os.makedirs(repodata_path, exist_ok=True)
+    # the metadata files to list in repomd.xml, keyed by record type
+    metadata_files = {}
 
     # Process all packages
-    with cr.RepositoryWriter(
-        cwd, compression=cr_compression_type, checksum_type=cr_checksum_type
-    ) as writer:
-        writer.set_num_of_pkgs(total_packages)
-
-        # If the repository is empty, use a revision of 0
-        # See: https://pulp.plan.io/issues/9402
-        if not content.exists():
-            writer.repomd.revision = "0"
-        for package in (
-            Package.objects.filter(pk__in=content).order_by("name", "evr").iterator(chunk_size=200)
-        ):
-            if package.pk not in retained_packages:
-                continue
-            pkg = package.to_createrepo_c()
-
-            # rewrite these fields with the desired ones
-            retained_pkg_info = retained_packages[package.pk]
-            pkg.checksum_type = retained_pkg_info.checksum_type
-            pkg.pkgId = retained_pkg_info.checksum
-            pkg.location_href = retained_pkg_info.path
-
-            if RPM_METADATA_USE_REPO_PACKAGE_TIME:
-                pkg.time_file = repo_pkg_times[package.pk]
-
-            writer.add_pkg(pkg)
-
-        # Process update records
-        update_records = UpdateRecord.objects.filter(pk__in=content).order_by("id", "digest")
-        for update_record in update_records.iterator():
-            writer.add_update_record(update_record.to_createrepo_c())
-
-        # Process modulemd, modulemd_defaults and obsoletes
-        with open(mod_yml_path, "ab") as mod_yml:
-            modulemds = Modulemd.objects.filter(pk__in=content).order_by(
-                *Modulemd.natural_key_fields()
-            )
-            for modulemd in modulemds.iterator():
-                mod_yml.write(modulemd.snippet.encode())
-                mod_yml.write(b"\n")
-                has_modules = True
-            modulemd_defaults = ModulemdDefaults.objects.filter(pk__in=content).order_by(
-                *ModulemdDefaults.natural_key_fields()
-            )
-            for default in modulemd_defaults.iterator():
-                mod_yml.write(default.snippet.encode())
-                mod_yml.write(b"\n")
-                has_modules = True
-            modulemd_obsoletes = ModulemdObsolete.objects.filter(pk__in=content).order_by(
-                *ModulemdObsolete.natural_key_fields()
-            )
-            for obsolete in modulemd_obsoletes.iterator():
-                mod_yml.write(obsolete.snippet.encode())
-                mod_yml.write(b"\n")
-                has_modules = True
-
-        # Process comps
-        comps = libcomps.Comps()
-        for pkg_grp in PackageGroup.objects.filter(pk__in=content).order_by("id").iterator():
-            group = pkg_grp.pkg_grp_to_libcomps()
-            comps.groups.append(group)
-            has_comps = True
-        for pkg_cat in PackageCategory.objects.filter(pk__in=content).order_by("id").iterator():
-            cat = pkg_cat.pkg_cat_to_libcomps()
-            comps.categories.append(cat)
-            has_comps = True
-        for pkg_env in PackageEnvironment.objects.filter(pk__in=content).order_by("id").iterator():
-            env = pkg_env.pkg_env_to_libcomps()
-            comps.environments.append(env)
-            has_comps = True
-        package_langpacks = PackageLangpacks.objects.filter(pk__in=content).order_by(
-            *PackageLangpacks.natural_key_fields()
-        )
-        for pkg_lng in package_langpacks.iterator():
-            comps.langpacks = dict_to_strdict(pkg_lng.matches)
-            has_comps = True
-
-        comps.toxml_f(
-            comps_xml_path,
-            xml_options={
-                "default_explicit": True,
-                "empty_groups": True,
-                "empty_packages": True,
-                "uservisible_explicit": True,
-            },
+    for name in PACKAGE_METADATA_TYPES:
+        metadata_files[name] = os.path.join(repodata_path, f"{name}.xml{compression_suffix}")
+
+    reused_packages = None
+    copy_package_metadata = False
+    if base_publication:
+        copy_package_metadata, reused_packages = base_publication.reuse_package_metadata(
+            retained_packages, repo_pkg_times, metadata_files
         )
 
-        if has_modules:
-            writer.add_repomd_metadata("modules", mod_yml_path, use_compression=False)
-
-        if has_comps:
-            writer.add_repomd_metadata("group", comps_xml_path, use_compression=False)
-
-        for name, record in extra_repomdrecords:
-            writer.add_repomd_metadata(name, record)
+    package_xml_classes = (cr.PrimaryXmlFile, cr.FilelistsXmlFile, cr.OtherXmlFile)
+    package_snippets = iter_package_metadata(
+        content, retained_packages, repo_pkg_times, reused_packages
+    )
 
-    for record in writer.repomd.records:
+    # Process update records, modulemd, modulemd_defaults and obsoletes, and comps
+    other_paths = {
+        "updateinfo": os.path.join(repodata_path, f"updateinfo.xml{compression_suffix}"),
+        "modules": os.path.join(repodata_path, "modules.yaml"),
+        "group": os.path.join(repodata_path, "comps.xml"),
+    }
+    other_writers = {
+        "updateinfo": partial(
+            write_updateinfo,
+            content,
+            other_paths["updateinfo"],
+            cr_compression_type,
+            base_publication,
+        ),
+        "modules": partial(write_modules_yaml, content, other_paths["modules"], base_publication),
+        "group": partial(write_comps_xml, content, other_paths["group"], base_publication),
+    }
+
+    if RPM_PUBLISH_WORKERS > 1:
+        # The package metadata is compressed in chunks by worker processes, while the rest of the
+        # metadata is generated in threads. The workers rely on Django having been set up already,
+        # so they need to be forked. They don't use the database.
+        with (
+            ProcessPoolExecutor(
+                max_workers=RPM_PUBLISH_WORKERS, mp_context=multiprocessing.get_context("fork")
+            ) as executor,
+            ThreadPoolExecutor(max_workers=len(other_writers)) as thread_executor,
+            tempfile.TemporaryDirectory(dir=".") as tmp_dir,
+        ):
+            package_writers = []
+            if not copy_package_metadata:
+                # The writers start the workers, so they need to be created before the threads
+                package_writers = [
+                    ChunkedXmlFile(
+                        metadata_files[name],
+                        xml_file_class,
+                        cr_compression_type,
+                        total_packages,
+                        executor,
+                        RPM_PUBLISH_WORKERS,
+                        tmp_dir,
+                    )
+                    for name, xml_file_class in zip(PACKAGE_METADATA_TYPES, package_xml_classes)
+                ]
+            # The threads use database connections of their own, which can't see what the task
+            # hasn't committed yet, so when publishing within a transaction (e.g. when copying
+            # content to an autopublished repository) the rest of the metadata is written by
+            # the task itself.
+            threaded_writers = {} if connection.in_atomic_block else other_writers
+            other_futures = {
+                name: thread_executor.submit(call_closing_connection, writer)
+                for name, writer in threaded_writers.items()
+            }
+            if package_writers:
+                write_package_metadata(package_writers, package_snippets)
+            written = {
+                name: other_futures[name].result() if name in other_futures else writer()
+                for name, writer in other_writers.items()
+            }
+    else:
+        if not copy_package_metadata:
+            package_writers = [
+                xml_file_class(metadata_files[name], compressiontype=cr_compression_type)
+                for name, xml_file_class in zip(PACKAGE_METADATA_TYPES, package_xml_classes)
+            ]
+            for package_writer in package_writers:
+                package_writer.set_num_of_pkgs(total_packages)
+            write_package_metadata(package_writers, package_snippets)
+        written = {name: writer() for name, writer in other_writers.items()}
+
+    for name, path in other_paths.items():
+        if written[name]:
+            metadata_files[name] = path
+
+    for name, record in extra_repomdrecords:
+        path = os.path.join(repodata_path, os.path.basename(record) + compression_suffix)
+        cr.compress_file(record, path, cr_compression_type)
+        metadata_files[name] = path
+
+    repomd = cr.Repomd()
+    # If the repository is empty, use a revision of 0
+    # See: https://pulp.plan.io/issues/9402
+    if not content.exists():
+        repomd.revision = "0"
+    for name, path in metadata_files.items():
+        record = cr.RepomdRecord(name, path)
+        record.fill(cr_checksum_type)
+        record.rename_file()
+        repomd.set_record(record)
+    with open(repomd_path, "w") as repomd_xml_file:
+        repomd_xml_file.write(repomd.xml_dump())
+
+    published_files = []
+    for record in repomd.records:
         path = os.path.join(repodata_path, os.path.basename(record.location_href))
-        with open(path, "rb") as repodata_fd:
-            PublishedMetadata.create_from_file(
-                relative_path=path,
-                publication=publication,
-                file=File(repodata_fd),
-            )
+        published_files.append((path, path))
 
     if metadata_signing_service:
         signing_service = AsciiArmoredDetachedSigningService.objects.get(
@@ -841,41 +1612,33 @@ def generate_repo_metadata(
             log.error(f"{signature_file_path} is 0 bytes! sign_results: {sign_results}")
             raise MetadataSigningError("Signature file is 0 bytes")
 
-        # publish a signed file
-        with open(sign_results["file"], "rb") as signed_file_fd:
-            PublishedMetadata.create_from_file(
-                relative_path=os.path.join(repodata_path, os.path.basename(sign_results["file"])),
-                publication=publication,
-                file=File(signed_file_fd),
-            )
-
-        # publish a detached signature
-        with open(sign_results["signature"], "rb") as signature_fd:
-            PublishedMetadata.create_from_file(
-                relative_path=os.path.join(
-                    repodata_path, os.path.basename(sign_results["signature"])
-                ),
-                publication=publication,
-                file=File(signature_fd),
+        # publish a signed file and a detached signature
+        for signed_path in [sign_results["file"], sign_results["signature"]]:
+            published_files.append(
+                (os.path.join(repodata_path, os.path.basename(signed_path)), signed_path)
             )
 
         # publish a public key required for further verification
-        pubkey_name = "repomd.xml.key"
-        with open(pubkey_name, "wb+") as f:
+        pubkey_path = os.path.join(repodata_path, "repomd.xml.key")
+        with open(pubkey_path, "wb") as f:
             f.write(signing_service.public_key.encode("utf-8"))
-            f.flush()
-            # important! as the file has already been opened and used, it will be treated as a
-            # cursor and when calculating the checksum it will calculate the checksum of nothing.
-            f.seek(0)
-            PublishedMetadata.create_from_file(
-                relative_path=os.path.join(repodata_path, pubkey_name),
-                publication=publication,
-                file=File(f),
-            )
+        published_files.append((pubkey_path, pubkey_path))
     else:
-        with open(repomd_path, "rb") as repomd_fd:
+        published_files.append((repomd_path, repomd_path))
+
+    return published_files
+
+
+def publish_repo_metadata(publication, published_files):
+    """
+    Add the repository metadata files written by generate_repo_metadata() to the publication.
+
+    Args:
+        publication(pulpcore.plugin.models.Publication): the publication
+        published_files(list): The (relative_path, path) of each of the files to add.
+    """
+    for relative_path, path in published_files:
+        with open(path, "rb") as fd:
             PublishedMetadata.create_from_file(
-                relative_path=os.path.join(repodata_path, os.path.basename(repomd_path)),
-                publication=publication,
-                file=File(repomd_fd),
+                relative_path=relative_path, publication=publication, file=File(fd)
             )
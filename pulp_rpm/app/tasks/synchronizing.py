@@ -1,18 +1,27 @@
+import array
 import asyncio
 import collections
+import contextlib
 import functools
 import json
 import logging
+import mmap
+import multiprocessing
 import os
+import pickle
 import re
+import shutil
+import sqlite3
 import tempfile
+import time
 import uuid
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from gettext import gettext as _  # noqa:F401
 
 import createrepo_c as cr
 import libcomps
-from aiohttp.client_exceptions import ClientResponseError
+from aiohttp.client_exceptions import ClientError, ClientResponseError
 from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
@@ -21,6 +30,7 @@ from django.db import transaction
 from django.db.models import Q
 from rpm_rs import Evr
 
+from pulpcore.plugin.constants import TASK_STATES
 from pulpcore.plugin.exceptions import SyncError
 from pulpcore.plugin.models import (
     Artifact,
@@ -29,21 +39,27 @@ from pulpcore.plugin.models import (
     PublishedArtifact,
     PublishedMetadata,
     Remote,
+    Task,
+    TaskGroup,
 )
 from pulpcore.plugin.stages import (
     ACSArtifactHandler,
     ArtifactDownloader,
     ArtifactResourceBudget,
     ArtifactSaver,
+    ContentAssociation,
     ContentSaver,
     DeclarativeArtifact,
     DeclarativeContent,
     DeclarativeVersion,
+    EndStage,
     QueryExistingArtifacts,
     QueryExistingContents,
     RemoteArtifactSaver,
     Stage,
+    create_pipeline,
 )
+from pulpcore.plugin.tasking import dispatch
 from pulpcore.plugin.util import get_domain
 
 from pulp_rpm.app.advisory import hash_update_record
@@ -56,9 +72,11 @@ from pulp_rpm.app.constants import (
     PACKAGE_DB_REPODATA,
     PACKAGE_REPODATA,
     PULP_MODULE_ATTR,
+    PULP_PACKAGE_ATTRS,
     SYNC_POLICIES,
     UPDATE_REPODATA,
 )
+from pulp_rpm.app.downloaders import NotModified
 from pulp_rpm.app.exceptions import (
     MirrorIncompatibleRepositoryError,
     MissingPrimaryMetadataError,
@@ -66,6 +84,7 @@ from pulp_rpm.app.exceptions import (
     UnsupportedModularCompressionError,
 )
 from pulp_rpm.app.kickstart.treeinfo import PulpTreeInfo, TreeinfoData
+from pulp_rpm.app.metadata_cache import MetadataCache
 from pulp_rpm.app.models import (
     Addon,
     Checksum,
@@ -92,23 +111,16 @@ from pulp_rpm.app.models import (
 )
 from pulp_rpm.app.modulemd import parse_modular
 from pulp_rpm.app.shared_utils import (
+    extract_signing_keys_from_header,
     get_sha256,
     is_previous_version,
     urlpath_sanitize,
 )
+from pulp_rpm.app.zchunk import ZchunkError, download_zchunk_delta
 
 log = logging.getLogger(__name__)
 
 
-# TODO: https://pulp.plan.io/issues/8687
-# A global dictionary for storing data about the remote's metadata files, used for mirroring
-# Indexed by repository.pk due to sub-repos.
-metadata_files_for_mirroring = collections.defaultdict(dict)
-# A global dictionary for storing data mapping pkgid to location_href for all packages, used
-# for mirroring. Indexed by repository.pk due to sub-repos.
-pkgid_to_location_href = collections.defaultdict(functools.partial(collections.defaultdict, set))
-
-
 MIRROR_INCOMPATIBLE_REPO_ERR_MSG = (
     "This repository uses features which are incompatible with 'mirror' sync. "
     "Please sync without mirroring enabled."
@@ -123,50 +135,167 @@ DUPLICATE_WARN_MSG = (
 
 # lift dynaconf lookups outside of loops
 ALLOWED_CONTENT_CHECKSUMS = settings.ALLOWED_CONTENT_CHECKSUMS
+DELTA_PARSE_MAX_NEW_PACKAGES = settings.RPM_SYNC_DELTA_PARSE_MAX_NEW_PACKAGES
+PARSE_WORKERS = settings.RPM_SYNC_PARSE_WORKERS
+SUBREPO_CONCURRENCY = settings.RPM_SYNC_SUBREPO_CONCURRENCY
+ZCHUNK_METADATA = settings.RPM_SYNC_ZCHUNK_METADATA
+EXTRACT_SIGNING_KEYS = settings.RPM_SYNC_EXTRACT_SIGNING_KEYS
+# How many pkgIds to look up in the domain with a single query
+PACKAGE_LOOKUP_BATCH_SIZE = 1000
+# How many published artifacts of a mirrored publication to save with a single query
+PUBLISHED_ARTIFACT_BATCH_SIZE = 2000
+# How many mirrors from a mirrorlist to probe at the same time
+MIRRORLIST_PROBE_CONCURRENCY = 8
+# How many of the fastest mirrors from a mirrorlist packages can be downloaded from
+MIRRORLIST_FAILOVER_MIRRORS = 3
 
 # sentinel
 ALREADY_SEEN = object()
 
+# Groups of repomd records which are synced (or carried forward from the previous sync) together,
+# along with the content types which are parsed from them
+INCREMENTAL_SYNC_RECORD_GROUPS = (
+    (*PACKAGE_REPODATA, *MODULAR_REPODATA),
+    tuple(UPDATE_REPODATA),
+    tuple(COMPS_REPODATA),
+)
 
-def store_metadata_for_mirroring(repo, md_path, relative_path):
-    """Used to store data about the downloaded metadata for mirror-publishing after the sync.
 
-    Args:
-        repo: Which repository the metadata is associated with
-        md_path: The path to the metadata file
-        relative_path: The relative path to the metadata file within the repository
+class MirroringStore:
     """
-    global metadata_files_for_mirroring
-    metadata_files_for_mirroring[str(repo.pk)][relative_path] = md_path
+    Bookkeeping about the metadata files and packages of the repositories synced by a task, used
+    for mirror-publishing after the sync.
 
+    The data is indexed by repository.pk due to sub-repos. It's kept in an SQLite database in the
+    task's working directory rather than in memory, because mirrors of large repositories may
+    have hundreds of thousands of packages, and it's deleted when the store is closed.
+    """
 
-def store_package_for_mirroring(repo, pkgid, location_href):
-    """Used to store data about the packages for mirror-publishing after the sync.
+    FLUSH_SIZE = 1000
 
-    Args:
-        repo: Which repository the metadata is associated with
-        pkgid: The checksum of the package
-        location_href: The relative path to the package within the repository
-    """
-    global pkgid_to_location_href
-    # this shouldn't really add the location_href to a list, really it ought to set the value
-    # but unfortunately some repositories have the same packages present in multiple places
-    # same pkgid, >1 different location_hrefs
-    pkgid_to_location_href[str(repo.pk)][pkgid].add(location_href)
+    def __init__(self, directory="."):
+        """
+        Create the store.
 
+        Args:
+            directory (str): The directory to create the database in
+        """
+        self._file = tempfile.NamedTemporaryFile(dir=directory, suffix=".sqlite3")
+        self._db = sqlite3.connect(self._file.name)
+        self._db.executescript(
+            """
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE metadata_files (
+                repo TEXT, relative_path TEXT, path TEXT, PRIMARY KEY (repo, relative_path)
+            ) WITHOUT ROWID;
+            CREATE TABLE packages (
+                repo TEXT, pkgid TEXT, location_href TEXT,
+                PRIMARY KEY (repo, pkgid, location_href)
+            ) WITHOUT ROWID;
+            """
+        )
+        self._pending_packages = []
 
-def add_metadata_to_publication(publication, version, prefix=""):
-    """Create a mirrored publication for the given repository version.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close and delete the database."""
+        self._db.close()
+        self._file.close()
+
+    def add_metadata_file(self, repo, md_path, relative_path):
+        """
+        Store data about a downloaded metadata file.
+
+        Args:
+            repo: Which repository the metadata is associated with
+            md_path: The path to the metadata file
+            relative_path: The relative path to the metadata file within the repository
+        """
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO metadata_files VALUES (?, ?, ?)",
+                (str(repo.pk), relative_path, md_path),
+            )
+
+    def add_package(self, repo, pkgid, location_href):
+        """
+        Store data about a package.
+
+        Args:
+            repo: Which repository the package is associated with
+            pkgid: The checksum of the package
+            location_href: The relative path to the package within the repository
+        """
+        # some repositories have the same packages present in multiple places
+        # same pkgid, >1 different location_hrefs
+        self._pending_packages.append((str(repo.pk), pkgid, location_href))
+        if len(self._pending_packages) >= self.FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO packages VALUES (?, ?, ?)", self._pending_packages
+            )
+        self._pending_packages.clear()
+
+    def metadata_files(self, repo):
+        """
+        Get the metadata files stored for a repository.
+
+        Args:
+            repo: The repository
+
+        Returns:
+            dict: The paths to the metadata files, by their relative path within the repository
+        """
+        return dict(
+            self._db.execute(
+                "SELECT relative_path, path FROM metadata_files WHERE repo = ?", (str(repo.pk),)
+            )
+        )
+
+    def package_locations(self, repo, pkgids):
+        """
+        Get the locations stored for some packages of a repository.
+
+        Args:
+            repo: The repository
+            pkgids (list): The checksums of the packages, at most `FLUSH_SIZE` of them
+
+        Returns:
+            dict: The sets of relative paths to the packages within the repository, by pkgid
+        """
+        self._flush()
+        locations = collections.defaultdict(set)
+        rows = self._db.execute(
+            "SELECT pkgid, location_href FROM packages WHERE repo = ? AND pkgid IN ({})".format(
+                ", ".join("?" * len(pkgids))
+            ),
+            (str(repo.pk), *pkgids),
+        )
+        for pkgid, location_href in rows:
+            locations[pkgid].add(location_href)
+        return locations
 
-    Uses the `metadata_files` global data.
+
+def add_metadata_to_publication(publication, version, mirroring_store, prefix=""):
+    """Create a mirrored publication for the given repository version.
 
     Args:
         publication: The publication to add downloaded repo metadata to
         version: The repository version the repo corresponds to
+        mirroring_store (MirroringStore): The data about the repo metadata stored by the sync
     Kwargs:
         prefix: Subdirectory underneath the root repository (if a sub-repo)
     """
-    repo_metadata_files = metadata_files_for_mirroring[str(version.repository.pk)]
+    repo_metadata_files = mirroring_store.metadata_files(version.repository)
 
     for relative_path, metadata_file_path in repo_metadata_files.items():
         with open(metadata_file_path, "rb") as metadata_fd:
@@ -176,22 +305,43 @@ def add_metadata_to_publication(publication, version, prefix=""):
                 publication=publication,
             )
 
+    # The published artifacts are saved in batches while the content artifacts are iterated,
+    # so that only one batch of them is ever held in memory
     published_artifacts = []
 
+    def add_published_artifact(content_artifact_pk, relative_path):
+        published_artifacts.append(
+            PublishedArtifact(
+                content_artifact_id=content_artifact_pk,
+                relative_path=relative_path,
+                publication=publication,
+            )
+        )
+        if len(published_artifacts) >= PUBLISHED_ARTIFACT_BATCH_SIZE:
+            PublishedArtifact.objects.bulk_create(published_artifacts)
+            published_artifacts.clear()
+
     # Handle packages
     pkg_data = ContentArtifact.objects.filter(
         content__in=version.content, content__pulp_type=Package.get_pulp_type()
-    ).values("pk", "content__rpm_package__pkgId")
-    for ca in pkg_data.iterator():
-        for relative_path in pkgid_to_location_href[str(version.repository.pk)][
-            ca["content__rpm_package__pkgId"]
-        ]:
-            pa = PublishedArtifact(
-                content_artifact_id=ca["pk"],
-                relative_path=os.path.join(prefix, relative_path),
-                publication=publication,
-            )
-            published_artifacts.append(pa)
+    ).values_list("pk", "content__rpm_package__pkgId")
+
+    def add_packages(batch):
+        locations = mirroring_store.package_locations(
+            version.repository, [pkgid for _, pkgid in batch]
+        )
+        for ca_pk, pkgid in batch:
+            for relative_path in locations[pkgid]:
+                add_published_artifact(ca_pk, os.path.join(prefix, relative_path))
+
+    batch = []
+    for ca in pkg_data.iterator(chunk_size=MirroringStore.FLUSH_SIZE):
+        batch.append(ca)
+        if len(batch) == MirroringStore.FLUSH_SIZE:
+            add_packages(batch)
+            batch = []
+    if batch:
+        add_packages(batch)
 
     # Handle everything else
     # TODO: this code is copied directly from publication, we should deduplicate it later
@@ -214,28 +364,689 @@ def add_metadata_to_publication(publication, version, prefix=""):
     )
 
     for content_artifact in contentartifact_qs.values("pk", "relative_path").iterator():
-        published_artifacts.append(
-            PublishedArtifact(
-                relative_path=content_artifact["relative_path"],
-                publication=publication,
-                content_artifact_id=content_artifact["pk"],
+        add_published_artifact(content_artifact["pk"], content_artifact["relative_path"])
+
+    PublishedArtifact.objects.bulk_create(published_artifacts)
+
+
+def score_grouping(items):
+    """
+    Score how well items are grouped together in a list.
+
+    Returns:
+        float: Score from 0 (completely scattered) to 1 (perfectly grouped)
+
+    Examples:
+        >>> score_grouping(["apple", "apple", "banana", "banana", "pear"])
+        1.0
+        >>> score_grouping(["apple", "banana", "apple", "banana", "pear"])
+        0.0 (or close to it)
+    """
+    if not items:
+        return 1.0
+
+    # Count actual number of runs (consecutive groups)
+    actual_runs = 1
+    for i in range(1, len(items)):
+        if items[i] != items[i - 1]:
+            actual_runs += 1
+
+    # Count frequency of each item
+    counts = collections.Counter(items)
+
+    # Minimum runs = number of unique items (best case: all grouped)
+    min_runs = len(counts)
+
+    # Maximum runs for this distribution (worst case: maximally scattered)
+    # Formula: min(total_items, 2 * sum_of_smaller_counts + 1)
+    sorted_counts = sorted(counts.values(), reverse=True)
+    other_counts_sum = sum(sorted_counts[1:])
+    max_runs = min(len(items), 2 * other_counts_sum + 1)
+
+    # Edge case: if all items are the same
+    if min_runs == max_runs:
+        return 1.0
+
+    # Normalize score: 1 = perfectly grouped, 0 = maximally scattered
+    score = (max_runs - actual_runs) / (max_runs - min_runs)
+
+    return score
+
+
+def intern_file_entries(files, string_cache, tuple_cache):
+    """
+    Replace the file entries of a package with shared copies of identical entries.
+
+    Args:
+        files (list): File entry tuples of the form (type, parent_dir, name)
+        string_cache (dict): A dictionary used to intern the parent directory strings
+        tuple_cache (dict): A dictionary used to intern whole file entry tuples
+
+    Returns:
+        list: the interned file entries
+    """
+    interned = []
+    for typ, parent_dir, name in files:
+        parent_dir = string_cache.setdefault(parent_dir, parent_dir)
+        file_entry = (typ, parent_dir, name)
+        interned.append(tuple_cache.setdefault(file_entry, file_entry))
+    return interned
+
+
+class PackageSpool:
+    """
+    An append-only, on-disk spool of parsed package records which can be replayed by position.
+
+    Used to parse repository metadata once while deferring the decision about which packages
+    should be emitted until every package has been seen.
+    """
+
+    def __init__(self, directory="."):
+        """
+        Create the spool.
+
+        Args:
+            directory (str): Where to create the (anonymous) spool file.
+        """
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._offsets = array.array("q")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def append(self, record):
+        """
+        Write a record to the end of the spool.
+
+        Args:
+            record: Any picklable object
+
+        Returns:
+            int: The position of the record within the spool
+        """
+        self._file.seek(0, os.SEEK_END)
+        self._offsets.append(self._file.tell())
+        pickle.dump(record, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        return len(self._offsets) - 1
+
+    def load(self, index):
+        """
+        Read the record stored at the given position.
+
+        Args:
+            index (int): The position returned by `append`
+
+        Returns:
+            The stored record
+        """
+        self._file.seek(self._offsets[index])
+        return pickle.load(self._file)
+
+    def close(self):
+        """Release the spool file."""
+        self._file.close()
+
+
+def index_package_offsets(metadata_path, decompressed_path):
+    """
+    Decompress a package metadata file and find where each of its packages starts.
+
+    Meant to be run in a worker process. The <package> elements can be found without parsing the
+    XML, since a "<" can't appear in the text of an XML document otherwise.
+
+    Args:
+        metadata_path (str): The path to primary.xml, filelists.xml or other.xml
+        decompressed_path (str): Where to write the decompressed file to
+
+    Returns:
+        array.array: The byte offset of every package in the decompressed file, followed by the
+            offset of the closing tag of the document
+    """
+    cr.decompress_file(metadata_path, decompressed_path, cr.AUTO_DETECT_COMPRESSION)
+    offsets = array.array("q")
+    with (
+        open(decompressed_path, "rb") as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data,
+    ):
+        offset = data.find(b"<package")
+        while offset != -1:
+            # not e.g. <packager>, the attributes may be separated by any XML whitespace
+            if data[offset + 8 : offset + 9] in (b" ", b"\t", b"\r", b"\n", b">"):
+                offsets.append(offset)
+            offset = data.find(b"<package", offset + 8)
+        offsets.append(data.rfind(b"</"))
+    return offsets
+
+
+def write_metadata_slice(decompressed_path, header_end, start, end, footer_start, path):
+    """
+    Write a package metadata file with only the packages within a range of bytes of another one.
+
+    Args:
+        decompressed_path (str): The path to the decompressed metadata file
+        header_end (int): The offset of its first package
+        start (int): The offset of the first package of the slice
+        end (int): The offset just past the last package of the slice
+        footer_start (int): The offset of the closing tag of the document
+        path (str): Where to write the slice to
+    """
+    with open(decompressed_path, "rb") as source, open(path, "wb") as target:
+        target.write(source.read(header_end))
+        source.seek(start)
+        remaining = end - start
+        while remaining:
+            block = source.read(min(remaining, 1024 * 1024))
+            target.write(block)
+            remaining -= len(block)
+        source.seek(footer_start)
+        shutil.copyfileobj(source, target)
+
+
+def spool_package_dicts(slices, positions, path):
+    """
+    Convert the packages at the given positions of a slice of the metadata into dicts.
+
+    Meant to be run in a worker process. The dicts are pickled to the file one after another.
+
+    Args:
+        slices (list): The arguments of write_metadata_slice() for primary.xml, filelists.xml and
+            other.xml, except for the path of the slice, or None for the ones which are missing
+        positions (list): The ascending positions of the packages to convert, within the slice
+        path (str): Where to write the package dicts to
+    """
+    slice_paths = []
+    for metadata_slice, metadata_type in zip(slices, ("primary", "filelists", "other")):
+        if metadata_slice is None:
+            slice_paths.append(None)
+            continue
+        slice_path = f"{path}.{metadata_type}.xml"
+        write_metadata_slice(*metadata_slice, slice_path)
+        slice_paths.append(slice_path)
+
+    wanted = set(positions)
+    packages = cr.PackageIterator(
+        primary_path=slice_paths[0], filelists_path=slice_paths[1], other_path=slice_paths[2]
+    )
+    with open(path, "wb") as spool_file:
+        for position, pkg in enumerate(packages):
+            if position in wanted:
+                package_dict = Package.createrepo_to_dict(pkg)
+                pickle.dump(package_dict, spool_file, protocol=pickle.HIGHEST_PROTOCOL)
+    for slice_path in slice_paths:
+        if slice_path:
+            os.unlink(slice_path)
+
+
+def parse_comps_file(comps_path):
+    """
+    Parse comps.xml into the dicts which the comps models are built from.
+
+    Meant to be run in a worker process.
+
+    Args:
+        comps_path (str): The path to the (possibly compressed) comps.xml
+
+    Returns:
+        dict: The langpacks as a tuple of the matches and the model dict (or None), and lists of
+            the category, environment and group dicts
+    """
+    comps = libcomps.Comps()
+    with tempfile.TemporaryDirectory(dir=".") as tf:
+        decompressed_path = os.path.join(tf, "comps.xml")
+        cr.decompress_file(comps_path, decompressed_path, cr.AUTO_DETECT_COMPRESSION)
+        with open(decompressed_path) as f:
+            comps.fromxml_str(f.read())
+
+    langpacks = None
+    if comps.langpacks:
+        langpacks = (
+            strdict_to_dict(comps.langpacks),
+            PackageLangpacks.libcomps_to_dict(comps.langpacks),
+        )
+
+    return {
+        "langpacks": langpacks,
+        "categories": [PackageCategory.libcomps_to_dict(c) for c in comps.categories],
+        "environments": [PackageEnvironment.libcomps_to_dict(e) for e in comps.environments],
+        "groups": [PackageGroup.libcomps_to_dict(g) for g in comps.groups],
+    }
+
+
+def spool_advisories(updateinfo_xml_path, path):
+    """
+    Parse updateinfo.xml into the dicts which the advisory models are built from.
+
+    Meant to be run in a worker process. Every advisory is pickled to the file one after another,
+    as a tuple of the record dict, its digest, a list of (collection dict, package dicts) tuples
+    and a list of reference dicts.
+
+    Args:
+        updateinfo_xml_path (str): The path to updateinfo.xml
+        path (str): Where to write the advisories to
+
+    Returns:
+        int: The number of advisories
+    """
+    uinfo = cr.UpdateInfo()
+
+    # TODO: handle parsing errors/warnings, warningcb callback can be used
+    cr.xml_parse_updateinfo(updateinfo_xml_path, uinfo)
+    updates = uinfo.updates
+
+    with open(path, "wb") as spool_file:
+        for update in updates:
+            collections = [
+                (
+                    UpdateCollection.createrepo_to_dict(collection),
+                    [
+                        UpdateCollectionPackage.createrepo_to_dict(package)
+                        for package in collection.packages
+                    ],
+                )
+                for collection in update.collections
+            ]
+            references = [
+                UpdateReference.createrepo_to_dict(reference) for reference in update.references
+            ]
+            advisory = (
+                UpdateRecord.createrepo_to_dict(update),
+                hash_update_record(update),
+                collections,
+                references,
             )
+            pickle.dump(advisory, spool_file, protocol=pickle.HIGHEST_PROTOCOL)
+    return len(updates)
+
+
+class ParallelPackageParser:
+    """
+    Converts packages into dicts in a pool of worker processes, and hands them back in order.
+
+    The metadata files are decompressed and the byte offsets of their packages are indexed first,
+    one file per worker. The positions to convert are then split into one contiguous shard per
+    worker, and every worker parses only the slice of the metadata which holds its shard. So the
+    metadata is parsed once in total, spread across the workers.
+    """
+
+    def __init__(self, primary_path, filelists_path, other_path, workers, directory="."):
+        """
+        Create the parser.
+
+        Args:
+            primary_path (str): The path to primary.xml
+            filelists_path (str): The path to filelists.xml, or None
+            other_path (str): The path to other.xml, or None
+            workers (int): The number of worker processes to use
+            directory (str): Where to create the temporary files holding the converted packages
+        """
+        self._paths = (primary_path, filelists_path, other_path)
+        self._workers = workers
+        self._directory = directory
+        self._executor = None
+        self._tmp_dir = None
+        self._indexes = None
+        self._positions = None
+        self._shards = collections.deque()
+        self._current = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self, positions):
+        """
+        Start converting the packages at the given positions of the metadata stream.
+
+        Must be called from within the event loop.
+
+        Args:
+            positions (list): The ascending positions of the packages to convert
+        """
+        if not positions:
+            return
+        self._tmp_dir = tempfile.TemporaryDirectory(dir=self._directory)
+        # The workers rely on Django having been set up already, so they need to be forked
+        self._executor = ProcessPoolExecutor(
+            max_workers=self._workers, mp_context=multiprocessing.get_context("fork")
         )
+        loop = asyncio.get_running_loop()
+        self._indexes = []
+        for metadata_path, metadata_type in zip(self._paths, ("primary", "filelists", "other")):
+            if metadata_path is None:
+                self._indexes.append(None)
+                continue
+            decompressed_path = os.path.join(self._tmp_dir.name, f"{metadata_type}.xml")
+            future = loop.run_in_executor(
+                self._executor, index_package_offsets, metadata_path, decompressed_path
+            )
+            self._indexes.append((future, decompressed_path))
+        self._positions = positions
+
+    async def _start_shards(self):
+        offsets = []
+        for index in self._indexes:
+            if index is None:
+                offsets.append(None)
+                continue
+            future, decompressed_path = index
+            offsets.append((await future, decompressed_path))
+        numbers_of_packages = {len(file_offsets) for file_offsets, _ in filter(None, offsets)}
+        if len(numbers_of_packages) != 1:
+            raise SyncError(_("The package metadata files list different numbers of packages"))
+
+        loop = asyncio.get_running_loop()
+        positions = self._positions
+        self._positions = None
+        shard_size = -(-len(positions) // self._workers)
+        for number, start in enumerate(range(0, len(positions), shard_size)):
+            shard = positions[start : start + shard_size]
+            first, last = shard[0], shard[-1]
+            slices = []
+            for index in offsets:
+                if index is None:
+                    slices.append(None)
+                    continue
+                file_offsets, decompressed_path = index
+                slices.append(
+                    (
+                        decompressed_path,
+                        file_offsets[0],
+                        file_offsets[first],
+                        file_offsets[last + 1],
+                        file_offsets[-1],
+                    )
+                )
+            path = os.path.join(self._tmp_dir.name, str(number))
+            future = loop.run_in_executor(
+                self._executor,
+                spool_package_dicts,
+                slices,
+                [position - first for position in shard],
+                path,
+            )
+            self._shards.append((future, path))
 
-    PublishedArtifact.objects.bulk_create(published_artifacts, batch_size=2000)
+    async def get(self):
+        """
+        Return the next converted package.
 
+        Returns:
+            dict: The package dict, for the packages in the order their positions were given
+        """
+        if self._positions is not None:
+            await self._start_shards()
+        while True:
+            if self._current is not None:
+                try:
+                    return pickle.load(self._current)
+                except EOFError:
+                    self._current.close()
+                    os.unlink(self._current.name)
+                    self._current = None
+            future, path = self._shards.popleft()
+            await future
+            self._current = open(path, "rb")
+
+    def close(self):
+        """Stop the workers and remove the temporary files."""
+        if self._current is not None:
+            self._current.close()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+
+
+class ExistingPackageIndex:
+    """
+    A compact index of already-saved packages, keyed by pkgId.
 
-def get_repomd_file(remote, url):
+    Only the handful of fields needed to recognize a package and re-associate it with a new
+    repository version are kept, as plain tuples. The (deferred) Package instance which stands
+    in for the saved content is only created once a package is actually claimed.
     """
-    Check if repodata exists.
+
+    # Listed in the order the model declares them, as expected by Model.from_db()
+    FIELDS = (
+        "pulp_id",
+        "pulp_type",
+        "content_ptr_id",
+        "name",
+        "epoch",
+        "version",
+        "release",
+        "arch",
+        "pkgId",
+        "checksum_type",
+        "location_href",
+        "size_package",
+        "is_modular",
+        "_pulp_domain_id",
+    )
+    # Fields with few distinct values which are worth sharing between the records
+    INTERNED_FIELDS = (
+        "pulp_type",
+        "name",
+        "epoch",
+        "version",
+        "release",
+        "arch",
+        "checksum_type",
+        "_pulp_domain_id",
+    )
+
+    def __init__(self):
+        self._records = {}
+        self._values = {}
+        self._db = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, pkgId):
+        return pkgId in self._records
+
+    def add(self, queryset, chunk_size=2000):
+        """
+        Add the packages from a queryset to the index.
+
+        Args:
+            queryset (django.db.models.QuerySet): A queryset of Package objects
+            chunk_size (int): The number of rows to fetch from the database at once
+        """
+        self._db = queryset.db
+        values = self._values
+        interned = [field in self.INTERNED_FIELDS for field in self.FIELDS]
+        pkgid_position = self.FIELDS.index("pkgId")
+        for row in queryset.values_list(*self.FIELDS).iterator(chunk_size=chunk_size):
+            record = tuple(
+                values.setdefault(value, value) if intern else value
+                for intern, value in zip(interned, row)
+            )
+            self._records[record[pkgid_position]] = record
+
+    def pop(self, pkgId):
+        """
+        Remove a package from the index.
+
+        Args:
+            pkgId (str): The checksum of the package
+
+        Returns:
+            tuple: The package record, or None if the package isn't in the index
+        """
+        return self._records.pop(pkgId, None)
+
+    def clear(self):
+        """Drop all of the remaining records."""
+        self._records.clear()
+        self._values.clear()
+
+    def to_package(self, record):
+        """
+        Create the saved Package instance for a record returned by `pop`.
+
+        Any fields other than the indexed ones are deferred, just as with `QuerySet.only()`.
+
+        Args:
+            record (tuple): A package record
+
+        Returns:
+            pulp_rpm.app.models.Package: A package which is already saved to the database
+        """
+        return Package.from_db(self._db, self.FIELDS, record)
+
+
+class MetadataFetcher:
+    """
+    Fetch the metadata files of a remote repository, each of them at most once per sync.
+
+    The HTTP validators (ETag and Last-Modified) of the fetched files are collected, so that the
+    next sync can ask the server whether any of the files have changed with conditional requests.
+    """
+
+    def __init__(self, remote):
+        """
+        Create the fetcher.
+
+        Args:
+            remote (RpmRemote or UlnRemote): An RpmRemote or UlnRemote to download with.
+        """
+        self.remote = remote
+        # url -> DownloadResult, or None if the file doesn't exist
+        self.results = {}
+        # url -> {"etag": ..., "last_modified": ...}, or None if the file doesn't exist
+        self.validators = {}
+        # url -> the (JSON-serializable) downloader parameters it was fetched with, if any
+        self.fetch_kwargs = {}
+
+    def fetch(self, url, headers=None, **kwargs):
+        """
+        Fetch a file, unless it has already been fetched during this sync.
+
+        Args:
+            url (str): The URL to download.
+            headers (dict): Additional headers for the request, which make it conditional.
+            kwargs (dict): Parameters for the downloader.
+
+        Returns:
+            pulpcore.plugin.download.DownloadResult: The downloaded file.
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist and the error was silenced.
+            NotModified: If the request was conditional and the file hasn't changed.
+        """
+        if url not in self.results:
+            if kwargs:
+                self.fetch_kwargs[url] = {
+                    key: sorted(value) if isinstance(value, set) else value
+                    for key, value in kwargs.items()
+                }
+            downloader = self.remote.get_downloader(url=url, **kwargs)
+            extra_data = {"request_kwargs": {"headers": headers}} if headers else None
+            try:
+                result = downloader.fetch(extra_data=extra_data)
+            except FileNotFoundError:
+                result = None
+            self.add(url, result)
+
+        if self.results[url] is None:
+            raise FileNotFoundError(url)
+        return self.results[url]
+
+    def add(self, url, result):
+        """
+        Add a file which was fetched some other way.
+
+        Args:
+            url (str): The URL the file was downloaded from.
+            result (pulpcore.plugin.download.DownloadResult): The downloaded file, or None if the
+                file doesn't exist.
+        """
+        if result is None:
+            self.validators[url] = None
+        else:
+            response_headers = result.headers or {}
+            self.validators[url] = {
+                "etag": response_headers.get("ETag"),
+                "last_modified": response_headers.get("Last-Modified"),
+            }
+        self.results[url] = result
+
+    def unchanged(self, validators, fetch_kwargs=None):
+        """
+        Check whether all of the files fetched by a previous sync are unchanged.
+
+        Conditional requests are used for the files which existed, and the files which didn't
+        exist are checked to still be missing. Each file is requested with the same downloader
+        parameters as during the previous sync. Files which turn out to have changed are kept, so
+        that the rest of the sync doesn't need to fetch them again.
+
+        Args:
+            validators (dict): The validators collected by the fetcher of the previous sync.
+            fetch_kwargs (dict): The downloader parameters collected by the fetcher of the
+                previous sync.
+
+        Returns:
+            bool: True, if none of the files have changed; False, otherwise.
+        """
+        if not validators or any(
+            validator is not None and not any(validator.values())
+            for validator in validators.values()
+        ):
+            # Without validators for every file, the server can't tell us what has changed
+            return False
+
+        fetch_kwargs = fetch_kwargs or {}
+        for url, validator in validators.items():
+            kwargs = {
+                key: set(value) if key == "silence_errors_for_response_status_codes" else value
+                for key, value in fetch_kwargs.get(url, {}).items()
+            }
+            try:
+                if validator is None:
+                    # Only the files fetched with silenced errors can have been missing
+                    kwargs.setdefault("silence_errors_for_response_status_codes", {403, 404})
+                    try:
+                        self.fetch(url, **kwargs)
+                    except FileNotFoundError:
+                        continue
+                    return False
+
+                headers = {}
+                if validator.get("etag"):
+                    headers["If-None-Match"] = validator["etag"]
+                if validator.get("last_modified"):
+                    headers["If-Modified-Since"] = validator["last_modified"]
+                try:
+                    self.fetch(url, headers=headers, **kwargs)
+                except NotModified:
+                    continue
+                return False
+            except ClientResponseError:
+                # Let the rest of the sync deal with it
+                return False
+
+        return True
+
+
+def get_repomd_url(url):
+    """
+    Get the URL of the repomd.xml file of a repository.
 
     Args:
-        remote (RpmRemote or UlnRemote): An RpmRemote or UlnRemote to download with.
         url (str): A remote repository URL
 
     Returns:
-        pulpcore.plugin.download.DownloadResult: downloaded repomd.xml
-
+        str: The URL of repomd.xml
     """
     # URLs, esp mirrorlist URLs, can come into this method with parameters attached.
     # This causes the urlpath_sanitize() below to return something like
@@ -243,43 +1054,108 @@ def get_repomd_file(remote, url):
     # Make sure we're only looking for the repomd.xml file, no matter what weirdness comes
     # in. See https://pulp.plan.io/issues/8981 for more details.
     url = url.split("?")[0]
-    downloader = remote.get_downloader(url=urlpath_sanitize(url, "repodata/repomd.xml"))
+    return urlpath_sanitize(url, "repodata/repomd.xml")
+
+
+def get_repomd_file(remote, url, fetcher=None):
+    """
+    Check if repodata exists.
+
+    Args:
+        remote (RpmRemote or UlnRemote): An RpmRemote or UlnRemote to download with.
+        url (str): A remote repository URL
+        fetcher (MetadataFetcher): An optional fetcher to reuse the files of the current sync.
+
+    Returns:
+        pulpcore.plugin.download.DownloadResult: downloaded repomd.xml
+
+    """
+    repomd_url = get_repomd_url(url)
+    if fetcher:
+        return fetcher.fetch(repomd_url)
+    downloader = remote.get_downloader(url=repomd_url)
     return downloader.fetch()
 
 
-def fetch_mirror(remote):
-    """Fetch the first valid mirror from a list of all available mirrors from a mirror list feed.
+async def probe_mirror(remote, mirror_url):
+    """
+    Download the repomd.xml file of a mirror, timing how long it takes.
+
+    Args:
+        remote (RpmRemote or UlnRemote): An RpmRemote or UlnRemote to download with.
+        mirror_url (str): The URL of the mirror
+
+    Returns:
+        tuple: The downloaded repomd.xml, and how many seconds it took to download
+    """
+    downloader = remote.get_downloader(url=get_repomd_url(mirror_url))
+    start = time.monotonic()
+    result = await downloader.run()
+    return result, time.monotonic() - start
+
+
+def fetch_mirror(remote, fetcher=None):
+    """Fetch the valid mirrors from a list of all available mirrors from a mirror list feed.
 
     URLs which are commented out or have any punctuations in front of them are being ignored.
+
+    The mirrors are probed concurrently, a batch at a time in the order of the list, until at
+    least one of them turns out to be valid. The valid ones are ranked by how quickly they served
+    their repomd.xml, which for a file this small mostly measures their latency.
+
+    Returns:
+        list: The URLs of the valid mirrors, fastest first
     """
-    downloader = remote.get_downloader(url=remote.url.rstrip("/"), urlencode=False)
-    result = downloader.fetch()
+    if fetcher:
+        result = fetcher.fetch(remote.url.rstrip("/"), urlencode=False)
+    else:
+        downloader = remote.get_downloader(url=remote.url.rstrip("/"), urlencode=False)
+        result = downloader.fetch()
 
     url_pattern = re.compile(r"(^|^[\w\s=]+\s)((http(s)?)://.*)")
+    mirror_urls = []
     with open(result.path) as mirror_list_file:
         for mirror in mirror_list_file:
             match = re.match(url_pattern, mirror)
-            if not match:
-                continue
-
-            mirror_url = match.group(2)
-            try:
-                get_repomd_file(remote, mirror_url)
-                # just check if the metadata exists
-                return mirror_url
-            except Exception as exc:
+            if match:
+                mirror_urls.append(match.group(2))
+
+    ranked_mirrors = []
+    loop = asyncio.get_event_loop()
+    for start in range(0, len(mirror_urls), MIRRORLIST_PROBE_CONCURRENCY):
+        batch = mirror_urls[start : start + MIRRORLIST_PROBE_CONCURRENCY]
+        probes = [probe_mirror(remote, mirror_url) for mirror_url in batch]
+        outcomes = loop.run_until_complete(asyncio.gather(*probes, return_exceptions=True))
+        for mirror_url, outcome in zip(batch, outcomes):
+            if isinstance(outcome, Exception):
                 log.warning(
                     "Url '{}' from mirrorlist was tried and failed with error: {}".format(
-                        mirror_url, exc
+                        mirror_url, outcome
                     )
                 )
                 continue
+            repomd_result, elapsed = outcome
+            log.debug("Url '{}' from mirrorlist responded in {:.3f}s".format(mirror_url, elapsed))
+            ranked_mirrors.append((elapsed, mirror_url, repomd_result))
+        if ranked_mirrors:
+            break
 
-    return None
+    ranked_mirrors.sort(key=lambda mirror: mirror[0])
+    if fetcher and ranked_mirrors:
+        # The rest of the sync uses the fastest mirror, don't download its repomd.xml again
+        _, mirror_url, repomd_result = ranked_mirrors[0]
+        fetcher.add(get_repomd_url(mirror_url), repomd_result)
+    return [mirror_url for _, mirror_url, _ in ranked_mirrors]
 
 
-def fetch_remote_url(remote, custom_url=None):
-    """Fetch a single remote from which can be content synced."""
+def fetch_remote_urls(remote, custom_url=None, fetcher=None):
+    """
+    Fetch the remote URLs from which content can be synced.
+
+    Returns:
+        list: The URL to sync from, followed by the fastest other mirrors from the mirrorlist
+            that packages can be downloaded from if it fails, if the remote is a mirrorlist.
+    """
 
     def normalize_url(url_to_normalize):
         return url_to_normalize.rstrip("/") + "/"
@@ -288,9 +1164,9 @@ def fetch_remote_url(remote, custom_url=None):
 
     try:
         normalized_remote_url = normalize_url(url)
-        get_repomd_file(remote, normalized_remote_url)
+        get_repomd_file(remote, normalized_remote_url, fetcher=fetcher)
         # just check if the metadata exists
-        return normalized_remote_url
+        return [normalized_remote_url]
     except ClientResponseError as exc:
         # If 'custom_url' is passed it is a call from ACS refresh
         # which doesn't support mirror lists.
@@ -301,28 +1177,33 @@ def fetch_remote_url(remote, custom_url=None):
         log.info(
             _("Attempting to resolve a true url from potential mirrolist url '{}'").format(url)
         )
-        remote_url = fetch_mirror(remote)
-        if remote_url:
+        remote_urls = fetch_mirror(remote, fetcher=fetcher)
+        if remote_urls:
             log.info(
                 _("Using url '{}' from mirrorlist in place of the provided url {}").format(
-                    remote_url, url
+                    remote_urls[0], url
                 )
             )
-            return normalize_url(remote_url)
+            return [normalize_url(remote_url) for remote_url in remote_urls]
 
         raise RemoteFetchError(url, exc.status, exc.message)
 
 
-def should_optimize_sync(sync_details, last_sync_details):
+def fetch_remote_url(remote, custom_url=None, fetcher=None):
+    """Fetch a single remote from which can be content synced."""
+    return fetch_remote_urls(remote, custom_url=custom_url, fetcher=fetcher)[0]
+
+
+def sync_parameters_unchanged(sync_details, last_sync_details):
     """
-    Check whether the sync should be optimized by comparing its parameters with the previous sync.
+    Check whether the results of the previous sync could be reused by the current sync.
 
     Args:
         sync_details (dict): A collection of details about the current sync configuration.
         last_sync_details (dict): A collection of details about the previous sync configuration.
 
     Returns:
-        bool: True, if sync is optimized; False, otherwise.
+        bool: True, if the repository and the sync parameters are unchanged; False, otherwise.
 
     """
     might_download_content = (
@@ -346,6 +1227,24 @@ def should_optimize_sync(sync_details, last_sync_details):
     if url_has_changed or repository_has_been_modified or retain_package_versions_has_changed:
         return False
 
+    return True
+
+
+def should_optimize_sync(sync_details, last_sync_details):
+    """
+    Check whether the sync should be optimized by comparing its parameters with the previous sync.
+
+    Args:
+        sync_details (dict): A collection of details about the current sync configuration.
+        last_sync_details (dict): A collection of details about the previous sync configuration.
+
+    Returns:
+        bool: True, if sync is optimized; False, otherwise.
+
+    """
+    if not sync_parameters_unchanged(sync_details, last_sync_details):
+        return False
+
     old_revision = is_previous_version(sync_details["revision"], last_sync_details.get("revision"))
     same_revision = last_sync_details.get("revision") == sync_details["revision"]
     same_repomd_checksum = (
@@ -360,7 +1259,64 @@ def should_optimize_sync(sync_details, last_sync_details):
     return True
 
 
-def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url=None, **kwargs):
+def get_previous_record_checksums(sync_details, last_sync_details):
+    """
+    Get the repomd record checksums of the previous sync, if its content can be carried forward.
+
+    Args:
+        sync_details (dict): A collection of details about the current sync configuration.
+        last_sync_details (dict): A collection of details about the previous sync configuration.
+
+    Returns:
+        dict: The checksums of the records keyed by their type, or None if nothing may be
+            carried forward.
+
+    """
+    # The publication has to be created from a complete copy of the metadata
+    if sync_details["sync_policy"] == SYNC_POLICIES.MIRROR_COMPLETE:
+        return None
+    if not sync_parameters_unchanged(sync_details, last_sync_details):
+        return None
+    if last_sync_details.get("skip_types") != sync_details["skip_types"]:
+        return None
+    return last_sync_details.get("repomd_records")
+
+
+def find_unchanged_record_types(record_checksums, previous_record_checksums):
+    """
+    Find the repomd record types whose content doesn't need to be synced again.
+
+    Records are compared in the groups which the content they describe is parsed from, e.g. the
+    packages depend on all of primary.xml, filelists.xml, other.xml and modules.yaml.
+
+    Args:
+        record_checksums (dict): The checksums of the current records keyed by their type.
+        previous_record_checksums (dict): The checksums of the records at the previous sync.
+
+    Returns:
+        set: The record types which are unchanged.
+
+    """
+    unchanged = set()
+    for record_types in INCREMENTAL_SYNC_RECORD_GROUPS:
+        current = {t: c for t, c in record_checksums.items() if t in record_types}
+        previous = {t: c for t, c in previous_record_checksums.items() if t in record_types}
+        if current and current == previous:
+            unchanged.update(record_types)
+    return unchanged
+
+
+def synchronize(
+    remote_pk,
+    repository_pk,
+    sync_policy,
+    skip_types,
+    optimize,
+    url=None,
+    shards=1,
+    shard_task_pks=None,
+    **kwargs,
+):
     """
     Sync content from the remote repository.
 
@@ -386,10 +1342,46 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
         skip_types (list): List of content to skip.
         optimize(bool): Optimize mode.
         url(str): Custom URL to use instead of Remote's URL
+        shards(int): If the repository needs to be synced, split its packages into this many
+            shards which are synced by separate tasks, followed by another sync of the repository.
+        shard_task_pks(list): The PKs of the shard tasks which ran before this sync.
 
     Raises:
         ValueError: If the remote does not specify a url to sync.
+        SyncError: If any of the shard tasks didn't complete.
 
+    """
+    # A sharded sync runs in a task group, which is finished once this task has dispatched the
+    # shards into it, or has found that there is nothing to sync, or has failed.
+    task_group = TaskGroup.current() if shards > 1 else None
+    try:
+        return _synchronize(
+            remote_pk,
+            repository_pk,
+            sync_policy,
+            skip_types,
+            optimize,
+            url=url,
+            shards=shards,
+            shard_task_pks=shard_task_pks,
+        )
+    finally:
+        if task_group:
+            task_group.finish()
+
+
+def _synchronize(
+    remote_pk,
+    repository_pk,
+    sync_policy,
+    skip_types,
+    optimize,
+    url=None,
+    shards=1,
+    shard_task_pks=None,
+):
+    """
+    Sync content from the remote repository, as described in synchronize().
     """
     try:
         remote = RpmRemote.objects.get(pk=remote_pk)
@@ -400,10 +1392,14 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
     if not remote.url and not url:
         raise SyncError("A remote must have a url specified to synchronize.")
 
+    if shard_task_pks:
+        check_shard_tasks(shard_task_pks)
+
     log.info(_("Synchronizing: repository={r} remote={p}").format(r=repository.name, p=remote.name))
 
     deferred_download = remote.policy != Remote.IMMEDIATE  # Interpret download policy
     skip_treeinfo = "treeinfo" in skip_types
+    fetcher = MetadataFetcher(remote)
 
     def get_treeinfo_data(remote, remote_url):
         """Get Treeinfo data from remote."""
@@ -414,13 +1410,11 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
         namespaces = [".treeinfo", "treeinfo"]
         for namespace in namespaces:
             treeinfo_url = urlpath_sanitize(remote_url, namespace)
-            downloader = remote.get_downloader(
-                url=treeinfo_url,
-                silence_errors_for_response_status_codes={403, 404},
-            )
 
             try:
-                result = downloader.fetch()
+                result = fetcher.fetch(
+                    treeinfo_url, silence_errors_for_response_status_codes={403, 404}
+                )
             except FileNotFoundError:
                 continue
 
@@ -454,15 +1448,25 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
             )
             treeinfo_file = tempfile.NamedTemporaryFile(dir=".", delete=False)
             treeinfo.dump(treeinfo_file.name, main_variant=main_variant)
-            store_metadata_for_mirroring(repository, treeinfo_file.name, namespace)
+            if mirroring_store:
+                mirroring_store.add_metadata_file(repository, treeinfo_file.name, namespace)
             break
 
         return treeinfo_serialized
 
+    def get_sync_parameters(remote, sync_policy, repository):
+        return {
+            "url": remote.url,  # use the original remote url so that mirrorlists are optimizable
+            "download_policy": remote.policy,
+            "sync_policy": sync_policy,
+            "most_recent_version": repository.latest_version().number,
+            "retain_package_versions": repository.retain_package_versions,
+            "skip_types": sorted(skip_types),
+        }
+
     def get_sync_details(remote, url, sync_policy, repository):
-        version = repository.latest_version()
         with tempfile.TemporaryDirectory(dir="."):
-            result = get_repomd_file(remote, url)
+            result = get_repomd_file(remote, url, fetcher=fetcher)
             repomd_path = result.path
             repomd = cr.Repomd(repomd_path)
             repomd_checksum = get_sha256(repomd_path)
@@ -470,16 +1474,30 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
             treeinfo_checksum = treeinfo_file_data.get("hash", "")
 
         return {
-            "url": remote.url,  # use the original remote url so that mirrorlists are optimizable
-            "download_policy": remote.policy,
-            "sync_policy": sync_policy,
-            "most_recent_version": version.number,
+            **get_sync_parameters(remote, sync_policy, repository),
             "revision": repomd.revision,
             "repomd_checksum": repomd_checksum,
             "treeinfo_checksum": treeinfo_checksum,
-            "retain_package_versions": repository.retain_package_versions,
+            "repomd_records": {record.type: record.checksum for record in repomd.records},
         }
 
+    def report_skipped_sync(done, total):
+        with ProgressReport(
+            message="Skipping Sync (no change from previous sync)", code="sync.was_skipped"
+        ) as pb:
+            pb.done = done
+            pb.total = total
+
+    def save_metadata_validators(sync_details):
+        # The files may have been served again with new validators, but the same content
+        changed = False
+        for key in ("metadata_validators", "metadata_fetch_kwargs"):
+            if repository.last_sync_details.get(key) != sync_details[key]:
+                repository.last_sync_details[key] = sync_details[key]
+                changed = True
+        if changed:
+            repository.save(update_fields=["last_sync_details"])
+
     mirror = sync_policy.startswith("mirror")
     mirror_metadata = sync_policy == SYNC_POLICIES.MIRROR_COMPLETE
 
@@ -491,8 +1509,29 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
     def is_subrepo(directory):
         return directory != PRIMARY_REPO
 
-    with tempfile.TemporaryDirectory(dir="."):
-        remote_url = fetch_remote_url(remote, url)
+    with (
+        tempfile.TemporaryDirectory(dir="."),
+        # Data about the metadata files and packages, for mirror-publishing after the sync
+        MirroringStore() if mirror_metadata else contextlib.nullcontext() as mirroring_store,
+    ):
+        # If none of the metadata files have changed since the previous sync, which is checked
+        # with conditional requests, we can skip the sync without downloading any of them.
+        if (
+            optimize
+            and sync_parameters_unchanged(
+                get_sync_parameters(remote, sync_policy, repository),
+                repository.last_sync_details,
+            )
+            and fetcher.unchanged(
+                repository.last_sync_details.get("metadata_validators"),
+                repository.last_sync_details.get("metadata_fetch_kwargs"),
+            )
+        ):
+            report_skipped_sync(1, 1)
+            return
+
+        remote_url, *fallback_urls = fetch_remote_urls(remote, url, fetcher=fetcher)
+        fallback_urls = fallback_urls[: MIRRORLIST_FAILOVER_MIRRORS - 1]
 
         # Find and set up to deal with any subtrees
         treeinfo = get_treeinfo_data(remote, remote_url)
@@ -525,30 +1564,46 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
                     ),
                     "sync_details": subrepo_sync_details,
                     "url": new_url,
+                    "fallback_urls": [
+                        urlpath_sanitize(fallback_url, path) for fallback_url in fallback_urls
+                    ],
                     "repo": sub_repo,
                 }
 
         # Set up to deal with the primary repository
         sync_details = get_sync_details(remote, remote_url, sync_policy, repository)
+        sync_details["metadata_validators"] = dict(fetcher.validators)
+        sync_details["metadata_fetch_kwargs"] = dict(fetcher.fetch_kwargs)
         repo_sync_config[PRIMARY_REPO] = {
             "should_skip": should_optimize_sync(sync_details, repository.last_sync_details),
             "sync_details": sync_details,
             "url": remote_url,
+            "fallback_urls": fallback_urls,
             "repo": repository,
         }
 
         # If all repos are exactly the same, we should skip all further processing, even in
         # metadata-mirror mode
         if optimize and all([config["should_skip"] for config in repo_sync_config.values()]):
-            with ProgressReport(
-                message="Skipping Sync (no change from previous sync)", code="sync.was_skipped"
-            ) as pb:
-                pb.done = len(repo_sync_config)
-                pb.total = len(repo_sync_config)
+            save_metadata_validators(sync_details)
+            report_skipped_sync(len(repo_sync_config), len(repo_sync_config))
             return
 
+        if shards > 1:
+            dispatch_sharded_sync(
+                remote,
+                repository,
+                shards,
+                sync_policy=sync_policy,
+                skip_types=skip_types,
+                optimize=optimize,
+                url=url,
+            )
+            return None
+
         skipped_syncs = 0
         repo_sync_results = {}
+        declarative_versions = {}
 
         # If some repos need to be synced and others do not, we go through them all
         # items() returns in insertion-order - make sure PRIMARY is the LAST thing we process
@@ -560,8 +1615,16 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
             if not mirror_metadata and optimize and repo_config["should_skip"]:
                 skipped_syncs += 1
                 repo_sync_results[directory] = repo.latest_version()
+                if not is_subrepo(directory):
+                    save_metadata_validators(repo_config["sync_details"])
                 continue
 
+            previous_record_checksums = None
+            if optimize:
+                previous_record_checksums = get_previous_record_checksums(
+                    repo_config["sync_details"], repo.last_sync_details
+                )
+
             stage = RpmFirstStage(
                 remote,
                 repo,
@@ -569,12 +1632,26 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
                 mirror_metadata,
                 skip_types=skip_types,
                 new_url=repo_config["url"],
+                fallback_urls=repo_config["fallback_urls"],
                 treeinfo=(treeinfo if not is_subrepo(directory) else None),
                 namespace=directory,
+                previous_record_checksums=previous_record_checksums,
+                fetcher=fetcher,
+                mirroring_store=mirroring_store,
             )
 
-            dv = RpmDeclarativeVersion(first_stage=stage, repository=repo, mirror=mirror)
-            repo_version = dv.create() or repo.latest_version()
+            declarative_versions[directory] = RpmDeclarativeVersion(
+                first_stage=stage, repository=repo, mirror=mirror
+            )
+
+        # The pipelines run concurrently, and the repository versions are finalized in order
+        new_versions = create_repository_versions(
+            list(declarative_versions.values()), SUBREPO_CONCURRENCY
+        )
+        for directory, new_version in zip(declarative_versions, new_versions):
+            repo_config = repo_sync_config[directory]
+            repo = repo_config["repo"]
+            repo_version = new_version or repo.latest_version()
 
             repo_config["sync_details"]["most_recent_version"] = repo_version.number
             repo.last_sync_details = repo_config["sync_details"]
@@ -582,31 +1659,31 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
 
             repo_sync_results[directory] = repo_version
 
-    if skipped_syncs:
-        with ProgressReport(
-            message="Skipping Sync (no change from previous sync)", code="sync.was_skipped"
-        ) as pb:
-            pb.done = skipped_syncs
-            pb.total = len(repo_sync_config)
-
-    if mirror_metadata:
-        with RpmPublication.create(
-            repo_sync_results[PRIMARY_REPO], pass_through=False
-        ) as publication:
-            gpgcheck = repository.repo_config.get("gpgcheck", 0)
-            has_repomd_signature = (
-                "repodata/repomd.xml.asc" in metadata_files_for_mirroring[str(repository.pk)].keys()
-            )
-            repo_gpgcheck = has_repomd_signature and repository.repo_config.get("repo_gpgcheck", 0)
+        if skipped_syncs:
+            report_skipped_sync(skipped_syncs, len(repo_sync_config))
 
-            publication.checksum_type = CHECKSUM_TYPES.UNKNOWN
-            publication.repo_config = {
-                "repo_gpgcheck": int(repo_gpgcheck),
-                "gpgcheck": int(gpgcheck),
-            }
+        if mirror_metadata:
+            with RpmPublication.create(
+                repo_sync_results[PRIMARY_REPO], pass_through=False
+            ) as publication:
+                gpgcheck = repository.repo_config.get("gpgcheck", 0)
+                has_repomd_signature = "repodata/repomd.xml.asc" in mirroring_store.metadata_files(
+                    repository
+                )
+                repo_gpgcheck = has_repomd_signature and repository.repo_config.get(
+                    "repo_gpgcheck", 0
+                )
+
+                publication.checksum_type = CHECKSUM_TYPES.UNKNOWN
+                publication.repo_config = {
+                    "repo_gpgcheck": int(repo_gpgcheck),
+                    "gpgcheck": int(gpgcheck),
+                }
 
-            for path, repo_version in repo_sync_results.items():
-                add_metadata_to_publication(publication, repo_version, prefix=path)
+                for path, repo_version in repo_sync_results.items():
+                    add_metadata_to_publication(
+                        publication, repo_version, mirroring_store, prefix=path
+                    )
 
     try:
         # This isn't exported for plugins until core/3.88 - but neither is the deprecation around
@@ -622,6 +1699,135 @@ def synchronize(remote_pk, repository_pk, sync_policy, skip_types, optimize, url
         return None
 
 
+def dispatch_sharded_sync(remote, repository, shards, **kwargs):
+    """
+    Dispatch the tasks of a sync which is split into shards, into the current task group.
+
+    The shards only share the repository, so they run in parallel once the current task is done,
+    and then the sync which creates the repository version from their packages needs it
+    exclusively, so it only starts once all of them are finished.
+
+    Args:
+        remote (RpmRemote or UlnRemote): The remote to sync from.
+        repository (RpmRepository): The repository to sync.
+        shards (int): How many shards the packages are split into.
+        kwargs (dict): The other parameters of the sync.
+    """
+    task_group = TaskGroup.current()
+    shard_tasks = [
+        dispatch(
+            synchronize_shard,
+            shared_resources=[remote, repository],
+            task_group=task_group,
+            kwargs={
+                "remote_pk": str(remote.pk),
+                "repository_pk": str(repository.pk),
+                "shard": shard,
+                "shards": shards,
+                "skip_types": kwargs["skip_types"],
+                "url": kwargs["url"],
+            },
+        )
+        for shard in range(shards)
+    ]
+    dispatch(
+        synchronize,
+        shared_resources=[remote],
+        exclusive_resources=[repository],
+        task_group=task_group,
+        kwargs={
+            "remote_pk": str(remote.pk),
+            "repository_pk": str(repository.pk),
+            "shard_task_pks": [str(task.pk) for task in shard_tasks],
+            **kwargs,
+        },
+    )
+
+
+def check_shard_tasks(shard_task_pks):
+    """
+    Check that all of the shard tasks of a sync have completed.
+
+    Args:
+        shard_task_pks (list): The PKs of the shard tasks.
+
+    Raises:
+        SyncError: If any of the shard tasks didn't complete.
+    """
+    incomplete = Task.objects.filter(pk__in=shard_task_pks).exclude(state=TASK_STATES.COMPLETED)
+    if incomplete.exists():
+        raise SyncError(
+            "{} of the {} shards of the sync did not complete.".format(
+                incomplete.count(), len(shard_task_pks)
+            )
+        )
+
+
+def synchronize_shard(remote_pk, repository_pk, shard, shards, skip_types, url=None):
+    """
+    Download and save the packages of one shard of the remote repository.
+
+    No repository version is created. The sync of the repository which runs after all of the
+    shards then finds the packages already saved, and only needs to associate them.
+
+    Args:
+        remote_pk (str): The remote PK.
+        repository_pk (str): The repository PK.
+        shard (int): Which shard of the packages to sync.
+        shards (int): How many shards the packages are split into.
+        skip_types (list): List of content to skip.
+        url(str): Custom URL to use instead of Remote's URL
+
+    """
+    try:
+        remote = RpmRemote.objects.get(pk=remote_pk)
+    except ObjectDoesNotExist:
+        remote = UlnRemote.objects.get(pk=remote_pk)
+    repository = RpmRepository.objects.get(pk=repository_pk)
+
+    if not remote.url and not url:
+        raise SyncError("A remote must have a url specified to synchronize.")
+
+    log.info(
+        _("Synchronizing shard {s} of {n}: repository={r} remote={p}").format(
+            s=shard + 1, n=shards, r=repository.name, p=remote.name
+        )
+    )
+
+    with tempfile.TemporaryDirectory(dir="."):
+        remote_url, *fallback_urls = fetch_remote_urls(remote, url)
+        stage = RpmFirstStage(
+            remote,
+            repository,
+            remote.policy != Remote.IMMEDIATE,
+            False,
+            skip_types=skip_types,
+            new_url=remote_url,
+            fallback_urls=fallback_urls[: MIRRORLIST_FAILOVER_MIRRORS - 1],
+            shard=(shard, shards),
+        )
+        resource_budget = ArtifactResourceBudget.from_settings()
+        # The content isn't associated with a repository version, nor related to other content
+        stages = [
+            stage,
+            QueryExistingArtifacts(),
+            ACSArtifactHandler(),
+            ArtifactDownloader(resource_budget=resource_budget),
+            ArtifactSaver(resource_budget=resource_budget),
+            QueryExistingContents(),
+        ]
+        if EXTRACT_SIGNING_KEYS:
+            stages.append(RpmSigningKeyExtractor())
+        stages.extend(
+            [
+                RpmContentSaver(),
+                RemoteArtifactSaver(fix_mismatched_remote_artifacts=True),
+                EndStage(),
+            ]
+        )
+        asyncio.get_event_loop().run_until_complete(create_pipeline(stages))
+
+
 class RpmDeclarativeVersion(DeclarativeVersion):
     """
     Subclassed Declarative version creates a custom pipeline for RPM sync.
@@ -663,6 +1869,12 @@ class RpmDeclarativeVersion(DeclarativeVersion):
                 ArtifactDownloader(resource_budget=resource_budget),
                 ArtifactSaver(resource_budget=resource_budget),
                 QueryExistingContents(),
+            ]
+        )
+        if EXTRACT_SIGNING_KEYS:
+            pipeline.append(RpmSigningKeyExtractor())
+        pipeline.extend(
+            [
                 RpmContentSaver(),
                 RpmInterrelateContent(),
                 RemoteArtifactSaver(fix_mismatched_remote_artifacts=True),
@@ -671,6 +1883,57 @@ class RpmDeclarativeVersion(DeclarativeVersion):
         return pipeline
 
 
+def create_repository_versions(declarative_versions, max_concurrency):
+    """
+    Create new versions of several repositories, running their sync pipelines concurrently.
+
+    This is equivalent to calling `create()` on each of the declarative versions in turn, except
+    that the pipelines share one event loop, so that the downloads and database queries of one
+    sync overlap with the work of the others. The repository versions are still finalized in
+    order, so the last one is finalized after all of the others are complete.
+
+    Args:
+        declarative_versions (list): The RpmDeclarativeVersions to create.
+        max_concurrency (int): The maximum number of pipelines to run at the same time.
+
+    Returns:
+        list: The created RepositoryVersions, or None for those which represent no change
+            from the latest version.
+    """
+    new_versions = [None] * len(declarative_versions)
+    pipelines = [None] * len(declarative_versions)
+
+    with tempfile.TemporaryDirectory(dir="."), contextlib.ExitStack() as stack:
+        # The versions are finalized when exiting the stack, in the reverse order of entering it
+        for index in reversed(range(len(declarative_versions))):
+            dv = declarative_versions[index]
+            new_versions[index] = stack.enter_context(dv.repository.new_version())
+            stages = dv.pipeline_stages(new_versions[index])
+            stages.append(ContentAssociation(new_versions[index], dv.mirror))
+            stages.append(EndStage())
+            pipelines[index] = stages
+
+        semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+        async def run_pipeline(stages):
+            async with semaphore:
+                await create_pipeline(stages)
+
+        async def run_pipelines():
+            tasks = [asyncio.ensure_future(run_pipeline(stages)) for stages in pipelines]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+
+        asyncio.get_event_loop().run_until_complete(run_pipelines())
+
+    return [new_version if new_version.complete else None for new_version in new_versions]
+
+
 class RpmFirstStage(Stage):
     """
     First stage of the Asyncio Stage Pipeline.
@@ -687,8 +1950,13 @@ class RpmFirstStage(Stage):
         mirror_metadata,
         skip_types=None,
         new_url=None,
+        fallback_urls=None,
         treeinfo=None,
         namespace="",
+        previous_record_checksums=None,
+        fetcher=None,
+        mirroring_store=None,
+        shard=None,
     ):
         """
         The first stage of a pulp_rpm sync pipeline.
@@ -704,8 +1972,18 @@ class RpmFirstStage(Stage):
         Keyword Args:
             skip_types (list): List of content to skip
             new_url(str): URL to replace remote url
+            fallback_urls(list): URLs of other mirrors of the same repository, which packages are
+                downloaded from if downloading them from the URL fails.
             treeinfo(dict): Treeinfo data
             namespace(str): Path where this repo is located relative to some parent repo.
+            previous_record_checksums(dict): The repomd record checksums of the previous sync,
+                if the content of the unchanged records may be carried forward.
+            fetcher(MetadataFetcher): The fetcher of the metadata files which have already been
+                downloaded during this sync.
+            mirroring_store(MirroringStore): Where to store data about the metadata files and
+                packages for mirror-publishing, if the metadata is mirrored.
+            shard(tuple): The shard (index, count) of the packages to sync, if only one of them
+                should be synced. No other content is synced then.
 
         """
         super().__init__()
@@ -724,31 +2002,50 @@ class RpmFirstStage(Stage):
         self.skip_types = [] if skip_types is None else skip_types
 
         self.remote_url = new_url or self.remote.url
+        self.fallback_urls = fallback_urls or []
 
         self.nevra_to_module = defaultdict(dict)
         self.pkgname_to_groups = defaultdict(list)
 
-    def is_illegal_relative_path(self, path):
-        """Whether a relative path points outside the repository being synced."""
-        return path.count("../") > self.namespace_depth
+        self.previous_record_checksums = previous_record_checksums
+        # The record types whose content is carried forward from the latest repository version
+        self.unchanged_record_types = set()
+        self.fetcher = fetcher
+        self.mirroring_store = mirroring_store
+        self.shard = shard
 
-    @staticmethod
-    async def parse_updateinfo(updateinfo_xml_path):
+    async def put(self, item):
         """
-        Parse updateinfo.xml to extact update info.
+        Pass a DeclarativeContent on to the next stage, unless it belongs to another shard.
 
         Args:
-            updateinfo_xml_path: a path to a downloaded updateinfo.xml
+            item (DeclarativeContent): The content to pass on.
+        """
+        if self.shard is not None:
+            shard, shards = self.shard
+            content = item.content
+            # Packages are assigned to shards by their checksum, which spreads them evenly
+            if not isinstance(content, Package) or int(content.pkgId[:8], 16) % shards != shard:
+                return
+        await super().put(item)
 
-        Returns:
-            :obj:`list` of :obj:`createrepo_c.UpdateRecord`: parsed update records
+    def package_urls(self, location_base, location_href):
+        """
+        The URLs to download a package from, in the order in which they should be tried.
 
+        The mirrors may not all be in sync with each other, but packages are verified against
+        their checksums, so a package can safely be downloaded from any of them.
         """
-        uinfo = cr.UpdateInfo()
+        if location_base:
+            return [urlpath_sanitize(location_base, location_href)]
+        return [
+            urlpath_sanitize(base_url, location_href)
+            for base_url in (self.remote_url, *self.fallback_urls)
+        ]
 
-        # TODO: handle parsing errors/warnings, warningcb callback can be used
-        cr.xml_parse_updateinfo(updateinfo_xml_path, uinfo)
-        return uinfo.updates
+    def is_illegal_relative_path(self, path):
+        """Whether a relative path points outside the repository being synced."""
+        return path.count("../") > self.namespace_depth
 
     async def run(self):
         """Build `DeclarativeContent` from the repodata."""
@@ -757,12 +2054,16 @@ class RpmFirstStage(Stage):
                 message="Downloading Metadata Files", code="sync.downloading.metadata"
             )
             async with ProgressReport(**progress_data) as metadata_pb:
-                # download repomd.xml
-                downloader = self.remote.get_downloader(
-                    url=urlpath_sanitize(self.remote_url, "repodata/repomd.xml")
-                )
-                result = await downloader.run()
-                store_metadata_for_mirroring(self.repository, result.path, "repodata/repomd.xml")
+                # download repomd.xml, unless it was already downloaded to check for changes
+                repomd_url = urlpath_sanitize(self.remote_url, "repodata/repomd.xml")
+                result = self.fetcher.results.get(repomd_url) if self.fetcher else None
+                if result is None:
+                    downloader = self.remote.get_downloader(url=repomd_url)
+                    result = await downloader.run()
+                if self.mirroring_store:
+                    self.mirroring_store.add_metadata_file(
+                        self.repository, result.path, "repodata/repomd.xml"
+                    )
                 await metadata_pb.aincrement()
 
                 repomd_path = result.path
@@ -783,17 +2084,109 @@ class RpmFirstStage(Stage):
                 repomd_downloaders = {}
                 repomd_files = {}
 
-                types_to_download = (
-                    set(PACKAGE_REPODATA)
-                    | set(UPDATE_REPODATA)
-                    | set(COMPS_REPODATA)
-                    | set(MODULAR_REPODATA)
-                )
+                if self.previous_record_checksums:
+                    self.unchanged_record_types = find_unchanged_record_types(
+                        {record.type: record.checksum for record in repomd.records},
+                        self.previous_record_checksums,
+                    )
+                    if self.unchanged_record_types:
+                        log.info(
+                            "Carrying forward the content of unchanged metadata: {}".format(
+                                ", ".join(sorted(self.unchanged_record_types))
+                            )
+                        )
+
+                if self.shard is not None:
+                    # Only the packages are synced by a shard, but they need the modules to know
+                    # whether they are modular
+                    types_to_download = set(PACKAGE_REPODATA) | set(MODULAR_REPODATA)
+                else:
+                    types_to_download = (
+                        set(PACKAGE_REPODATA)
+                        | set(UPDATE_REPODATA)
+                        | set(COMPS_REPODATA)
+                        | set(MODULAR_REPODATA)
+                    )
 
-                async def run_repomdrecord_download(name, location_href, downloader):
+                metadata_cache = MetadataCache.from_settings()
+
+                async def run_repomdrecord_download(name, location_href, downloader, record):
+                    if metadata_cache:
+                        result = await asyncio.to_thread(
+                            metadata_cache.get,
+                            record.checksum_type,
+                            record.checksum,
+                            downloader.url,
+                        )
+                        if result:
+                            return name, location_href, result
                     result = await downloader.run()
+                    if metadata_cache:
+                        await asyncio.to_thread(
+                            metadata_cache.put, record.checksum_type, record.checksum, result.path
+                        )
                     return name, location_href, result
 
+                # The zchunk versions of the package metadata can be downloaded incrementally, by
+                # reusing the chunks of the version from the previous sync, if it's in the cache
+                zck_records = {}
+                if ZCHUNK_METADATA and cr.HAS_ZCK and metadata_cache and not self.mirror_metadata:
+                    zck_records = {
+                        record.type.removesuffix("_zck"): record
+                        for record in repomd.records
+                        if record.type in {f"{name}_zck" for name in PACKAGE_REPODATA}
+                    }
+                previous_records = self.repository.last_sync_details.get("repomd_records", {})
+
+                async def run_zchunk_download(name, record):
+                    record.checksum_type = getattr(CHECKSUM_TYPES, record.checksum_type.upper())
+                    url = urlpath_sanitize(self.remote_url, record.location_href)
+                    downloader = self.remote.get_downloader(
+                        url=url,
+                        expected_size=record.size,
+                        expected_digests={record.checksum_type: record.checksum},
+                    )
+                    previous_checksum = previous_records.get(record.type)
+                    if not previous_checksum or previous_checksum == record.checksum:
+                        return await run_repomdrecord_download(
+                            name, record.location_href, downloader, record
+                        )
+
+                    result = await asyncio.to_thread(
+                        metadata_cache.get, record.checksum_type, record.checksum, url
+                    )
+                    if result:
+                        return name, record.location_href, result
+                    previous = await asyncio.to_thread(
+                        metadata_cache.get, record.checksum_type, previous_checksum, url
+                    )
+                    if previous:
+                        try:
+                            result = await download_zchunk_delta(
+                                self.remote,
+                                url,
+                                previous.path,
+                                record.checksum_type,
+                                record.checksum,
+                                record.size,
+                            )
+                        except (ZchunkError, ClientError, asyncio.TimeoutError) as exc:
+                            log.info(
+                                "Unable to download {} incrementally, downloading all of it: "
+                                "{}".format(url, exc)
+                            )
+                        else:
+                            await asyncio.to_thread(
+                                metadata_cache.put,
+                                record.checksum_type,
+                                record.checksum,
+                                result.path,
+                            )
+                            return name, record.location_href, result
+                    return await run_repomdrecord_download(
+                        name, record.location_href, downloader, record
+                    )
+
                 for record in repomd.records:
                     record_checksum_type = getattr(CHECKSUM_TYPES, record.checksum_type.upper())
                     checksum_types[record.type] = record_checksum_type
@@ -813,6 +2206,15 @@ class RpmFirstStage(Stage):
                     if not self.mirror_metadata and record.type not in types_to_download:
                         continue
 
+                    if record.type in self.unchanged_record_types:
+                        continue
+
+                    if record.type in zck_records:
+                        repomd_downloaders[record.type] = asyncio.ensure_future(
+                            run_zchunk_download(record.type, zck_records[record.type])
+                        )
+                        continue
+
                     base_url = record.location_base or self.remote_url
                     downloader = self.remote.get_downloader(
                         url=urlpath_sanitize(base_url, record.location_href),
@@ -820,13 +2222,18 @@ class RpmFirstStage(Stage):
                         expected_digests={record_checksum_type: record.checksum},
                     )
                     repomd_downloaders[record.type] = asyncio.ensure_future(
-                        run_repomdrecord_download(record.type, record.location_href, downloader)
+                        run_repomdrecord_download(
+                            record.type, record.location_href, downloader, record
+                        )
                     )
 
                 try:
                     for future in asyncio.as_completed(list(repomd_downloaders.values())):
                         name, location_href, result = await future
-                        store_metadata_for_mirroring(self.repository, result.path, location_href)
+                        if self.mirroring_store:
+                            self.mirroring_store.add_metadata_file(
+                                self.repository, result.path, location_href
+                            )
                         repomd_files[name] = result
                         await metadata_pb.aincrement()
                 except ClientResponseError as exc:
@@ -847,7 +2254,9 @@ class RpmFirstStage(Stage):
                                 silence_errors_for_response_status_codes={403, 404},
                             )
                             result = await downloader.run()
-                            store_metadata_for_mirroring(self.repository, result.path, file_href)
+                            self.mirroring_store.add_metadata_file(
+                                self.repository, result.path, file_href
+                            )
                             await metadata_pb.aincrement()
                         except (ClientResponseError, FileNotFoundError):
                             pass
@@ -859,7 +2268,7 @@ class RpmFirstStage(Stage):
                             silence_errors_for_response_status_codes={403, 404},
                         )
                         result = await downloader.run()
-                        store_metadata_for_mirroring(
+                        self.mirroring_store.add_metadata_file(
                             self.repository, result.path, "extra_files.json"
                         )
                         await metadata_pb.aincrement()
@@ -881,7 +2290,7 @@ class RpmFirstStage(Stage):
                                         expected_digests=filtered_checksums,
                                     )
                                     result = await downloader.run()
-                                    store_metadata_for_mirroring(
+                                    self.mirroring_store.add_metadata_file(
                                         self.repository, result.path, data["file"]
                                     )
                                     await metadata_pb.aincrement()
@@ -928,48 +2337,83 @@ class RpmFirstStage(Stage):
 
     async def parse_repository_metadata(self, repomd, metadata_results):
         """Parse repository metadata."""
-        if "primary" not in metadata_results.keys():
+        packages_unchanged = "primary" in self.unchanged_record_types
+
+        if "primary" not in metadata_results.keys() and not packages_unchanged:
             raise MissingPrimaryMetadataError()
 
-        if "filelists" not in metadata_results.keys():
+        if "filelists" not in metadata_results.keys() and not packages_unchanged:
             log.warn("Repository doesn't contain metadata file 'filelists.xml'")
 
-        if "other" not in metadata_results.keys():
+        if "other" not in metadata_results.keys() and not packages_unchanged:
             log.warn("Repository doesn't contain metadata file 'other.xml'")
 
         await self.parse_distribution_tree()
 
-        # modularity-parsing MUST COME BEFORE package-parsing!
-        # The only way to know if a package is 'modular' in a repo, is to
-        # know that it is referenced in modulemd.
-        modulemd_dcs = []
-        modulemd_result = metadata_results.get("modules", None)
-        modulemd_list = []
-        if modulemd_result:
-            # Need to check modules compression here because modules are parsed before
-            # all other metadata. And check for compression type of metadata few lines
-            # bellow only skip them if unsupported. If we cannot parse modulemd, package
-            # can't be flagged as 'modular' thus broken repository!
-            if modulemd_result.url.endswith("zck"):
-                raise UnsupportedModularCompressionError("zck")
-            modulemd_dcs, modulemd_list = await self.parse_modules_metadata(modulemd_result)
-
-        # **Now** we can successfully parse package-metadata
-        await self.parse_packages(
-            metadata_results.get("primary"),
-            metadata_results.get("filelists"),
-            metadata_results.get("other"),
-            modulemd_list=modulemd_list,
-        )
-
-        groups_list = []
+        # Nothing else depends on comps.xml and updateinfo.xml until the packages have been
+        # parsed, so parse them in worker processes in the meantime. The workers rely on Django
+        # having been set up already, so they need to be forked. No workers are started if
+        # neither of them was downloaded (e.g. both are unchanged since the last sync).
         comps_result = metadata_results.get("group", None)
-        if comps_result:
-            groups_list = await self.parse_packages_components(comps_result)
-
         updateinfo_result = metadata_results.get("updateinfo", None)
-        if updateinfo_result:
-            await self.parse_advisories(updateinfo_result)
+        num_to_parse = bool(comps_result) + bool(updateinfo_result)
+        with contextlib.ExitStack() as stack:
+            if num_to_parse:
+                executor = stack.enter_context(
+                    ProcessPoolExecutor(
+                        max_workers=num_to_parse, mp_context=multiprocessing.get_context("fork")
+                    )
+                )
+                tmp_dir = stack.enter_context(tempfile.TemporaryDirectory(dir="."))
+            loop = asyncio.get_running_loop()
+            if comps_result:
+                comps_future = loop.run_in_executor(executor, parse_comps_file, comps_result.path)
+            if updateinfo_result:
+                advisories_path = os.path.join(tmp_dir, "advisories")
+                advisories_future = loop.run_in_executor(
+                    executor, spool_advisories, updateinfo_result.path, advisories_path
+                )
+
+            # modularity-parsing MUST COME BEFORE package-parsing!
+            # The only way to know if a package is 'modular' in a repo, is to
+            # know that it is referenced in modulemd.
+            modulemd_dcs = []
+            modulemd_result = metadata_results.get("modules", None)
+            modulemd_list = []
+            if packages_unchanged:
+                await self.carry_forward_content(
+                    Modulemd, ModulemdDefaults, ModulemdObsolete, Package
+                )
+            elif modulemd_result:
+                # Need to check modules compression here because modules are parsed before
+                # all other metadata. And check for compression type of metadata few lines
+                # bellow only skip them if unsupported. If we cannot parse modulemd, package
+                # can't be flagged as 'modular' thus broken repository!
+                if modulemd_result.url.endswith("zck"):
+                    raise UnsupportedModularCompressionError("zck")
+                modulemd_dcs, modulemd_list = await self.parse_modules_metadata(modulemd_result)
+
+            # **Now** we can successfully parse package-metadata
+            if not packages_unchanged:
+                await self.parse_packages(
+                    metadata_results.get("primary"),
+                    metadata_results.get("filelists"),
+                    metadata_results.get("other"),
+                    modulemd_list=modulemd_list,
+                )
+
+            groups_list = []
+            if "group" in self.unchanged_record_types:
+                await self.carry_forward_content(
+                    PackageCategory, PackageEnvironment, PackageGroup, PackageLangpacks
+                )
+            elif comps_result:
+                groups_list = await self.parse_packages_components(await comps_future)
+
+            if "updateinfo" in self.unchanged_record_types:
+                await self.carry_forward_content(UpdateRecord)
+            elif updateinfo_result:
+                await self.parse_advisories(advisories_path, await advisories_future)
 
         # now send modules and groups down the pipeline since all relations have been set up
         for modulemd_dc in modulemd_dcs:
@@ -1016,6 +2460,25 @@ class RpmFirstStage(Stage):
                 dc = DeclarativeContent(content=repo_metadata_file, d_artifacts=[da])
                 await self.put(dc)
 
+    async def carry_forward_content(self, *content_types):
+        """
+        Emit the content of the given types from the latest repository version as-is.
+
+        Only the fields which make up the natural key are loaded, the content is already saved.
+
+        Args:
+            content_types (list): The content models to carry forward
+        """
+        latest_version = await sync_to_async(self.repository.latest_version)()
+        for content_type in content_types:
+            queryset = content_type.objects.filter(pk__in=latest_version.content).only(
+                *content_type.natural_key_fields()
+            )
+            async for content in queryset.aiterator(chunk_size=2000):
+                dc = DeclarativeContent(content=content)
+                dc.extra_data = defaultdict(list)
+                await self.put(dc)
+
     async def parse_modules_metadata(self, modulemd_result):
         """
         Parse modules' metadata which define what packages are built for specific releases.
@@ -1023,7 +2486,9 @@ class RpmFirstStage(Stage):
         Args:
             modulemd_result(pulpcore.download.base.DownloadResult): downloaded modulemd file
         """
-        modulemd_all, defaults_all, obsoletes_all = parse_modular(modulemd_result.path)
+        modulemd_all, defaults_all, obsoletes_all = parse_modular(
+            modulemd_result.path, workers=PARSE_WORKERS
+        )
 
         modulemd_dcs = []
 
@@ -1088,8 +2553,13 @@ class RpmFirstStage(Stage):
 
         return (modulemd_dcs, modulemd_all)
 
-    async def parse_packages_components(self, comps_result):
-        """Parse packages' components that define how are the packages bundled."""
+    async def parse_packages_components(self, comps):
+        """
+        Parse packages' components that define how are the packages bundled.
+
+        Args:
+            comps (dict): The comps.xml contents, as returned by `parse_comps_file`
+        """
         group_to_categories = defaultdict(list)
 
         group_to_environments = defaultdict(list)
@@ -1100,30 +2570,24 @@ class RpmFirstStage(Stage):
         dc_environments = []
         dc_groups = []
 
-        comps = libcomps.Comps()
-        with tempfile.TemporaryDirectory(dir=".") as tf:
-            decompressed_path = os.path.join(tf, "comps.xml")
-            cr.decompress_file(comps_result.path, decompressed_path, cr.AUTO_DETECT_COMPRESSION)
-            with open(decompressed_path) as f:
-                comps.fromxml_str(f.read())
-
         async with ProgressReport(message="Parsed Comps", code="sync.parsing.comps") as comps_pb:
-            comps_total = len(comps.groups) + len(comps.categories) + len(comps.environments)
+            comps_total = (
+                len(comps["groups"]) + len(comps["categories"]) + len(comps["environments"])
+            )
             comps_pb.total = comps_total
             comps_pb.done = comps_total
 
-        if comps.langpacks:
-            langpack_dict = PackageLangpacks.libcomps_to_dict(comps.langpacks)
+        if comps["langpacks"]:
+            langpack_matches, langpack_dict = comps["langpacks"]
             packagelangpack = PackageLangpacks(
-                matches=strdict_to_dict(comps.langpacks), digest=dict_digest(langpack_dict)
+                matches=langpack_matches, digest=dict_digest(langpack_dict)
             )
             package_language_pack_dc = DeclarativeContent(content=packagelangpack)
             package_language_pack_dc.extra_data = defaultdict(list)
 
         # init categories declarative content
-        if comps.categories:
-            for category in comps.categories:
-                category_dict = PackageCategory.libcomps_to_dict(category)
+        if comps["categories"]:
+            for category_dict in comps["categories"]:
                 category_dict["digest"] = dict_digest(category_dict)
                 packagecategory = PackageCategory(**category_dict)
                 dc = DeclarativeContent(content=packagecategory)
@@ -1135,9 +2599,8 @@ class RpmFirstStage(Stage):
                 dc_categories.append(dc)
 
         # init environments declarative content
-        if comps.environments:
-            for environment in comps.environments:
-                environment_dict = PackageEnvironment.libcomps_to_dict(environment)
+        if comps["environments"]:
+            for environment_dict in comps["environments"]:
                 environment_dict["digest"] = dict_digest(environment_dict)
                 packageenvironment = PackageEnvironment(**environment_dict)
                 dc = DeclarativeContent(content=packageenvironment)
@@ -1154,9 +2617,8 @@ class RpmFirstStage(Stage):
                 dc_environments.append(dc)
 
         # init groups declarative content
-        if comps.groups:
-            for group in comps.groups:
-                group_dict = PackageGroup.libcomps_to_dict(group)
+        if comps["groups"]:
+            for group_dict in comps["groups"]:
                 group_dict["digest"] = dict_digest(group_dict)
                 packagegroup = PackageGroup(**group_dict)
                 dc = DeclarativeContent(content=packagegroup)
@@ -1195,7 +2657,29 @@ class RpmFirstStage(Stage):
         return dc_groups
 
     async def parse_packages(self, primary_xml, filelists_xml, other_xml, modulemd_list=None):
-        """Parse packages from the remote repository."""
+        """
+        Parse packages from the remote repository.
+
+        Every package is verified and the information needed for the skip, retention and
+        duplicate-NEVRA decisions is collected while the metadata is streamed, and each package
+        is written to an on-disk spool. Once all of the decisions are known, the spool is
+        replayed in the original order and only the packages which survived are emitted.
+
+        How the metadata is streamed depends on whether the repository has been synced before:
+
+        * If the repository doesn't have any packages yet (e.g. on the first sync),
+          primary/filelists/other are streamed together exactly once.
+        * On a resync most packages are typically already present in the repository, and for
+          those only their location is needed. So only primary.xml is streamed up front, and
+          filelists.xml and other.xml are parsed afterwards for just the new packages. If too
+          many packages turn out to be new to hold them in memory, they are picked up with a
+          second streaming pass instead.
+        * If ``RPM_SYNC_PARSE_WORKERS`` is set, only primary.xml is streamed up front as well, and
+          the new packages are then converted by a pool of worker processes.
+
+        Either way, the new packages are looked up in the rest of the domain in batches before
+        they are converted, so that packages which were already saved are never built again.
+        """
         parser = cr.RepositoryReader.from_metadata_files(
             primary_xml.path,
             filelists_xml.path if filelists_xml else None,
@@ -1204,6 +2688,7 @@ class RpmFirstStage(Stage):
 
         # skip SRPM if defined
         skip_srpms = "srpm" in self.skip_types
+        mirroring_store = self.mirroring_store
         nevras = set()
         checksums = set()
         modular_artifact_nevras = set()
@@ -1226,18 +2711,53 @@ class RpmFirstStage(Stage):
         latest_build_time_by_nevra = {}
         # A list of package names seen in which order - used to calculate heuristics used by caching
         pkg_names_seen_order = []
+        # The NEVRA and build time of every spooled package, indexed by its position in the spool
+        spooled_nevras = []
+        spooled_build_times = array.array("q")
+
+        # Pre-load existing packages from the latest repo version keyed by pkgId.
+        # Cache hits reuse the saved model object, causing QueryExistingContents to
+        # skip them (because _state.adding is False on already-saved objects).
+        def _build_existing_packages_cache():
+            cache = ExistingPackageIndex()
+            latest_version = self.repository.latest_version()
+            if latest_version:
+                # only index what we need to handle already-synced packages
+                cache.add(Package.objects.filter(pk__in=latest_version.content.all()))
+            return cache
+
+        existing_packages = await sync_to_async(_build_existing_packages_cache)()
+
+        # Packages which aren't in the repository yet may still have been saved already, by
+        # syncing or uploading them into another repository in the domain. Look them up in bulk
+        # so that they are handled just like the packages which are in the repository.
+        def _add_domain_packages_to_cache(pkgids):
+            existing_packages.add(
+                Package.objects.filter(_pulp_domain=get_domain(), pkgId__in=pkgids)
+            )
 
-        # Perform various checks and potentially filter out unwanted packages
-        # We parse all of primary.xml first and fail fast if something is wrong.
-        # Collect a list of any package nevras() we don't want to include, and other checks
-        def verification_and_skip_callback(pkg):
+        # Records of saved packages claimed by a spooled entry, keyed by the position in the spool
+        claimed_packages = {}
+
+        # On a resync, defer parsing filelists.xml and other.xml until we know which packages
+        # are new. Until then, the new packages are held here, keyed by the position in the spool.
+        # When parsing in parallel, the new packages are always converted by the worker processes.
+        parallel_parse = PARSE_WORKERS > 1
+        delta_parse = parallel_parse or bool(existing_packages)
+        delta_parse_overflow = parallel_parse
+        pending_packages = {}
+        # The pkgIds of all of the new packages, keyed by the position in the spool
+        new_pkgids = {}
+
+        # Perform various checks and collect a list of any package nevras() we don't want to
+        # include. Everything we'll need later on is written to the spool as we go.
+        def verify_and_spool(pkg, spool):
             nonlocal pkgid_warning_triggered
             nonlocal nevra_warning_triggered
-            nonlocal package_skip_nevras
             nonlocal latest_packages_by_arch_and_name
             nonlocal total_packages
-            nonlocal latest_build_time_by_nevra
             nonlocal skipped_packages
+            nonlocal delta_parse_overflow
 
             total_packages += 1
             pkg_nevra = pkg.nevra()
@@ -1294,263 +2814,337 @@ class RpmFirstStage(Stage):
                 pkg_evr = Evr(pkg.epoch, pkg.version, pkg.release).sortkey()
                 latest_packages_by_arch_and_name[pkg.arch][pkg_name].append((pkg_evr, pkg_nevra))
 
-        # Ew, callback-based API, gross. The streaming API doesn't support optionally
-        # specifying particular files yet so we have to use the old way.
-        cr.xml_parse_primary(primary_xml.path, pkgcb=verification_and_skip_callback, do_files=False)
-
-        # Go through the package lists, sort them descending by EVR, ignore the first N and then
-        # add the remaining ones to the skip list.
-        for arch, packages in latest_packages_by_arch_and_name.items():
-            for name, versions in packages.items():
-                versions.sort(key=lambda p: p[0], reverse=True)
-                for pkg in versions[self.repository.retain_package_versions :]:
-                    evr, nevra = pkg
-                    package_skip_nevras.add(nevra)
-                    skipped_packages += 1
-
-        del latest_packages_by_arch_and_name
-
-        if skipped_packages:
-            msg = (
-                "Excluding {} packages "
-                "(duplicates, outdated or skipping was requested e.g. 'skip_types')"
-            )
-            log.info(msg.format(skipped_packages))
-
-        def score_grouping(items):
-            """
-            Score how well items are grouped together in a list.
-
-            Returns:
-                float: Score from 0 (completely scattered) to 1 (perfectly grouped)
-
-            Examples:
-                >>> score_grouping(["apple", "apple", "banana", "banana", "pear"])
-                1.0
-                >>> score_grouping(["apple", "banana", "apple", "banana", "pear"])
-                0.0 (or close to it)
-            """
-            if not items:
-                return 1.0
-
-            # Count actual number of runs (consecutive groups)
-            actual_runs = 1
-            for i in range(1, len(items)):
-                if items[i] != items[i - 1]:
-                    actual_runs += 1
-
-            # Count frequency of each item
-            from collections import Counter
-
-            counts = Counter(items)
-
-            # Minimum runs = number of unique items (best case: all grouped)
-            min_runs = len(counts)
-
-            # Maximum runs for this distribution (worst case: maximally scattered)
-            # Formula: min(total_items, 2 * sum_of_smaller_counts + 1)
-            sorted_counts = sorted(counts.values(), reverse=True)
-            other_counts_sum = sum(sorted_counts[1:])
-            max_runs = min(len(items), 2 * other_counts_sum + 1)
-
-            # Edge case: if all items are the same
-            if min_runs == max_runs:
-                return 1.0
-
-            # Normalize score: 1 = perfectly grouped, 0 = maximally scattered
-            score = (max_runs - actual_runs) / (max_runs - min_runs)
-
-            return score
-
-        last_seen_package_name = None
-        # for specific repos that are highly random but also have a small nubmer of unique names,
-        # let's use global caching for all packages instead of just like consecutive ones
-        pkg_names_count = len(set(pkg_names_seen_order))
-        repo_grouping_score = score_grouping(pkg_names_seen_order)
-        use_global_caching = repo_grouping_score < 0.25 and pkg_names_count < 25
-        log.debug(
-            f"use_global_caching: {use_global_caching} repo_grouping_score: {repo_grouping_score} "
-            f" pkg_names_count: {pkg_names_count}"
+            # Packages which are already present in the repository only need their location,
+            # everything else is converted to the dict used to construct the model later on
+            # (unless it's incomplete, because filelists.xml and other.xml haven't been parsed yet)
+            cached = existing_packages.pop(pkg.pkgId)
+            if cached is not None or delta_parse:
+                package_dict = None
+            else:
+                package_dict = Package.createrepo_to_dict(pkg)
+            index = spool.append((pkg.location_href, pkg.location_base, package_dict))
+            if cached is not None:
+                claimed_packages[index] = cached
+            elif delta_parse:
+                new_pkgids[index] = pkg.pkgId
+                if (
+                    not delta_parse_overflow
+                    and len(pending_packages) >= DELTA_PARSE_MAX_NEW_PACKAGES
+                ):
+                    delta_parse_overflow = True
+                    pending_packages.clear()
+                if not delta_parse_overflow:
+                    pending_packages[index] = pkg
+            spooled_nevras.append(pkg_nevra)
+            spooled_build_times.append(pkg.time_build)
+
+        def parse_pending_packages(parse_func, path):
+            """Add the data from filelists.xml or other.xml to the pending packages."""
+            # There can be multiple package entries with the same pkgId, fill them in order
+            pending_by_pkgid = defaultdict(collections.deque)
+            for pkg in pending_packages.values():
+                pending_by_pkgid[pkg.pkgId].append(pkg)
+
+            def newpkgcb(pkgId, name, arch):
+                candidates = pending_by_pkgid.get(pkgId)
+                # Returning None skips parsing the package entry altogether
+                return candidates.popleft() if candidates else None
+
+            parse_func(path, newpkgcb=newpkgcb)
+
+        async def lookup_and_spool(packages, spool):
+            """Look up a batch of packages in the domain before spooling them."""
+            pkgids = [pkg.pkgId for pkg in packages if pkg.pkgId not in existing_packages]
+            if pkgids:
+                await sync_to_async(_add_domain_packages_to_cache)(pkgids)
+            for pkg in packages:
+                verify_and_spool(pkg, spool)
+            packages.clear()
+
+        parallel_parser = ParallelPackageParser(
+            primary_xml.path,
+            filelists_xml.path if filelists_xml else None,
+            other_xml.path if other_xml else None,
+            workers=PARSE_WORKERS,
         )
 
-        progress_data = {
-            "message": "Skipping Packages",
-            "code": "sync.skipped.packages",
-            "done": skipped_packages,
-            "total": skipped_packages,
-        }
-        async with ProgressReport(**progress_data) as skipped_pb:
-            await skipped_pb.asave()
-
-        progress_data = {
-            "message": "Parsed Packages",
-            "code": "sync.parsing.packages",
-            "total": total_packages,
-        }
-        async with ProgressReport(**progress_data) as packages_pb:
-            # Pre-load existing packages from the latest repo version keyed by pkgId.
-            # Cache hits reuse the saved model object, causing QueryExistingContents to
-            # skip them (because _state.adding is False on already-saved objects).
-            def _build_existing_packages_cache():
-                cache = {}
-                latest_version = self.repository.latest_version()
-                if latest_version:
-                    # ignore particularly expensive metadata which we do not need to handle for already-synced packages
-                    for existing_pkg in (
-                        Package.objects.filter(pk__in=latest_version.content.all())
-                        .defer(
-                            "files",
-                            "requires",
-                            "provides",
-                            "changelogs",
-                        )
-                        .iterator()
-                    ):
-                        cache[existing_pkg.pkgId] = existing_pkg
-                return cache
-
-            existing_packages = await sync_to_async(_build_existing_packages_cache)()
-
-            string_cache = {}
-            tuple_cache = {}
+        with PackageSpool() as spool, parallel_parser:
+            if delta_parse:
+                # Only parse the files listed in primary.xml if there's no filelists.xml to
+                # take them from later on.
+                cr.xml_parse_primary(
+                    primary_xml.path,
+                    pkgcb=functools.partial(verify_and_spool, spool=spool),
+                    do_files=filelists_xml is None,
+                )
+            else:
+                package_batch = []
+                for pkg in parser.iter_packages():
+                    package_batch.append(pkg)
+                    if len(package_batch) >= PACKAGE_LOOKUP_BATCH_SIZE:
+                        await lookup_and_spool(package_batch, spool)
+                await lookup_and_spool(package_batch, spool)
+
+            # Anything left over was not referenced by the remote metadata at all
+            existing_packages.clear()
+
+            # Go through the package lists, sort them descending by EVR, ignore the first N and
+            # then add the remaining ones to the skip list.
+            for arch, packages in latest_packages_by_arch_and_name.items():
+                for name, versions in packages.items():
+                    versions.sort(key=lambda p: p[0], reverse=True)
+                    for pkg in versions[self.repository.retain_package_versions :]:
+                        evr, nevra = pkg
+                        package_skip_nevras.add(nevra)
+                        skipped_packages += 1
+
+            del latest_packages_by_arch_and_name
+
+            if skipped_packages:
+                msg = (
+                    "Excluding {} packages "
+                    "(duplicates, outdated or skipping was requested e.g. 'skip_types')"
+                )
+                log.info(msg.format(skipped_packages))
 
-            for pkg in parser.iter_packages():
-                pkg_nevra = pkg.nevra()
+            # Decide which of the spooled packages will actually be synced
+            selected = bytearray(len(spool))
+            for index, pkg_nevra in enumerate(spooled_nevras):
                 # Skip over packages (retention feature, skip_types feature)
                 if package_skip_nevras and pkg_nevra in package_skip_nevras:
                     continue
-                # Same heuristic as DNF / Yum / Zypper - in the event we encounter multiple package
-                # entries with the same NEVRA, pick the one with the larger build time. Ties are
-                # broken by first-seen: after the first package passes, the entry is replaced with
-                # a sentinel so that any subsequent package with the same NEVRA is filtered out.
-                elif pkg.time_build != latest_build_time_by_nevra[pkg_nevra]:
+                # Same heuristic as DNF / Yum / Zypper - in the event we encounter multiple
+                # package entries with the same NEVRA, pick the one with the larger build time.
+                # Ties are broken by first-seen: after the first package passes, the entry is
+                # replaced with a sentinel so that any subsequent package with the same NEVRA
+                # is filtered out.
+                elif spooled_build_times[index] != latest_build_time_by_nevra[pkg_nevra]:
                     continue
                 latest_build_time_by_nevra[pkg_nevra] = ALREADY_SEEN
-                # Typically (not always, but 90% of the time) like (same name, different arch
-                # or version) packages are grouped together metadata - this means that re-using
-                # the cache for runs of consecutive like packages is highly effective at saving
-                # memory yet while avoiding the overhead of the cache when it will go unused.
-                if pkg.name != last_seen_package_name and not use_global_caching:
-                    string_cache.clear()
-                    tuple_cache.clear()
-
-                # If we see a package that's in the cache (generated from latest repo_version)
-                # avoid generating a new empty Package and instead pass the saved one. This avoids
-                # more expensive queries down the line in QueryExistingContents.
-                cached = existing_packages.pop(pkg.pkgId, None)
-                if cached is not None:
-                    base_url = pkg.location_base or self.remote_url
-                    url = urlpath_sanitize(base_url, pkg.location_href)
-                    store_package_for_mirroring(self.repository, cached.pkgId, pkg.location_href)
-                    last_seen_package_name = pkg.name
-                    del pkg
-
-                    artifact = Artifact(size=cached.size_package)
-                    checksum_type = getattr(CHECKSUM_TYPES, cached.checksum_type.upper())
-                    setattr(artifact, checksum_type, cached.pkgId)
-                    da = DeclarativeArtifact(
-                        artifact=artifact,
-                        url=url,
-                        relative_path=cached.location_href,
-                        remote=self.remote,
-                        deferred_download=self.deferred_download,
-                    )
-                    dc = DeclarativeContent(content=cached, d_artifacts=[da])
-                    dc.extra_data = defaultdict(list)
-                else:
-                    # Implicit: There can be multiple package entries that are completely
-                    # identical (same NEVRA, same build time, same checksum / pkgid) and the
-                    # same or different location_href. We're not explicitly handling this, the
-                    # pipeline will deduplicate.
-                    package = Package(
-                        **Package.createrepo_to_dict(
-                            pkg, string_cache=string_cache, tuple_cache=tuple_cache
-                        )
-                    )
-                    # TODO: set signing_keys when we support package signing during sync
-                    package.signing_keys = None
-                    base_url = pkg.location_base or self.remote_url
-                    url = urlpath_sanitize(base_url, package.location_href)
-                    last_seen_package_name = pkg.name
-                    del pkg  # delete & free the memory as soon as we're done with it
-
-                    # Location_href is not a property of the Package in isolation [0], and
-                    # Pulp has a well defined way of generating the layout/locations on
-                    # publication time. We only need to use the original location_href for
-                    # metadata mirroring.
-                    # [0] https://github.com/pulp/pulp_rpm/issues/2580
-                    original_location_href = package.location_href
-                    package.location_href = package.filename
-                    store_package_for_mirroring(
-                        self.repository, package.pkgId, original_location_href
+                selected[index] = True
+
+            spooled_nevras.clear()
+            del spooled_build_times[:]
+
+            if delta_parse:
+                selected_new_pkgids = [
+                    (index, pkgId) for index, pkgId in new_pkgids.items() if selected[index]
+                ]
+                new_pkgids.clear()
+                for start in range(0, len(selected_new_pkgids), PACKAGE_LOOKUP_BATCH_SIZE):
+                    batch = selected_new_pkgids[start : start + PACKAGE_LOOKUP_BATCH_SIZE]
+                    await sync_to_async(_add_domain_packages_to_cache)(
+                        [pkgId for index, pkgId in batch]
                     )
+                    for index, pkgId in batch:
+                        cached = existing_packages.pop(pkgId)
+                        if cached is not None:
+                            claimed_packages[index] = cached
+                            pending_packages.pop(index, None)
+                del selected_new_pkgids
+                existing_packages.clear()
+
+            if delta_parse and not delta_parse_overflow:
+                for index in [index for index in pending_packages if not selected[index]]:
+                    del pending_packages[index]
+                log.debug(f"Parsing filelists and other for {len(pending_packages)} new packages")
+                if pending_packages:
+                    if filelists_xml:
+                        parse_pending_packages(cr.xml_parse_filelists, filelists_xml.path)
+                    if other_xml:
+                        parse_pending_packages(cr.xml_parse_other, other_xml.path)
+            elif parallel_parse:
+                new_positions = [
+                    index
+                    for index in range(len(spool))
+                    if selected[index] and index not in claimed_packages
+                ]
+                log.debug(f"Parsing {len(new_positions)} new packages in {PARSE_WORKERS} workers")
+                parallel_parser.start(new_positions)
+                del new_positions
+            elif delta_parse:
+                log.debug("Too many new packages to parse filelists and other separately")
+                package_stream = iter(parser.iter_packages())
+                package_stream_position = -1
+
+            last_seen_package_name = None
+            # for specific repos that are highly random but also have a small nubmer of unique
+            # names, let's use global caching for all packages instead of just like consecutive ones
+            pkg_names_count = len(set(pkg_names_seen_order))
+            repo_grouping_score = score_grouping(pkg_names_seen_order)
+            use_global_caching = repo_grouping_score < 0.25 and pkg_names_count < 25
+            log.debug(
+                f"use_global_caching: {use_global_caching} "
+                f"repo_grouping_score: {repo_grouping_score} "
+                f" pkg_names_count: {pkg_names_count}"
+            )
 
-                    artifact = Artifact(size=package.size_package)
-                    checksum_type = getattr(CHECKSUM_TYPES, package.checksum_type.upper())
-                    setattr(artifact, checksum_type, package.pkgId)
-                    da = DeclarativeArtifact(
-                        artifact=artifact,
-                        url=url,
-                        relative_path=package.location_href,
-                        remote=self.remote,
-                        deferred_download=self.deferred_download,
-                    )
-                    dc = DeclarativeContent(content=package, d_artifacts=[da])
-                    dc.extra_data = defaultdict(list)
-
-                # find if a package relates to a modulemd
-                if dc.content.nevra in self.nevra_to_module.keys():
-                    if dc.content._state.adding:  # don't edit existing packages though
-                        dc.content.is_modular = True
-                    for dc_modulemd in self.nevra_to_module[dc.content.nevra]:
-                        dc.extra_data["modulemd_relation"].append(dc_modulemd)
-                        dc_modulemd.extra_data["package_relation"].append(dc)
-
-                if dc.content.name in self.pkgname_to_groups.keys():
-                    for dc_group in self.pkgname_to_groups[dc.content.name]:
-                        dc.extra_data["group_relations"].append(dc_group)
-                        dc_group.extra_data["related_packages"].append(dc)
-
-                await packages_pb.aincrement()  # TODO: don't do this for every individual package
-                await self.put(dc)
+            progress_data = {
+                "message": "Skipping Packages",
+                "code": "sync.skipped.packages",
+                "done": skipped_packages,
+                "total": skipped_packages,
+            }
+            async with ProgressReport(**progress_data) as skipped_pb:
+                await skipped_pb.asave()
+
+            progress_data = {
+                "message": "Parsed Packages",
+                "code": "sync.parsing.packages",
+                "total": total_packages,
+            }
+            async with ProgressReport(**progress_data) as packages_pb:
+                string_cache = {}
+                tuple_cache = {}
+
+                for index in range(len(spool)):
+                    if not selected[index]:
+                        continue
+                    pkg_name = pkg_names_seen_order[index]
+                    # Typically (not always, but 90% of the time) like (same name, different arch
+                    # or version) packages are grouped together metadata - this means that
+                    # re-using the cache for runs of consecutive like packages is highly effective
+                    # at saving memory yet while avoiding the overhead of the cache when it will go
+                    # unused.
+                    if pkg_name != last_seen_package_name and not use_global_caching:
+                        string_cache.clear()
+                        tuple_cache.clear()
+                    last_seen_package_name = pkg_name
+
+                    location_href, location_base, package_dict = spool.load(index)
+                    urls = self.package_urls(location_base, location_href)
+
+                    # If we see a package that's in the cache (generated from latest repo_version)
+                    # avoid generating a new empty Package and instead pass the saved one. This
+                    # avoids more expensive queries down the line in QueryExistingContents.
+                    cached = claimed_packages.pop(index, None)
+                    if cached is not None:
+                        cached = existing_packages.to_package(cached)
+                        if mirroring_store:
+                            mirroring_store.add_package(
+                                self.repository, cached.pkgId, location_href
+                            )
 
-    async def parse_advisories(self, result):
-        """Parse advisories from the remote repository."""
-        updateinfo_xml_path = result.path
+                        artifact = Artifact(size=cached.size_package)
+                        checksum_type = getattr(CHECKSUM_TYPES, cached.checksum_type.upper())
+                        setattr(artifact, checksum_type, cached.pkgId)
+                        da = DeclarativeArtifact(
+                            artifact=artifact,
+                            urls=urls,
+                            relative_path=cached.location_href,
+                            remote=self.remote,
+                            deferred_download=self.deferred_download,
+                        )
+                        dc = DeclarativeContent(content=cached, d_artifacts=[da])
+                        dc.extra_data = defaultdict(list)
+                    else:
+                        if parallel_parse:
+                            package_dict = await parallel_parser.get()
+                        if package_dict is not None:
+                            package_dict[PULP_PACKAGE_ATTRS.FILES] = intern_file_entries(
+                                package_dict[PULP_PACKAGE_ATTRS.FILES], string_cache, tuple_cache
+                            )
+                        else:
+                            if delta_parse_overflow:
+                                while package_stream_position < index:
+                                    pkg = next(package_stream)
+                                    package_stream_position += 1
+                            else:
+                                pkg = pending_packages.pop(index)
+                            package_dict = Package.createrepo_to_dict(
+                                pkg, string_cache=string_cache, tuple_cache=tuple_cache
+                            )
+                            del pkg  # delete & free the memory as soon as we're done with it
+
+                        # Implicit: There can be multiple package entries that are completely
+                        # identical (same NEVRA, same build time, same checksum / pkgid) and the
+                        # same or different location_href. We're not explicitly handling this, the
+                        # pipeline will deduplicate.
+                        package = Package(**package_dict)
+                        # set by RpmSigningKeyExtractor, which reads them from the RPM header
+                        package.signing_keys = None
+                        del package_dict
+
+                        # Location_href is not a property of the Package in isolation [0], and
+                        # Pulp has a well defined way of generating the layout/locations on
+                        # publication time. We only need to use the original location_href for
+                        # metadata mirroring.
+                        # [0] https://github.com/pulp/pulp_rpm/issues/2580
+                        original_location_href = package.location_href
+                        package.location_href = package.filename
+                        if mirroring_store:
+                            mirroring_store.add_package(
+                                self.repository, package.pkgId, original_location_href
+                            )
+
+                        artifact = Artifact(size=package.size_package)
+                        checksum_type = getattr(CHECKSUM_TYPES, package.checksum_type.upper())
+                        setattr(artifact, checksum_type, package.pkgId)
+                        da = DeclarativeArtifact(
+                            artifact=artifact,
+                            urls=urls,
+                            relative_path=package.location_href,
+                            remote=self.remote,
+                            deferred_download=self.deferred_download,
+                        )
+                        dc = DeclarativeContent(content=package, d_artifacts=[da])
+                        dc.extra_data = defaultdict(list)
+
+                    # find if a package relates to a modulemd
+                    if dc.content.nevra in self.nevra_to_module.keys():
+                        if dc.content._state.adding:  # don't edit existing packages though
+                            dc.content.is_modular = True
+                        for dc_modulemd in self.nevra_to_module[dc.content.nevra]:
+                            dc.extra_data["modulemd_relation"].append(dc_modulemd)
+                            dc_modulemd.extra_data["package_relation"].append(dc)
+
+                    if dc.content.name in self.pkgname_to_groups.keys():
+                        for dc_group in self.pkgname_to_groups[dc.content.name]:
+                            dc.extra_data["group_relations"].append(dc_group)
+                            dc_group.extra_data["related_packages"].append(dc)
+
+                    await packages_pb.aincrement()  # TODO: don't do this for every package
+                    await self.put(dc)
+
+    async def parse_advisories(self, advisories_path, total):
+        """
+        Parse advisories from the remote repository.
 
-        updates = await RpmFirstStage.parse_updateinfo(updateinfo_xml_path)
+        Args:
+            advisories_path (str): The advisories, as written by `spool_advisories`
+            total (int): The number of advisories
+        """
         progress_data = {
             "message": "Parsed Advisories",
             "code": "sync.parsing.advisories",
-            "total": len(updates),
+            "total": total,
         }
         async with ProgressReport(**progress_data) as advisories_pb:
-            for update in updates:
-                update_record = UpdateRecord(**UpdateRecord.createrepo_to_dict(update))
-                update_record.pulp_domain = get_domain()
-                update_record.digest = hash_update_record(update)
-                future_relations = {"collections": defaultdict(list), "references": []}
-
-                for collection in update.collections:
-                    coll_dict = UpdateCollection.createrepo_to_dict(collection)
-                    if coll_dict["name"] is None:
-                        coll_dict["name"] = "collection-autofill-" + uuid.uuid4().hex[:12]
-                    coll = UpdateCollection(**coll_dict)
-
-                    for package in collection.packages:
-                        pkg_dict = UpdateCollectionPackage.createrepo_to_dict(package)
-                        pkg = UpdateCollectionPackage(**pkg_dict)
-                        future_relations["collections"][coll].append(pkg)
-
-                for reference in update.references:
-                    reference_dict = UpdateReference.createrepo_to_dict(reference)
-                    ref = UpdateReference(**reference_dict)
-                    future_relations["references"].append(ref)
-
-                await advisories_pb.aincrement()
-                dc = DeclarativeContent(content=update_record)
-                dc.extra_data = future_relations
-                await self.put(dc)
+            with open(advisories_path, "rb") as advisories_file:
+                for _ in range(total):
+                    record_dict, digest, collections, references = pickle.load(advisories_file)
+                    update_record = UpdateRecord(**record_dict)
+                    update_record.pulp_domain = get_domain()
+                    update_record.digest = digest
+                    future_relations = {"collections": defaultdict(list), "references": []}
+
+                    for coll_dict, pkg_dicts in collections:
+                        if coll_dict["name"] is None:
+                            coll_dict["name"] = "collection-autofill-" + uuid.uuid4().hex[:12]
+                        coll = UpdateCollection(**coll_dict)
+
+                        for pkg_dict in pkg_dicts:
+                            pkg = UpdateCollectionPackage(**pkg_dict)
+                            future_relations["collections"][coll].append(pkg)
+
+                    for reference_dict in references:
+                        ref = UpdateReference(**reference_dict)
+                        future_relations["references"].append(ref)
+
+                    await advisories_pb.aincrement()
+                    dc = DeclarativeContent(content=update_record)
+                    dc.extra_data = future_relations
+                    await self.put(dc)
 
 
 class RpmInterrelateContent(Stage):
@@ -1605,6 +3199,84 @@ class RpmInterrelateContent(Stage):
                 await self.put(declarative_content)
 
 
+class RpmSigningKeyExtractor(Stage):
+    """
+    A stage that extracts the signing keys of new packages from their RPM headers.
+
+    The header is read from the artifact of the package if it has been downloaded already, or
+    otherwise only its byte range is downloaded from the remote, as listed in primary.xml.
+    """
+
+    async def run(self):
+        """
+        Extract the signing keys of the new packages of each batch.
+        """
+        storage = self.domain.get_storage()
+
+        def read_artifact_header(artifact, header_end):
+            with storage.open(artifact.file.name) as artifact_file:
+                return artifact_file.read(header_end)
+
+        async def fetch_header(d_artifact, header_end):
+            downloader = d_artifact.remote.get_downloader(url=d_artifact.url)
+            extra_data = {"request_kwargs": {"headers": {"Range": f"bytes=0-{header_end - 1}"}}}
+            result = await downloader.run(extra_data=extra_data)
+            # The server may have sent the whole file if it doesn't support range requests
+            with open(result.path, "rb") as f:
+                data = f.read(header_end)
+            os.unlink(result.path)
+            return data
+
+        # The packages whose signing keys couldn't be extracted, with the reason why
+        failures = []
+
+        async def extract_signing_keys(d_content):
+            package = d_content.content
+            d_artifact = d_content.d_artifacts[0]
+            try:
+                if not d_artifact.artifact._state.adding:
+                    data = await sync_to_async(read_artifact_header)(
+                        d_artifact.artifact, package.rpm_header_end
+                    )
+                else:
+                    data = await fetch_header(d_artifact, package.rpm_header_end)
+                package.signing_keys = await asyncio.to_thread(
+                    extract_signing_keys_from_header, data
+                )
+            except (ClientError, asyncio.TimeoutError, OSError, ValueError) as exc:
+                # The header couldn't be downloaded, read or parsed (rpm_rs raises OSError)
+                log.debug(
+                    "Unable to extract the signing keys of package {}: {}".format(
+                        package.filename, exc
+                    )
+                )
+                failures.append((package.filename, exc))
+
+        async for batch in self.batches():
+            await asyncio.gather(
+                *(
+                    extract_signing_keys(d_content)
+                    for d_content in batch
+                    if d_content is not None
+                    and isinstance(d_content.content, Package)
+                    and d_content.content._state.adding
+                    and d_content.content.signing_keys is None
+                    and d_content.content.rpm_header_end
+                    and d_content.d_artifacts
+                )
+            )
+            for d_content in batch:
+                await self.put(d_content)
+
+        if failures:
+            filename, exc = failures[0]
+            log.warning(
+                "Unable to extract the signing keys of {} packages, e.g. of {}: {}".format(
+                    len(failures), filename, exc
+                )
+            )
+
+
 class RpmContentSaver(ContentSaver):
     """
     A modification of ContentSaver stage that additionally saves RPM plugin specific items.
@@ -1676,7 +3348,27 @@ class RpmContentSaver(ContentSaver):
         update_collection_to_save = []
         update_references_to_save = []
         update_collection_packages_to_save = []
-        seen_updaterecords = []
+        seen_updaterecords = set()
+
+        # existing content which was retrieved from the db at earlier stages already has its
+        # relations, find all of it for the whole batch at once
+        update_record_pks = [
+            declarative_content.content.pk
+            for declarative_content in batch
+            if declarative_content is not None
+            and isinstance(declarative_content.content, UpdateRecord)
+        ]
+        update_records_with_relations = set()
+        if update_record_pks:
+            update_records_with_relations = set(
+                UpdateCollection.objects.filter(update_record_id__in=update_record_pks)
+                .values_list("update_record_id", flat=True)
+                .union(
+                    UpdateReference.objects.filter(
+                        update_record_id__in=update_record_pks
+                    ).values_list("update_record_id", flat=True)
+                )
+            )
 
         for declarative_content in batch:
             if declarative_content is None:
@@ -1688,11 +3380,7 @@ class RpmContentSaver(ContentSaver):
             elif isinstance(declarative_content.content, UpdateRecord):
                 update_record = declarative_content.content
 
-                relations_exist = (
-                    update_record.collections.count() or update_record.references.count()
-                )
-                if relations_exist:
-                    # existing content which was retrieved from the db at earlier stages
+                if update_record.pk in update_records_with_relations:
                     continue
 
                 # if there are same update_records in a batch, the relations to the references
@@ -1701,7 +3389,7 @@ class RpmContentSaver(ContentSaver):
                 # It can happen easily during pulp 2to3 migration, or in case of a bad repo.
                 if update_record.digest in seen_updaterecords:
                     continue
-                seen_updaterecords.append(update_record.digest)
+                seen_updaterecords.add(update_record.digest)
 
                 future_relations = declarative_content.extra_data
                 update_collections = future_relations.get("collections", {})
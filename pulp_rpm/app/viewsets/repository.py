@@ -6,13 +6,13 @@ from rest_framework.decorators import action
 from rest_framework.serializers import ValidationError as DRFValidationError
 
 from pulpcore.plugin.actions import ModifyRepositoryActionMixin
-from pulpcore.plugin.models import ContentArtifact, RepositoryVersion
+from pulpcore.plugin.models import ContentArtifact, RepositoryVersion, TaskGroup
 from pulpcore.plugin.serializers import (
     AsyncOperationResponseSerializer,
     RepositoryAddRemoveContentSerializer,
 )
 from pulpcore.plugin.tasking import check_content, dispatch
-from pulpcore.plugin.util import extract_pk
+from pulpcore.plugin.util import extract_pk, reverse
 from pulpcore.plugin.viewsets import (
     DistributionViewSet,
     NamedModelViewSet,
@@ -243,6 +243,7 @@ class RpmRepositoryViewSet(RepositoryViewSet, RpmModifyRepositoryActionMixin, Ro
         sync_policy = serializer.validated_data.get("sync_policy")
         skip_types = serializer.validated_data.get("skip_types")
         optimize = serializer.validated_data.get("optimize")
+        shards = serializer.validated_data.get("shards", 1)
 
         if not sync_policy:
             sync_policy = SYNC_POLICIES.ADDITIVE if not mirror else SYNC_POLICIES.MIRROR_COMPLETE
@@ -263,19 +264,32 @@ class RpmRepositoryViewSet(RepositoryViewSet, RpmModifyRepositoryActionMixin, Ro
             if skip_types:
                 raise DRFValidationError(err_msg.format("skip_types"))
 
+        # A sharded sync dispatches the tasks of the shards into the task group, once it has
+        # checked that there is anything to sync
+        task_group = None
+        if shards > 1:
+            task_group = TaskGroup.objects.create(description="Sharded sync of an RPM repository.")
+
         result = dispatch(
             tasks.synchronize,
             shared_resources=[remote],
             exclusive_resources=[repository],
+            task_group=task_group,
             kwargs={
                 "sync_policy": sync_policy,
                 "remote_pk": str(remote.pk),
                 "repository_pk": str(repository.pk),
                 "skip_types": skip_types,
                 "optimize": optimize,
+                "shards": shards,
             },
         )
-        return OperationPostponedResponse(result, request)
+        response = OperationPostponedResponse(result, request)
+        if task_group:
+            response.data["task_group"] = reverse(
+                "task-groups-detail", kwargs={"pk": task_group.pk}, request=request
+            )
+        return response
 
 
 class RpmRepositoryVersionViewSet(RepositoryVersionViewSet):
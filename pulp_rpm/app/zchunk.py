@@ -0,0 +1,381 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from logging import getLogger
+
+from pulpcore.plugin.download import DownloadResult
+
+log = getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+LEAD_ID = b"\0ZCK1"
+# How many bytes to request up front, which covers the whole header of most files
+HEADER_REQUEST_SIZE = 64 * 1024
+# Ranges of missing chunks which are closer together than this are requested together
+RANGE_MERGE_GAP = 4 * 1024
+# The maximum number of range requests to make for a single file
+MAX_RANGE_REQUESTS = 64
+
+# The zchunk checksum types, and the sizes of their digests
+CHECKSUM_TYPES = {
+    0: ("sha1", 20),
+    1: ("sha256", 32),
+    2: ("sha512", 64),
+    # SHA-512 truncated to 128 bits
+    3: ("sha512", 16),
+}
+
+FLAG_HAS_STREAMS = 1
+FLAG_HAS_OPTIONAL_ELEMENTS = 2
+FLAG_HAS_UNCOMPRESSED_CHECKSUMS = 4
+
+
+class ZchunkError(ValueError):
+    """
+    Raised when a zchunk file can't be parsed, or reassembled from its chunks.
+    """
+
+
+def read_compint(data, offset):
+    """
+    Read a zchunk compressed integer.
+
+    The integers are stored little-endian in base 128, and the last byte has its high bit set.
+
+    Args:
+        data (bytes): The data to read from
+        offset (int): Where the integer starts
+
+    Returns:
+        tuple: The integer, and the offset right after it
+    """
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ZchunkError("Truncated zchunk header")
+        byte = data[offset]
+        offset += 1
+        if byte >= 128:
+            return value + ((byte - 128) << shift), offset
+        value += byte << shift
+        shift += 7
+
+
+def chunk_digest(checksum_type, data):
+    """
+    Compute the digest of a chunk, as it's stored in the zchunk index.
+
+    Args:
+        checksum_type (int): The zchunk checksum type
+        data (bytes): The (compressed) chunk
+
+    Returns:
+        bytes: The digest
+    """
+    name, size = CHECKSUM_TYPES[checksum_type]
+    return hashlib.new(name, data).digest()[:size]
+
+
+class ZchunkHeader:
+    """
+    The header of a zchunk file, i.e. everything which comes before its chunks.
+
+    Attributes:
+        length (int): The length of the whole header, i.e. where the chunks start
+        chunk_checksum_type (int): The zchunk checksum type of the chunk digests
+        chunks (list): The (digest, offset, length) of each chunk, with offsets relative to the
+            start of the file, in the order of the file. The first one is the dictionary.
+    """
+
+    def __init__(self, length, chunk_checksum_type, chunks):
+        self.length = length
+        self.chunk_checksum_type = chunk_checksum_type
+        self.chunks = chunks
+
+    @property
+    def size(self):
+        """The size of the whole file."""
+        if not self.chunks:
+            return self.length
+        _, offset, length = self.chunks[-1]
+        return offset + length
+
+    @staticmethod
+    def lead_length(data):
+        """
+        Parse the lead of a zchunk file, to find out the length of the whole header.
+
+        Args:
+            data (bytes): The start of the file, at least up to the end of the lead
+
+        Returns:
+            int: The length of the header
+        """
+        if not data.startswith(LEAD_ID):
+            raise ZchunkError("Not a zchunk file")
+        checksum_type, offset = read_compint(data, len(LEAD_ID))
+        if checksum_type not in CHECKSUM_TYPES:
+            raise ZchunkError(f"Unknown zchunk checksum type: {checksum_type}")
+        header_size, offset = read_compint(data, offset)
+        return offset + CHECKSUM_TYPES[checksum_type][1] + header_size
+
+    @classmethod
+    def parse(cls, data):
+        """
+        Parse the header of a zchunk file.
+
+        Args:
+            data (bytes): The start of the file, at least up to the end of the header
+
+        Returns:
+            ZchunkHeader: The header
+        """
+        length = cls.lead_length(data)
+        if len(data) < length:
+            raise ZchunkError("Truncated zchunk header")
+        data = data[:length]
+
+        # lead
+        checksum_type, offset = read_compint(data, len(LEAD_ID))
+        _, offset = read_compint(data, offset)
+        digest_size = CHECKSUM_TYPES[checksum_type][1]
+        offset += digest_size
+
+        # preface
+        offset += digest_size
+        flags, offset = read_compint(data, offset)
+        _, offset = read_compint(data, offset)
+        if flags & FLAG_HAS_OPTIONAL_ELEMENTS:
+            count, offset = read_compint(data, offset)
+            for _ in range(count):
+                _, offset = read_compint(data, offset)
+                element_size, offset = read_compint(data, offset)
+                offset += element_size
+
+        # index
+        index_size, offset = read_compint(data, offset)
+        index_end = offset + index_size
+        chunk_checksum_type, offset = read_compint(data, offset)
+        if chunk_checksum_type not in CHECKSUM_TYPES:
+            raise ZchunkError(f"Unknown zchunk checksum type: {chunk_checksum_type}")
+        chunk_digest_size = CHECKSUM_TYPES[chunk_checksum_type][1]
+        count, offset = read_compint(data, offset)
+
+        chunks = []
+        chunk_offset = length
+        while offset < index_end:
+            if flags & FLAG_HAS_STREAMS:
+                _, offset = read_compint(data, offset)
+            digest = data[offset : offset + chunk_digest_size]
+            offset += chunk_digest_size
+            if flags & FLAG_HAS_UNCOMPRESSED_CHECKSUMS:
+                offset += chunk_digest_size
+            chunk_length, offset = read_compint(data, offset)
+            _, offset = read_compint(data, offset)
+            chunks.append((digest, chunk_offset, chunk_length))
+            chunk_offset += chunk_length
+
+        if len(chunks) != count or offset != index_end:
+            raise ZchunkError("Corrupted zchunk index")
+        return cls(length, chunk_checksum_type, chunks)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Parse the header of a zchunk file on disk.
+
+        Args:
+            path (str): The path to the file
+
+        Returns:
+            ZchunkHeader: The header
+        """
+        with open(path, "rb") as f:
+            data = f.read(HEADER_REQUEST_SIZE)
+            length = cls.lead_length(data)
+            if length > len(data):
+                data += f.read(length - len(data))
+        return cls.parse(data)
+
+
+def missing_ranges(header, source_header, available_until=0):
+    """
+    Find the byte ranges of the chunks of a file which can't be copied from another version.
+
+    Args:
+        header (ZchunkHeader): The header of the file to reassemble
+        source_header (ZchunkHeader): The header of the file to copy chunks from
+        available_until (int): How many bytes from the start of the file are already available
+
+    Returns:
+        list: The (start, end) of the ranges, with the end being exclusive
+    """
+    available = set()
+    if source_header.chunk_checksum_type == header.chunk_checksum_type:
+        available = {digest for digest, _, length in source_header.chunks if length}
+
+    ranges = []
+    for digest, offset, length in header.chunks:
+        if not length or digest in available or offset + length <= available_until:
+            continue
+        if ranges and offset - ranges[-1][1] <= RANGE_MERGE_GAP:
+            ranges[-1][1] = offset + length
+        else:
+            ranges.append([offset, offset + length])
+
+    # Merge the ranges which are closest together, until there aren't too many of them
+    if len(ranges) > MAX_RANGE_REQUESTS:
+        gaps = sorted(ranges[i + 1][0] - ranges[i][1] for i in range(len(ranges) - 1))
+        max_gap = gaps[len(ranges) - MAX_RANGE_REQUESTS - 1]
+        merged = [ranges[0]]
+        for start, end in ranges[1:]:
+            if start - merged[-1][1] <= max_gap:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        ranges = merged
+
+    return [tuple(byte_range) for byte_range in ranges]
+
+
+def assemble(path, header_data, header, source_path, source_header, fetched_ranges):
+    """
+    Reassemble a zchunk file from its header, the chunks of another version, and fetched ranges.
+
+    Args:
+        path (str): Where to write the file
+        header_data (bytes): The start of the file, at least up to the end of the header
+        header (ZchunkHeader): The parsed header of the file
+        source_path (str): The path to the other version of the file
+        source_header (ZchunkHeader): The parsed header of the other version of the file
+        fetched_ranges (dict): The paths to the files holding the fetched ranges, keyed by the
+            (start, end) of the range
+
+    Raises:
+        ZchunkError: If a chunk is missing, or doesn't match its digest
+    """
+    source_chunks = {}
+    if source_header.chunk_checksum_type == header.chunk_checksum_type:
+        source_chunks = {
+            digest: (offset, length) for digest, offset, length in source_header.chunks
+        }
+
+    def read_fetched(offset, length):
+        if offset + length <= len(header_data):
+            return header_data[offset : offset + length]
+        for (start, end), range_path in fetched_ranges.items():
+            if start <= offset and offset + length <= end:
+                with open(range_path, "rb") as f:
+                    f.seek(offset - start)
+                    return f.read(length)
+        raise ZchunkError(f"Missing zchunk chunk at offset {offset}")
+
+    with open(path, "wb") as f, open(source_path, "rb") as source:
+        f.write(header_data[: header.length])
+        for digest, offset, length in header.chunks:
+            if not length:
+                continue
+            if digest in source_chunks:
+                source_offset, _ = source_chunks[digest]
+                source.seek(source_offset)
+                data = source.read(length)
+            else:
+                data = read_fetched(offset, length)
+            if len(data) != length or chunk_digest(header.chunk_checksum_type, data) != digest:
+                raise ZchunkError(f"Corrupted zchunk chunk at offset {offset}")
+            f.write(data)
+
+
+async def download_range(remote, url, start, end):
+    """
+    Download a range of bytes of a file.
+
+    Args:
+        remote (RpmRemote or UlnRemote): The remote to download with
+        url (str): The URL of the file
+        start (int): The first byte to download
+        end (int): The byte after the last one to download
+
+    Returns:
+        pulpcore.plugin.download.DownloadResult: The downloaded bytes, or the whole file if the
+            server doesn't support range requests
+    """
+    downloader = remote.get_downloader(url=url)
+    extra_data = {"request_kwargs": {"headers": {"Range": f"bytes={start}-{end - 1}"}}}
+    return await downloader.run(extra_data=extra_data)
+
+
+async def download_zchunk_delta(remote, url, source_path, checksum_type, checksum, size):
+    """
+    Download a zchunk file, fetching only the chunks which another version of it doesn't have.
+
+    The header is downloaded first, to find out which chunks the file consists of, and the
+    missing chunks are then fetched with range requests.
+
+    Args:
+        remote (RpmRemote or UlnRemote): The remote to download with
+        url (str): The URL of the file
+        source_path (str): The path to another version of the file
+        checksum_type (str): The type of the checksum of the file, e.g. "sha256"
+        checksum (str): The expected checksum of the file
+        size (int): The expected size of the file
+
+    Returns:
+        pulpcore.plugin.download.DownloadResult: The downloaded file
+
+    Raises:
+        ZchunkError: If the file can't be reassembled
+    """
+    source_header = await asyncio.to_thread(ZchunkHeader.from_file, source_path)
+
+    result = await download_range(remote, url, 0, min(HEADER_REQUEST_SIZE, size))
+    if os.path.getsize(result.path) == size:
+        # The server sent the whole file
+        path = result.path
+    else:
+        with open(result.path, "rb") as f:
+            header_data = f.read()
+        length = ZchunkHeader.lead_length(header_data)
+        if length > len(header_data):
+            result = await download_range(remote, url, len(header_data), length)
+            with open(result.path, "rb") as f:
+                header_data += f.read()
+        header = ZchunkHeader.parse(header_data)
+        if header.size != size:
+            raise ZchunkError("The size of the zchunk file doesn't match its metadata")
+
+        ranges = missing_ranges(header, source_header, available_until=len(header_data))
+        results = await asyncio.gather(
+            *(download_range(remote, url, start, end) for start, end in ranges)
+        )
+        fetched_ranges = {}
+        for (start, end), range_result in zip(ranges, results):
+            if os.path.getsize(range_result.path) != end - start:
+                raise ZchunkError("The server doesn't support range requests")
+            fetched_ranges[(start, end)] = range_result.path
+
+        path = tempfile.NamedTemporaryFile(dir=".", delete=False).name
+        await asyncio.to_thread(
+            assemble, path, header_data, header, source_path, source_header, fetched_ranges
+        )
+        log.info(
+            "Downloaded {} of {} bytes of {}".format(
+                len(header_data) + sum(end - start for start, end in ranges), size, url
+            )
+        )
+
+    digest = hashlib.new(checksum_type)
+    with open(path, "rb") as f:
+        while data := f.read(CHUNK_SIZE):
+            digest.update(data)
+    if digest.hexdigest() != checksum.lower():
+        raise ZchunkError(f"The reassembled zchunk file doesn't match its checksum: {url}")
+
+    return DownloadResult(
+        url=url,
+        artifact_attributes={checksum_type: checksum, "size": size},
+        path=path,
+        headers=None,
+    )
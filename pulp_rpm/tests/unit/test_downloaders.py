@@ -0,0 +1,108 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from aiohttp import ClientResponseError
+
+from pulp_rpm.app import downloaders
+from pulp_rpm.app.downloaders import ULN_SESSION_KEY_LIFETIME, ULN_SESSION_KEYS, UlnDownloader
+
+SESSION_KEYS = ["a" * 43, "b" * 43, "c" * 43]
+
+
+def make_response(status):
+    """Create a response to a download request, as an async context manager."""
+    response = MagicMock(status=status)
+    response.release = AsyncMock()
+    if status >= 400:
+        response.raise_for_status.side_effect = ClientResponseError(MagicMock(), (), status=status)
+    request = MagicMock()
+    request.__aenter__.return_value = response
+    return request
+
+
+class TestUlnDownloader(TestCase):
+    """Test the session keys shared by the ULN downloaders."""
+
+    def setUp(self):
+        ULN_SESSION_KEYS.clear()
+        self.session = MagicMock()
+        self.now = 1000.0
+
+        async def login(username, password):
+            await asyncio.sleep(0.01)
+            return SESSION_KEYS[self.login.await_count - 1]
+
+        self.login = AsyncMock(side_effect=login)
+        server_proxy = patch.object(downloaders, "AllowProxyServerProxy")
+        self.addCleanup(server_proxy.stop)
+        client = server_proxy.start().return_value
+        client.auth.login = self.login
+        client.close = AsyncMock()
+        # only the clock of the downloaders, the event loop needs the real one
+        clock = patch.object(downloaders, "time")
+        self.addCleanup(clock.stop)
+        clock.start().monotonic.side_effect = lambda: self.now
+
+    def tearDown(self):
+        ULN_SESSION_KEYS.clear()
+
+    def downloader(self, username="user"):
+        """Create a downloader of a package of a ULN channel."""
+        return UlnDownloader(
+            "uln://ol8_x86_64_baseos_latest/Packages/a.rpm",
+            session=self.session,
+            username=username,
+            password="password",
+            uln_server_base_url="https://linux-update.oracle.com/",
+        )
+
+    def test_concurrent_login(self):
+        """Test that concurrent downloaders log in once, and share the session key."""
+
+        async def get_session_keys():
+            uln_downloaders = [self.downloader() for _ in range(5)]
+            return await asyncio.gather(*(d._get_session_key() for d in uln_downloaders))
+
+        self.assertEqual([SESSION_KEYS[0]] * 5, asyncio.run(get_session_keys()))
+        self.assertEqual(1, self.login.await_count)
+        self.assertEqual(1, len(ULN_SESSION_KEYS))
+
+    def test_expired_session_key(self):
+        """Test that expired session keys are dropped, and renewed when needed."""
+        self.assertEqual(SESSION_KEYS[0], asyncio.run(self.downloader()._get_session_key()))
+        self.now += ULN_SESSION_KEY_LIFETIME - 1
+        self.assertEqual(SESSION_KEYS[0], asyncio.run(self.downloader()._get_session_key()))
+        self.assertEqual(1, self.login.await_count)
+
+        self.now += 1
+        self.assertEqual(SESSION_KEYS[1], asyncio.run(self.downloader()._get_session_key()))
+        self.assertEqual(2, self.login.await_count)
+        self.assertEqual(1, len(ULN_SESSION_KEYS))
+
+        # the expired session keys of other accounts are dropped when logging in
+        self.now += ULN_SESSION_KEY_LIFETIME
+        asyncio.run(self.downloader(username="other")._get_session_key())
+        self.assertEqual([SESSION_KEYS[2]], [key for key, expires in ULN_SESSION_KEYS.values()])
+
+    def test_renew_session_key(self):
+        """Test that a rejected session key is renewed, and the download retried once."""
+        self.session.get.side_effect = [make_response(401), make_response(200)]
+        downloader = self.downloader()
+        with patch.object(UlnDownloader, "_handle_response", AsyncMock(return_value="result")):
+            self.assertEqual("result", asyncio.run(downloader._run()))
+
+        self.assertEqual(2, self.login.await_count)
+        self.assertEqual(
+            [{"X-ULN-API-User-Key": key} for key in SESSION_KEYS[:2]],
+            [call.kwargs["headers"] for call in self.session.get.call_args_list],
+        )
+        self.assertEqual({SESSION_KEYS[1]}, {key for key, expires in ULN_SESSION_KEYS.values()})
+
+        # a download which is rejected again isn't retried any further
+        self.session.get.reset_mock()
+        self.session.get.side_effect = [make_response(403), make_response(401)]
+        with self.assertRaises(ClientResponseError):
+            asyncio.run(self.downloader()._run())
+        self.assertEqual(2, self.session.get.call_count)
+        self.assertEqual(3, self.login.await_count)
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import tempfile
+from unittest import TestCase
+
+from pulp_rpm.app.metadata_cache import MetadataCache
+
+
+class TestMetadataCache(TestCase):
+    """Test the cache of repository metadata files."""
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = self._tmp_dir.name
+        self._cwd = os.getcwd()
+        os.chdir(self.tmp_dir)
+        self.cache = MetadataCache(os.path.join(self.tmp_dir, "cache"), max_size=100)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp_dir.cleanup()
+
+    def write_file(self, content):
+        with tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False) as f:
+            f.write(content)
+        return f.name, hashlib.sha256(content).hexdigest()
+
+    def test_get_and_put(self):
+        """Test that a file added to the cache can be retrieved by its checksum."""
+        path, checksum = self.write_file(b"<metadata/>")
+
+        self.assertIsNone(self.cache.get("sha256", checksum, "http://example.com/primary.xml"))
+        self.cache.put("sha256", checksum, path)
+        result = self.cache.get("sha256", checksum, "http://example.com/primary.xml")
+
+        self.assertEqual("http://example.com/primary.xml", result.url)
+        self.assertNotEqual(path, result.path)
+        with open(result.path, "rb") as f:
+            self.assertEqual(b"<metadata/>", f.read())
+
+    def test_corrupted_file(self):
+        """Test that a file which doesn't match its checksum is discarded."""
+        path, checksum = self.write_file(b"<metadata/>")
+        self.cache.put("sha256", checksum, path)
+        with open(os.path.join(self.cache.directory, f"sha256-{checksum}"), "wb") as f:
+            f.write(b"<corrupted/>")
+
+        self.assertIsNone(self.cache.get("sha256", checksum, "http://example.com/primary.xml"))
+        self.assertEqual([], os.listdir(self.cache.directory))
+
+    def test_invalid_checksum(self):
+        """Test that checksums can't be used to point outside of the cache."""
+        path, _ = self.write_file(b"<metadata/>")
+        self.cache.put("sha256", "../../etc/passwd", path)
+
+        self.assertIsNone(self.cache.get("sha256", "../../etc/passwd", "http://example.com/"))
+        self.assertEqual([], os.listdir(self.cache.directory))
+
+    def test_evict_least_recently_used(self):
+        """Test that the least recently used files are evicted to stay within the size limit."""
+        files = [self.write_file(bytes([number]) * 40) for number in range(3)]
+        self.cache.put("sha256", files[0][1], files[0][0])
+        self.cache.put("sha256", files[1][1], files[1][0])
+        os.utime(os.path.join(self.cache.directory, f"sha256-{files[0][1]}"), (1, 1))
+        os.utime(os.path.join(self.cache.directory, f"sha256-{files[1][1]}"), (2, 2))
+        self.assertIsNotNone(self.cache.get("sha256", files[0][1], "http://example.com/"))
+
+        self.cache.put("sha256", files[2][1], files[2][0])
+
+        self.assertEqual(
+            sorted([f"sha256-{files[0][1]}", f"sha256-{files[2][1]}"]),
+            sorted(os.listdir(self.cache.directory)),
+        )
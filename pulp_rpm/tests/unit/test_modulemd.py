@@ -2,7 +2,7 @@ import os
 
 import yaml
 
-from pulp_rpm.app.modulemd import disable_pyyaml_magic_casting, parse_modular
+from pulp_rpm.app.modulemd import ModulemdLoader, disable_pyyaml_magic_casting, parse_modular
 
 sample_file_data = """
 ---
@@ -173,3 +173,22 @@ def test_disabling_pyyaml_magic_casting():
     assert result["inty"] == 83
     assert result["dicty"]["inty"] == 83
     assert result["listy"]["inty"] == 83
+
+
+def test_modulemd_loader_matches_safe_loader():
+    """The modulemd loader loads the same as SafeLoader without magic casting, and only that."""
+    with disable_pyyaml_magic_casting():
+        expected = list(yaml.load_all(sample_file_data, Loader=yaml.SafeLoader))
+
+    assert list(yaml.load_all(sample_file_data, Loader=ModulemdLoader)) == expected
+    assert yaml.load("inty: 00123", Loader=yaml.SafeLoader)["inty"] == 83
+
+
+def test_parse_modular_in_workers(tmp_path):
+    """Parsing the documents in worker processes gives the same result, in the same order."""
+    os.chdir(tmp_path)
+    file_name = "modulemd.yaml"
+    with open(file_name, "w") as file:
+        file.write(sample_file_data)
+
+    assert parse_modular(file_name, workers=2) == parse_modular(file_name)
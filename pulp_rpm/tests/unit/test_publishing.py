@@ -1,11 +1,104 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from unittest.mock import MagicMock, patch
+from uuid import uuid4
+
+import createrepo_c as cr
+from django.db import connections
 from django.test import TestCase
+from django.utils import timezone
+
+from pulpcore.plugin.models import AsciiArmoredDetachedSigningService, Content
+
+from pulp_rpm.app.models import Package, PackageMetadataFragment, UpdateRecord
+from pulp_rpm.app.tasks.publishing import (
+    BasePublication,
+    ChunkedXmlFile,
+    PackageInfo,
+    PkgBuild,
+    ReusedPackages,
+    _CollisionManager,
+    generate_repo_metadata,
+    generate_sub_repos_metadata,
+    iter_package_metadata,
+    prune_metadata_fragments,
+)
+
+
+def make_package(name):
+    """Create a createrepo_c package."""
+    package = cr.Package()
+    package.name = name
+    package.pkgId = name * 64
+    package.checksum_type = "sha256"
+    package.location_href = f"Packages/{name}.rpm"
+    package.time_file = 1700000000
+    return package
+
 
-from pulp_rpm.app.tasks.publishing import PkgBuild, _CollisionManager
+def write_repodata(directory, packages):
+    """Write the package metadata and an updateinfo.xml of a publication, and its repomd.xml."""
+    repomd = cr.Repomd()
+    for name, xml_file_class in [
+        ("primary", cr.PrimaryXmlFile),
+        ("filelists", cr.FilelistsXmlFile),
+        ("other", cr.OtherXmlFile),
+    ]:
+        path = os.path.join(directory, f"{name}.xml.gz")
+        xml_file = xml_file_class(path)
+        xml_file.set_num_of_pkgs(len(packages))
+        for package in packages:
+            xml_file.add_pkg(package)
+        xml_file.close()
+        record = cr.RepomdRecord(name, path)
+        record.fill(cr.SHA256)
+        repomd.set_record(record)
+    path = os.path.join(directory, "updateinfo.xml")
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<updates/>\n')
+    record = cr.RepomdRecord("updateinfo", path)
+    record.fill(cr.SHA256)
+    repomd.set_record(record)
+    with open(os.path.join(directory, "repomd.xml"), "w") as f:
+        f.write(repomd.xml_dump())
+
+
+class LocalBasePublication(BasePublication):
+    """A BasePublication whose metadata files are read from a local directory."""
+
+    def __init__(self, directory, added_types=(), added_packages=()):
+        self.local_directory = directory
+        repository_version = MagicMock()
+        added = repository_version.added.return_value.order_by.return_value
+        added.values_list.return_value.distinct.return_value = list(added_types)
+        added.filter.return_value.values_list.return_value = list(added_packages)
+        removed = repository_version.removed.return_value.order_by.return_value
+        removed.values_list.return_value.distinct.return_value = []
+        super().__init__(MagicMock(), repository_version)
+
+    def _fetch(self, relative_path):
+        path = os.path.join(self.local_directory, os.path.basename(relative_path))
+        return path if os.path.exists(path) else None
 
 
 class TestPublishing(TestCase):
     """Test the publishing task."""
 
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._cwd = os.getcwd()
+        os.chdir(self._tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp_dir.cleanup()
+
     def test_collision_manager(self):
         """Test that the collision manager is correctly choosing which packages to keep."""
         low_epoch = PkgBuild(cid=1, epoch=0, build_time=100)
@@ -30,3 +123,379 @@ class TestPublishing(TestCase):
         self.assertEqual([mid_build_time.cid], cm.retained_cids())
         cm.add(high_build_time, "nevra2", "path")
         self.assertEqual([high_build_time.cid], cm.retained_cids())
+
+    def test_reused_packages(self):
+        """Test that packages are found in the metadata regardless of small differences in order."""
+        packages = []
+        for name in ["a", "b", "c", "d"]:
+            package = cr.Package()
+            package.pkgId = name * 64
+            package.location_href = f"Packages/{name}.rpm"
+            packages.append(package)
+        reused_packages = ReusedPackages(
+            packages, {(pkg.pkgId, pkg.location_href) for pkg in packages[1:]}
+        )
+
+        self.assertIsNone(reused_packages.get("a" * 64, "Packages/a.rpm"))
+        self.assertIs(packages[2], reused_packages.get("c" * 64, "Packages/c.rpm"))
+        self.assertIs(packages[1], reused_packages.get("b" * 64, "Packages/b.rpm"))
+        self.assertIsNone(reused_packages.get("d" * 64, "Packages/moved/d.rpm"))
+        self.assertIs(packages[3], reused_packages.get("d" * 64, "Packages/d.rpm"))
+
+    def test_metadata_fragment_digest(self):
+        """Test that the stored snippets of a package are only reused if it's published the same."""
+        package_id = uuid4()
+        fields = [package_id, "sha256", "a" * 64, "Packages/f/foo.rpm", None]
+        digest = PackageMetadataFragment.calculate_digest(*fields)
+
+        self.assertEqual(digest, PackageMetadataFragment.calculate_digest(*fields))
+        for index, value in enumerate([uuid4(), "sha512", "b" * 64, "Packages/foo.rpm", 1]):
+            changed_fields = fields.copy()
+            changed_fields[index] = value
+            self.assertNotEqual(digest, PackageMetadataFragment.calculate_digest(*changed_fields))
+
+    def test_iter_package_metadata_fragments(self):
+        """Test that stored snippets are used and refreshed, and the missing ones are stored."""
+        stored_pk, new_pk = uuid4(), uuid4()
+        retained_packages = {
+            pk: PackageInfo(uuid4(), f"Packages/{name}.rpm", "sha256", name * 64)
+            for pk, name in [(stored_pk, "a"), (new_pk, "b")]
+        }
+        digests = {
+            pk: PackageMetadataFragment.calculate_digest(
+                pk, "sha256", pkg_info.checksum, pkg_info.path
+            )
+            for pk, pkg_info in retained_packages.items()
+        }
+        stale = timezone.now() - timedelta(days=2)
+        packages = MagicMock()
+        package_pks = packages.filter.return_value.order_by.return_value.values_list.return_value
+        package_pks.iterator.return_value = [stored_pk, new_pk]
+        packages.filter.return_value.values.return_value.iterator.return_value = [{"pk": new_pk}]
+        fragments = MagicMock()
+        fragments.filter.return_value.values_list.return_value = [
+            (digests[stored_pk], "primary", "filelists", "other", stale)
+        ]
+
+        with (
+            patch("pulp_rpm.app.tasks.publishing.RPM_PUBLISH_METADATA_FRAGMENTS", True),
+            patch.object(Package, "objects", packages),
+            patch.object(Package, "values_to_createrepo_c", return_value=make_package("b")),
+            patch.object(PackageMetadataFragment, "objects", fragments),
+        ):
+            snippets = list(iter_package_metadata(MagicMock(), retained_packages))
+
+        self.assertEqual(("primary", "filelists", "other"), snippets[0])
+        self.assertIn('<location href="Packages/b.rpm"/>', snippets[1][0])
+        packages.filter.assert_called_with(pk__in=[new_pk])
+        fragments.filter.assert_any_call(digest__in=[digests[stored_pk]])
+        fragments.filter.return_value.update.assert_called_once()
+        (new_fragments,), kwargs = fragments.bulk_create.call_args
+        self.assertEqual([digests[new_pk]], [fragment.digest for fragment in new_fragments])
+        fragment = new_fragments[0]
+        self.assertEqual(snippets[1], (fragment.primary, fragment.filelists, fragment.other))
+        self.assertEqual({"ignore_conflicts": True}, kwargs)
+
+    def test_prune_metadata_fragments(self):
+        """Test that only the snippets which haven't been used for a while are pruned."""
+        with patch.object(PackageMetadataFragment, "objects") as fragments:
+            fragments.filter.return_value.delete.return_value = (3, {})
+            self.assertEqual(3, prune_metadata_fragments())
+
+        cutoff = fragments.filter.call_args.kwargs["pulp_last_updated__lt"]
+        self.assertAlmostEqual(
+            timezone.now() - timedelta(days=30), cutoff, delta=timedelta(minutes=1)
+        )
+
+    def test_values_to_createrepo_c(self):
+        """Test that packages are converted from queried values, leaving out the other fields."""
+        package = Package.values_to_createrepo_c(
+            {
+                "name": "foo",
+                "checksum_type": "sha",
+                "files": [["", "/usr/bin/", "foo"], ["dir", "/usr/share/", "foo"]],
+                "time_file": 1700000000,
+            }
+        )
+
+        self.assertEqual("foo", package.name)
+        self.assertEqual("sha1", package.checksum_type)
+        self.assertEqual(
+            {("", "/usr/bin/", "foo"), ("dir", "/usr/share/", "foo")}, set(package.files)
+        )
+        self.assertEqual(1700000000, package.time_file)
+        self.assertIsNone(package.pkgId)
+        self.assertIsNone(package.location_href)
+
+    def test_chunked_xml_file(self):
+        """Test that metadata compressed in chunks reads the same as if it was written at once."""
+        packages = []
+        for number in range(50):
+            package = cr.Package()
+            package.name = f"package-{number}"
+            package.pkgId = f"{number:064x}"
+            package.checksum_type = "sha256"
+            package.location_href = f"Packages/package-{number}.rpm"
+            package.files = [("", "/usr/share/doc/", f"file-{number}")]
+            packages.append(package)
+
+        executors = [
+            partial(ThreadPoolExecutor, 2),
+            partial(ProcessPoolExecutor, 2, mp_context=multiprocessing.get_context("fork")),
+        ]
+        for executor_class in executors:
+            with tempfile.TemporaryDirectory() as tmp_dir, executor_class() as executor:
+                for compression_type in [cr.GZ, cr.ZSTD, cr.NO_COMPRESSION]:
+                    suffix = cr.compression_suffix(compression_type) or ""
+                    expected_path = os.path.join(tmp_dir, f"expected.xml{suffix}")
+                    chunked_path = os.path.join(tmp_dir, f"filelists.xml{suffix}")
+                    expected = cr.FilelistsXmlFile(expected_path, compressiontype=compression_type)
+                    expected.set_num_of_pkgs(len(packages))
+                    chunked = ChunkedXmlFile(
+                        chunked_path,
+                        cr.FilelistsXmlFile,
+                        compression_type,
+                        len(packages),
+                        executor,
+                        2,
+                        tmp_dir,
+                        chunk_size=1000,
+                    )
+                    for package in packages:
+                        snippet = cr.xml_dump(package)[1]
+                        expected.add_chunk(snippet)
+                        chunked.add_chunk(snippet)
+                    expected.close()
+                    chunked.close()
+
+                    records = []
+                    for path in [expected_path, chunked_path]:
+                        record = cr.RepomdRecord("filelists", path)
+                        record.fill(cr.SHA256)
+                        records.append(record)
+                        os.unlink(path)
+                    self.assertEqual(records[0].checksum_open, records[1].checksum_open)
+                    self.assertEqual(records[0].size_open, records[1].size_open)
+                    if compression_type == cr.NO_COMPRESSION:
+                        self.assertEqual(records[0].checksum, records[1].checksum)
+                    else:
+                        self.assertGreater(records[1].size, records[0].size)
+                self.assertEqual([], os.listdir(tmp_dir))
+
+    def test_generate_repo_metadata_workers(self):
+        """Test that the rest of the metadata is only written in threads outside of transactions."""
+        packages = [make_package(name) for name in ["a", "b", "c"]]
+        retained_packages = {
+            uuid4(): PackageInfo(uuid4(), pkg.location_href, "sha256", pkg.pkgId)
+            for pkg in packages
+        }
+        publication = MagicMock(checksum_type="sha256")
+
+        for in_atomic_block in [True, False]:
+            writer_threads = []
+
+            def write(*args):
+                writer_threads.append(threading.current_thread())
+                return False
+
+            with (
+                patch("pulp_rpm.app.tasks.publishing.RPM_PUBLISH_WORKERS", 2),
+                patch("pulp_rpm.app.tasks.publishing.connection") as connection,
+                patch(
+                    "pulp_rpm.app.tasks.publishing.iter_package_metadata",
+                    return_value=[cr.xml_dump(pkg) for pkg in packages],
+                ),
+                patch("pulp_rpm.app.tasks.publishing.write_updateinfo", side_effect=write),
+                patch("pulp_rpm.app.tasks.publishing.write_modules_yaml", side_effect=write),
+                patch("pulp_rpm.app.tasks.publishing.write_comps_xml", side_effect=write),
+            ):
+                connection.in_atomic_block = in_atomic_block
+                published_files = generate_repo_metadata(
+                    MagicMock(), publication, {}, [], retained_packages=retained_packages
+                )
+
+            if in_atomic_block:
+                self.assertEqual([threading.current_thread()] * 3, writer_threads)
+                connection.close.assert_not_called()
+            else:
+                self.assertNotIn(threading.current_thread(), writer_threads)
+                self.assertEqual(3, connection.close.call_count)
+            primary_path = next(path for path, _ in published_files if "primary" in path)
+            parsed = []
+            cr.xml_parse_primary(primary_path, pkgcb=parsed.append, do_files=False)
+            self.assertEqual(["a", "b", "c"], [pkg.name for pkg in parsed])
+            shutil.rmtree("repodata")
+
+    def test_generate_sub_repos_metadata(self):
+        """Test that sub-repos are written by forked workers, unless within a transaction."""
+        sub_repo_args = [
+            (Content.objects.filter(pk__in=[uuid4()]), "publication", {}, [], name)
+            for name in ["addon", "variant"]
+        ]
+
+        def generate(content, publication, checksum_types, extra_repomdrecords, sub_folder):
+            # the content is rebuilt from its query in the workers, which don't use the
+            # connection of the task
+            task_connection = connections["default"].connection is not None
+            return [(sub_folder, os.getpid(), str(content.query.where), task_connection)]
+
+        for in_atomic_block in [False, True]:
+            progress_report = MagicMock()
+            # the connection of the task, with a transaction or not
+            task_connection = MagicMock()
+            with (
+                patch("pulp_rpm.app.tasks.publishing.RPM_PUBLISH_SUBREPO_WORKERS", 2),
+                patch.object(connections["default"], "connection", task_connection),
+                patch.object(connections["default"], "in_atomic_block", in_atomic_block),
+                patch("pulp_rpm.app.tasks.publishing.generate_repo_metadata", side_effect=generate),
+            ):
+                sub_repo_files = generate_sub_repos_metadata(sub_repo_args, progress_report)
+                # the task goes on with its connection once the workers are done
+                self.assertIs(task_connection, connections["default"].connection)
+            task_connection.close.assert_not_called()
+
+            self.assertEqual(
+                [
+                    [(name, str(content.query.where))]
+                    for content, _publication, _checksum_types, _records, name in sub_repo_args
+                ],
+                [[(name, where) for name, _pid, where, _conn in files] for files in sub_repo_files],
+            )
+            pids = {pid for files in sub_repo_files for _name, pid, _where, _conn in files}
+            used_task_connection = {conn for files in sub_repo_files for *_, conn in files}
+            self.assertEqual(2, progress_report.increment.call_count)
+            if in_atomic_block:
+                self.assertEqual({os.getpid()}, pids)
+                self.assertEqual({True}, used_task_connection)
+            else:
+                self.assertNotIn(os.getpid(), pids)
+                self.assertEqual({False}, used_task_connection)
+
+    def test_generate_repo_metadata_signed_sub_repo(self):
+        """Test that the metadata of a sub-repo is signed, and its key is published next to it."""
+
+        def sign(path):
+            signature_path = f"{path}.asc"
+            with open(signature_path, "w") as signature:
+                signature.write("signature")
+            return {"file": path, "signature": signature_path}
+
+        signing_service = MagicMock(public_key="public key")
+        signing_service.sign.side_effect = sign
+        with (
+            patch("pulp_rpm.app.tasks.publishing.iter_package_metadata", return_value=[]),
+            patch("pulp_rpm.app.tasks.publishing.write_updateinfo", return_value=False),
+            patch("pulp_rpm.app.tasks.publishing.write_modules_yaml", return_value=False),
+            patch("pulp_rpm.app.tasks.publishing.write_comps_xml", return_value=False),
+            patch.object(AsciiArmoredDetachedSigningService, "objects") as signing_services,
+        ):
+            signing_services.get.return_value = signing_service
+            published_files = generate_repo_metadata(
+                MagicMock(),
+                MagicMock(checksum_type="sha256"),
+                {},
+                [],
+                sub_folder="addon",
+                metadata_signing_service=uuid4(),
+            )
+
+        relative_paths = [relative_path for relative_path, _path in published_files]
+        for name in ["repomd.xml", "repomd.xml.asc", "repomd.xml.key"]:
+            self.assertIn(f"addon/repodata/{name}", relative_paths)
+        with open("addon/repodata/repomd.xml.key") as key:
+            self.assertEqual("public key", key.read())
+
+    def test_base_publication_find(self):
+        """Test that the latest complete publication with the same settings is reused."""
+        publication = MagicMock()
+        with (
+            patch("pulp_rpm.app.tasks.publishing.RpmPublication") as rpm_publication,
+            patch.object(BasePublication, "__init__", return_value=None) as init,
+        ):
+            query = rpm_publication.objects.filter.return_value.exclude.return_value
+            first = query.select_related.return_value.order_by.return_value.first
+            self.assertIsInstance(BasePublication.find(publication), BasePublication)
+            init.assert_called_once_with(first.return_value, publication.repository_version)
+            rpm_publication.objects.filter.assert_called_once_with(
+                repository_version__repository=publication.repository_version.repository,
+                complete=True,
+                checksum_type=publication.checksum_type,
+                compression_type=publication.compression_type,
+                layout=publication.layout,
+            )
+            rpm_publication.objects.filter.return_value.exclude.assert_called_once_with(
+                pk=publication.pk
+            )
+
+            first.return_value = None
+            self.assertIsNone(BasePublication.find(publication))
+
+    def test_base_publication(self):
+        """Test that the unchanged metadata files of a publication are copied."""
+        packages = [make_package(name) for name in ["a", "b"]]
+        os.mkdir("base")
+        write_repodata("base", packages)
+        base_publication = LocalBasePublication("base", added_types=[Package.get_pulp_type()])
+
+        self.assertTrue(base_publication.changed(Package))
+        self.assertTrue(base_publication.changed(UpdateRecord, Package))
+        self.assertFalse(base_publication.changed(UpdateRecord))
+        self.assertTrue(base_publication.copy("updateinfo", "updateinfo.xml"))
+        with open("updateinfo.xml") as f, open("base/updateinfo.xml") as base_file:
+            self.assertEqual(base_file.read(), f.read())
+        self.assertFalse(base_publication.copy("group", "comps.xml"))
+        self.assertFalse(os.path.exists("comps.xml"))
+        self.assertEqual(
+            {(pkg.pkgId, pkg.location_href): 1700000000 for pkg in packages},
+            base_publication.package_keys(),
+        )
+
+        os.unlink("base/filelists.xml.gz")
+        self.assertIsNone(LocalBasePublication("base").package_keys())
+
+    def test_reuse_package_metadata(self):
+        """Test that package metadata is copied if unchanged, and otherwise parsed for reuse."""
+        packages = [make_package(name) for name in ["a", "b", "c"]]
+        os.mkdir("base")
+        write_repodata("base", packages)
+        package_ids = [uuid4() for package in packages]
+        retained_packages = {
+            pk: PackageInfo(uuid4(), pkg.location_href, "sha256", pkg.pkgId)
+            for pk, pkg in zip(package_ids, packages)
+        }
+        metadata_files = {name: f"{name}.xml.gz" for name in ["primary", "filelists", "other"]}
+
+        base_publication = LocalBasePublication("base")
+        copied, reused_packages = base_publication.reuse_package_metadata(
+            retained_packages, {}, metadata_files
+        )
+        self.assertTrue(copied)
+        self.assertIsNone(reused_packages)
+        for name, path in metadata_files.items():
+            with open(path, "rb") as f, open(f"base/{name}.xml.gz", "rb") as base_file:
+                self.assertEqual(base_file.read(), f.read())
+
+        # "a" was removed, "d" was added and "c" was moved without being added again
+        new_pk = uuid4()
+        del retained_packages[package_ids[0]]
+        retained_packages[new_pk] = PackageInfo(uuid4(), "Packages/d.rpm", "sha256", "d" * 64)
+        retained_packages[package_ids[2]] = PackageInfo(
+            uuid4(), "Packages/moved/c.rpm", "sha256", "c" * 64
+        )
+        base_publication = LocalBasePublication("base", added_packages=[new_pk])
+        copied, reused_packages = base_publication.reuse_package_metadata(
+            retained_packages, {}, metadata_files
+        )
+        self.assertFalse(copied)
+        # Only the packages which are in the metadata are looked for in it
+        self.assertEqual({("b" * 64, "Packages/b.rpm")}, reused_packages._keys)
+        self.assertEqual("b", reused_packages.get("b" * 64, "Packages/b.rpm").name)
+        self.assertIsNone(reused_packages.get("c" * 64, "Packages/moved/c.rpm"))
+
+        os.unlink("base/other.xml.gz")
+        self.assertEqual(
+            (False, None),
+            LocalBasePublication("base").reuse_package_metadata(
+                retained_packages, {}, metadata_files
+            ),
+        )
@@ -1,10 +1,15 @@
 from types import SimpleNamespace
 
+import createrepo_c as cr
 import pytest
 import requests
 import rpm_rs
 
-from pulp_rpm.app.shared_utils import extract_signing_keys, format_signing_keys
+from pulp_rpm.app.shared_utils import (
+    extract_signing_keys,
+    extract_signing_keys_from_header,
+    format_signing_keys,
+)
 from pulp_rpm.app.tasks.signing import _verify_package_fingerprint
 from pulp_rpm.tests.functional.constants import RPM_FIXTURE_SIGNED, RPM_FIXTURE_UNSIGNED
 
@@ -127,3 +132,10 @@ def test_extract_signing_keys_signed_rpm(signed_rpm):
 def test_extract_signing_keys_unsigned_rpm(unsigned_rpm):
     keys = extract_signing_keys(unsigned_rpm)
     assert keys == []
+
+
+def test_extract_signing_keys_from_header(signed_rpm):
+    header_end = cr.package_from_rpm(signed_rpm).rpm_header_end
+    with open(signed_rpm, "rb") as f:
+        header = f.read(header_end)
+    assert extract_signing_keys_from_header(header) == extract_signing_keys(signed_rpm)
@@ -0,0 +1,782 @@
+import asyncio
+import glob
+import gzip
+import os
+import tempfile
+import uuid
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import AsyncMock, MagicMock, call, patch
+
+import createrepo_c as cr
+from aiohttp.client_exceptions import ClientConnectionError
+
+from pulpcore.plugin.download import DownloadResult
+from pulpcore.plugin.exceptions import SyncError
+
+from pulp_rpm.app.downloaders import NotModified
+from pulp_rpm.app.models import Package, UpdateRecord
+from pulp_rpm.app.tasks.synchronizing import (
+    ExistingPackageIndex,
+    MetadataFetcher,
+    MirroringStore,
+    PackageSpool,
+    ParallelPackageParser,
+    RpmContentSaver,
+    RpmFirstStage,
+    RpmSigningKeyExtractor,
+    check_shard_tasks,
+    create_repository_versions,
+    dispatch_sharded_sync,
+    fetch_mirror,
+    find_unchanged_record_types,
+    get_previous_record_checksums,
+    index_package_offsets,
+    intern_file_entries,
+    score_grouping,
+    synchronize,
+)
+
+
+def make_package(name):
+    """Create a createrepo_c package."""
+    package = cr.Package()
+    package.name = name
+    package.epoch = "0"
+    package.version = "1.0"
+    package.release = "1"
+    package.arch = "noarch"
+    package.pkgId = name * 64
+    package.checksum_type = "sha256"
+    package.location_href = f"Packages/{name}.rpm"
+    package.time_build = 1700000000
+    package.size_package = 1024
+    package.files = [("", "/usr/share/doc/", name)]
+    return package
+
+
+def write_package_metadata(directory, packages):
+    """Write the primary.xml, filelists.xml and other.xml of the packages."""
+    metadata_files = []
+    for name, xml_file_class in [
+        ("primary", cr.PrimaryXmlFile),
+        ("filelists", cr.FilelistsXmlFile),
+        ("other", cr.OtherXmlFile),
+    ]:
+        path = os.path.join(directory, f"{name}.xml")
+        xml_file = xml_file_class(path, compressiontype=cr.NO_COMPRESSION)
+        xml_file.set_num_of_pkgs(len(packages))
+        for package in packages:
+            xml_file.add_pkg(package)
+        xml_file.close()
+        metadata_files.append(SimpleNamespace(path=path))
+    return metadata_files
+
+
+def saved_package_record(package):
+    """The ExistingPackageIndex record of a package saved in the database."""
+    pk = uuid.uuid4()
+    fields = {"pulp_id": pk, "pulp_type": "rpm.package", "content_ptr_id": pk}
+    fields.update(checksum_type="sha256", is_modular=False, _pulp_domain_id=uuid.uuid4())
+    return tuple(
+        fields[field] if field in fields else getattr(package, field)
+        for field in ExistingPackageIndex.FIELDS
+    )
+
+
+class TestSynchronizing(TestCase):
+    """Test helpers used by the sync task."""
+
+    def parse_packages(self, packages, saved_packages, repository_packages=()):
+        """
+        Run RpmFirstStage.parse_packages() on the metadata of the packages.
+
+        Args:
+            packages (list): The createrepo_c packages in the metadata.
+            saved_packages (list): The packages which are saved in the domain.
+            repository_packages (list): The saved packages which are in the latest version of the
+                repository.
+
+        Returns:
+            tuple: The emitted DeclarativeContent, the pkgIds of each lookup of packages in the
+                domain, and the names of the packages which were converted from the metadata.
+        """
+        records = {package.pkgId: saved_package_record(package) for package in saved_packages}
+        lookups = []
+
+        def filter_packages(pk__in=None, pkgId__in=None, _pulp_domain=None):
+            if pkgId__in is None:
+                found = [records[package.pkgId] for package in repository_packages]
+            else:
+                lookups.append(list(pkgId__in))
+                found = [records[pkgId] for pkgId in pkgId__in if pkgId in records]
+            queryset = MagicMock(db="default")
+            queryset.values_list.return_value.iterator.return_value = found
+            return queryset
+
+        repository = MagicMock(retain_package_versions=0)
+        if not repository_packages:
+            repository.latest_version.return_value = None
+        progress_report = MagicMock()
+        progress_report.return_value.__aenter__.return_value = AsyncMock()
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            patch("pulpcore.app.util.default_domain", SimpleNamespace(pk=uuid.uuid4())),
+            patch("pulp_rpm.app.tasks.synchronizing.ProgressReport", progress_report),
+            patch.object(Package, "objects") as objects,
+            patch.object(
+                Package, "createrepo_to_dict", wraps=Package.createrepo_to_dict
+            ) as createrepo_to_dict,
+        ):
+            objects.filter.side_effect = filter_packages
+            stage = RpmFirstStage(MagicMock(url="https://example.com/"), repository, False, False)
+            stage._out_q = asyncio.Queue()
+            metadata_files = write_package_metadata(tmp_dir, packages)
+            asyncio.run(stage.parse_packages(*metadata_files, modulemd_list=[]))
+
+        emitted = [stage._out_q.get_nowait() for _ in range(stage._out_q.qsize())]
+        converted = [call.args[0].name for call in createrepo_to_dict.call_args_list]
+        return emitted, lookups, converted
+
+    def use_event_loop(self):
+        """Set a new event loop for the thread, which is what the sync task runs on in a worker."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.addCleanup(loop.close)
+        self.addCleanup(asyncio.set_event_loop, None)
+
+    def test_resume_interrupted_sync(self):
+        """Test that a sync run after an interrupted one reuses the packages it already saved."""
+        packages = [make_package(name) for name in "abcde"]
+        # "a" is in the repository, and the interrupted sync saved "b" and "c"
+        emitted, lookups, converted = self.parse_packages(
+            packages, packages[:3], repository_packages=packages[:1]
+        )
+        self.assertEqual(list("abcde"), [dc.content.name for dc in emitted])
+        self.assertEqual(
+            [False, False, False, True, True], [dc.content._state.adding for dc in emitted]
+        )
+        # Only the remaining packages are converted, and downloaded
+        self.assertEqual(["d", "e"], converted)
+        self.assertEqual([["b" * 64, "c" * 64, "d" * 64, "e" * 64]], lookups)
+
+    def test_lookup_domain_packages(self):
+        """Test that packages saved in the domain are looked up in batches, and reused."""
+        packages = [make_package(name) for name in "abcde"]
+        with patch("pulp_rpm.app.tasks.synchronizing.PACKAGE_LOOKUP_BATCH_SIZE", 2):
+            # the first sync of the repository, "b" and "d" were saved by another one
+            emitted, lookups, converted = self.parse_packages(packages, packages[1:4:2])
+            self.assertEqual(list("abcde"), [dc.content.name for dc in emitted])
+            self.assertEqual(
+                [True, False, True, False, True], [dc.content._state.adding for dc in emitted]
+            )
+            self.assertEqual(["a", "c", "e"], converted)
+            self.assertEqual([["a" * 64, "b" * 64], ["c" * 64, "d" * 64], ["e" * 64]], lookups)
+
+            # a later sync, only the packages which aren't in the repository are looked up
+            emitted, lookups, converted = self.parse_packages(
+                packages, packages[:2] + packages[3:4], repository_packages=packages[:1]
+            )
+            self.assertEqual(
+                [False, False, True, False, True], [dc.content._state.adding for dc in emitted]
+            )
+            self.assertEqual(["c", "e"], converted)
+            self.assertEqual([["b" * 64, "c" * 64], ["d" * 64, "e" * 64]], lookups)
+
+    def test_package_spool(self):
+        """Test that records can be replayed by position, in any order."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with PackageSpool(directory=tmp_dir) as spool:
+                records = [("a.rpm", "", {"name": "a"}), ("b.rpm", "", None), ("c.rpm", "", {})]
+                indices = [spool.append(record) for record in records]
+
+                self.assertEqual([0, 1, 2], indices)
+                self.assertEqual(3, len(spool))
+                self.assertEqual(records[2], spool.load(2))
+                self.assertEqual(records[0], spool.load(0))
+                spool.append(("d.rpm", "", None))
+                self.assertEqual(records[1], spool.load(1))
+                self.assertEqual(("d.rpm", "", None), spool.load(3))
+
+    def test_intern_file_entries(self):
+        """Test that identical file entries end up sharing the same objects."""
+        string_cache = {}
+        tuple_cache = {}
+        first = intern_file_entries(
+            [("", "".join(["/usr/", "bin"]), "foo")], string_cache, tuple_cache
+        )
+        second = intern_file_entries(
+            [("", "".join(["/usr/", "bin"]), "foo"), ("dir", "".join(["/usr/", "bin"]), "")],
+            string_cache,
+            tuple_cache,
+        )
+
+        self.assertEqual([("", "/usr/bin", "foo")], first)
+        self.assertIs(first[0], second[0])
+        self.assertIs(first[0][1], second[1][1])
+
+    def test_score_grouping(self):
+        """Test the package name grouping heuristic."""
+        self.assertEqual(1.0, score_grouping([]))
+        self.assertEqual(1.0, score_grouping(["apple", "apple", "banana", "banana", "pear"]))
+        self.assertEqual(0.0, score_grouping(["apple", "banana", "apple", "banana", "apple"]))
+
+    def test_existing_package_index_to_package(self):
+        """Test that an indexed record is turned into a saved, deferred package."""
+        pk = uuid.uuid4()
+        domain_pk = uuid.uuid4()
+        values = {
+            "pulp_id": pk,
+            "pulp_type": "rpm.package",
+            "content_ptr_id": pk,
+            "name": "foo",
+            "epoch": "0",
+            "version": "1.0",
+            "release": "1",
+            "arch": "noarch",
+            "pkgId": "abc123",
+            "checksum_type": "sha256",
+            "location_href": "foo-1.0-1.noarch.rpm",
+            "size_package": 1024,
+            "is_modular": False,
+            "_pulp_domain_id": domain_pk,
+        }
+        record = tuple(values[field] for field in ExistingPackageIndex.FIELDS)
+
+        package = ExistingPackageIndex().to_package(record)
+
+        self.assertFalse(package._state.adding)
+        self.assertEqual(pk, package.pk)
+        self.assertEqual("foo-0:1.0-1.noarch", package.nevra)
+        self.assertEqual(1024, package.size_package)
+        self.assertEqual("foo-1.0-1.noarch.rpm", package.location_href)
+        self.assertEqual(
+            (domain_pk, "foo", "0", "1.0", "1", "noarch", "sha256", "abc123"),
+            package.natural_key(),
+        )
+        self.assertIn("files", package.get_deferred_fields())
+
+    def test_parallel_package_parser(self):
+        """Test that packages converted by the workers are handed back in order."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with cr.RepositoryWriter(tmp_dir) as writer:
+                writer.set_num_of_pkgs(5)
+                for number in range(5):
+                    pkg = cr.Package()
+                    pkg.name = f"pkg{number}"
+                    pkg.epoch = "0"
+                    pkg.version = "1.0"
+                    pkg.release = "1"
+                    pkg.arch = "noarch"
+                    pkg.pkgId = str(number) * 64
+                    pkg.checksum_type = "sha256"
+                    pkg.location_href = f"pkg{number}-1.0-1.noarch.rpm"
+                    pkg.files = [("", "/usr/bin/", f"pkg{number}")]
+                    pkg.changelogs = [("someone", 1, f"change {number}")]
+                    writer.add_pkg(pkg)
+
+            def metadata_path(metadata_type):
+                return glob.glob(os.path.join(tmp_dir, "repodata", f"*-{metadata_type}.xml*"))[0]
+
+            async def parse(positions):
+                with ParallelPackageParser(
+                    metadata_path("primary"),
+                    metadata_path("filelists"),
+                    metadata_path("other"),
+                    workers=2,
+                    directory=tmp_dir,
+                ) as parser:
+                    parser.start(positions)
+                    return [await parser.get() for _ in positions]
+
+            package_dicts = asyncio.run(parse([0, 2, 3, 4]))
+
+        self.assertEqual(["pkg0", "pkg2", "pkg3", "pkg4"], [pkg["name"] for pkg in package_dicts])
+        self.assertEqual([(None, "/usr/bin/", "pkg2")], package_dicts[1]["files"])
+        self.assertEqual([("someone", 1, "change 3")], package_dicts[2]["changelogs"])
+
+    def test_index_package_offsets(self):
+        """Test that the packages are found in the metadata, and nothing else is."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            primary_path = os.path.join(tmp_dir, "primary.xml.gz")
+            primary = cr.PrimaryXmlFile(primary_path)
+            primary.set_num_of_pkgs(2)
+            for number in range(2):
+                pkg = cr.Package()
+                pkg.name = f"pkg{number}"
+                pkg.pkgId = str(number) * 64
+                pkg.checksum_type = "sha256"
+                pkg.rpm_packager = "someone"
+                primary.add_pkg(pkg)
+            primary.close()
+            decompressed_path = os.path.join(tmp_dir, "primary.xml")
+            offsets = index_package_offsets(primary_path, decompressed_path)
+            with open(decompressed_path, "rb") as f:
+                data = f.read()
+
+        self.assertEqual(3, len(offsets))
+        self.assertTrue(data[offsets[0] :].startswith(b'<package type="rpm">'))
+        self.assertIn(b"pkg0", data[offsets[0] : offsets[1]])
+        self.assertIn(b"pkg1", data[offsets[1] : offsets[2]])
+        self.assertEqual(b"</metadata>", data[offsets[2] :].strip())
+
+    def test_index_package_offsets_whitespace(self):
+        """Test that the packages are found whatever whitespace separates their attributes."""
+        data = (
+            b'<?xml version="1.0" encoding="UTF-8"?>\n'
+            b'<metadata xmlns="http://linux.duke.edu/metadata/common" packages="3">\n'
+            b'<package\n type="rpm"><name>pkg0</name><packager>someone</packager></package>\n'
+            b'<package\ttype="rpm"><name>pkg1</name></package>\n'
+            b"<package><name>pkg2</name></package>\n"
+            b"</metadata>\n"
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            primary_path = os.path.join(tmp_dir, "primary.xml.gz")
+            with gzip.open(primary_path, "wb") as f:
+                f.write(data)
+            offsets = index_package_offsets(primary_path, os.path.join(tmp_dir, "primary.xml"))
+
+        self.assertEqual(4, len(offsets))
+        for number, (start, end) in enumerate(zip(offsets, offsets[1:])):
+            self.assertTrue(data[start:end].startswith(b"<package"))
+            self.assertIn(f"<name>pkg{number}</name>".encode(), data[start:end])
+        self.assertEqual(b"</metadata>\n", data[offsets[3] :])
+
+    def test_find_unchanged_record_types(self):
+        """Test that records are only considered unchanged together with their group."""
+        previous = {
+            "primary": "a",
+            "filelists": "b",
+            "other": "c",
+            "modules": "d",
+            "updateinfo": "e",
+            "group": "f",
+            "productid": "g",
+        }
+
+        self.assertEqual(
+            {"primary", "filelists", "other", "modules", "updateinfo", "group"},
+            find_unchanged_record_types(previous, previous),
+        )
+        self.assertEqual(
+            {"primary", "filelists", "other", "modules", "group"},
+            find_unchanged_record_types({**previous, "updateinfo": "x"}, previous),
+        )
+        self.assertEqual(
+            {"updateinfo", "group"},
+            find_unchanged_record_types({**previous, "modules": "x"}, previous),
+        )
+        current = {key: value for key, value in previous.items() if key != "modules"}
+        self.assertEqual({"updateinfo", "group"}, find_unchanged_record_types(current, previous))
+        self.assertEqual(set(), find_unchanged_record_types({"primary": "a"}, {}))
+
+    def test_get_previous_record_checksums(self):
+        """Test that the previous records are only used if the sync parameters are unchanged."""
+        sync_details = {
+            "url": "http://example.com/repo/",
+            "download_policy": "on_demand",
+            "sync_policy": "mirror_content_only",
+            "most_recent_version": 2,
+            "revision": "2",
+            "repomd_checksum": "new",
+            "treeinfo_checksum": "",
+            "retain_package_versions": 0,
+            "skip_types": ["srpm"],
+            "repomd_records": {"primary": "a", "updateinfo": "new"},
+        }
+        last_sync_details = {
+            **sync_details,
+            "revision": "1",
+            "repomd_checksum": "old",
+            "repomd_records": {"primary": "a", "updateinfo": "old"},
+        }
+
+        self.assertEqual(
+            {"primary": "a", "updateinfo": "old"},
+            get_previous_record_checksums(sync_details, last_sync_details),
+        )
+        self.assertIsNone(
+            get_previous_record_checksums(sync_details, {**last_sync_details, "skip_types": []})
+        )
+        self.assertIsNone(
+            get_previous_record_checksums(
+                sync_details, {**last_sync_details, "most_recent_version": 1}
+            )
+        )
+        self.assertIsNone(
+            get_previous_record_checksums(
+                {**sync_details, "sync_policy": "mirror_complete"},
+                {**last_sync_details, "sync_policy": "mirror_complete"},
+            )
+        )
+        self.assertIsNone(get_previous_record_checksums(sync_details, {}))
+
+    def test_metadata_fetcher(self):
+        """Test that files are fetched once, and unchanged files are detected."""
+        repomd_url = "http://example.com/repodata/repomd.xml"
+        treeinfo_url = "http://example.com/.treeinfo"
+        result = DownloadResult(
+            url=repomd_url,
+            artifact_attributes={},
+            path="repomd.xml",
+            headers={"ETag": '"abc"', "Last-Modified": "Sat, 17 Oct 2026 00:00:00 GMT"},
+        )
+        downloader = MagicMock()
+        downloader.fetch.side_effect = [result, FileNotFoundError()]
+        remote = MagicMock()
+        remote.get_downloader.return_value = downloader
+
+        fetcher = MetadataFetcher(remote)
+        self.assertIs(result, fetcher.fetch(repomd_url))
+        self.assertIs(result, fetcher.fetch(repomd_url))
+        with self.assertRaises(FileNotFoundError):
+            fetcher.fetch(treeinfo_url)
+        with self.assertRaises(FileNotFoundError):
+            fetcher.fetch(treeinfo_url)
+        self.assertEqual(2, downloader.fetch.call_count)
+        validators = {
+            repomd_url: {"etag": '"abc"', "last_modified": "Sat, 17 Oct 2026 00:00:00 GMT"},
+            treeinfo_url: None,
+        }
+        self.assertEqual(validators, fetcher.validators)
+
+        downloader.fetch.side_effect = [NotModified(repomd_url), FileNotFoundError()]
+        self.assertTrue(MetadataFetcher(remote).unchanged(validators))
+        request_kwargs = downloader.fetch.call_args_list[2].kwargs["extra_data"]["request_kwargs"]
+        self.assertEqual(
+            {"If-None-Match": '"abc"', "If-Modified-Since": "Sat, 17 Oct 2026 00:00:00 GMT"},
+            request_kwargs["headers"],
+        )
+
+        downloader.fetch.side_effect = [result]
+        fetcher = MetadataFetcher(remote)
+        self.assertFalse(fetcher.unchanged(validators))
+        self.assertIs(result, fetcher.fetch(repomd_url))
+
+        self.assertFalse(MetadataFetcher(remote).unchanged({}))
+        self.assertFalse(
+            MetadataFetcher(remote).unchanged({repomd_url: {"etag": None, "last_modified": None}})
+        )
+        self.assertEqual(5, downloader.fetch.call_count)
+
+    def test_metadata_fetcher_kwargs(self):
+        """Test that unchanged files are checked with the parameters they were fetched with."""
+        mirrorlist_url = "http://example.com/mirrorlist?repo=base&arch=$basearch"
+        treeinfo_url = "http://example.com/.treeinfo"
+        result = DownloadResult(
+            url=mirrorlist_url, artifact_attributes={}, path="mirrorlist", headers={"ETag": '"a"'}
+        )
+        downloader = MagicMock()
+        downloader.fetch.side_effect = [result, FileNotFoundError()]
+        remote = MagicMock()
+        remote.get_downloader.return_value = downloader
+
+        fetcher = MetadataFetcher(remote)
+        fetcher.fetch(mirrorlist_url, urlencode=False)
+        with self.assertRaises(FileNotFoundError):
+            fetcher.fetch(treeinfo_url, silence_errors_for_response_status_codes={404, 403})
+        fetch_kwargs = {
+            mirrorlist_url: {"urlencode": False},
+            treeinfo_url: {"silence_errors_for_response_status_codes": [403, 404]},
+        }
+        self.assertEqual(fetch_kwargs, fetcher.fetch_kwargs)
+
+        remote.get_downloader.reset_mock()
+        downloader.fetch.side_effect = [NotModified(mirrorlist_url), FileNotFoundError()]
+        self.assertTrue(MetadataFetcher(remote).unchanged(fetcher.validators, fetch_kwargs))
+        self.assertEqual(
+            [
+                call(url=mirrorlist_url, urlencode=False),
+                call(url=treeinfo_url, silence_errors_for_response_status_codes={403, 404}),
+            ],
+            remote.get_downloader.call_args_list,
+        )
+
+    def test_fetch_mirror(self):
+        """Test that the valid mirrors of a mirrorlist are ranked by their response time."""
+        delays = {
+            "http://slow.example.com/repodata/repomd.xml": 0.05,
+            "http://fast.example.com/repodata/repomd.xml": 0,
+        }
+
+        def get_downloader(url, **kwargs):
+            async def run():
+                if url not in delays:
+                    raise ClientConnectionError(url)
+                await asyncio.sleep(delays[url])
+                return DownloadResult(url=url, artifact_attributes={}, path=None, headers={})
+
+            downloader = MagicMock()
+            downloader.run = run
+            downloader.fetch.return_value = DownloadResult(
+                url=url, artifact_attributes={}, path=mirrorlist.name, headers={}
+            )
+            return downloader
+
+        self.use_event_loop()
+        remote = MagicMock(url="http://mirrors.example.com/mirrorlist")
+        remote.get_downloader.side_effect = get_downloader
+        with tempfile.NamedTemporaryFile("w") as mirrorlist:
+            mirrorlist.write(
+                "# http://commented.example.com/\n"
+                "http://broken.example.com/\n"
+                "http://slow.example.com/\n"
+                "http://fast.example.com/\n"
+            )
+            mirrorlist.flush()
+            fetcher = MetadataFetcher(remote)
+            mirrors = fetch_mirror(remote, fetcher=fetcher)
+
+        self.assertEqual(["http://fast.example.com/", "http://slow.example.com/"], mirrors)
+        self.assertEqual(
+            "http://fast.example.com/repodata/repomd.xml",
+            fetcher.results["http://fast.example.com/repodata/repomd.xml"].url,
+        )
+
+    def test_dispatch_sharded_sync(self):
+        """Test that the shards are dispatched into the task group before the final sync."""
+        remote = MagicMock(pk=uuid.uuid4())
+        repository = MagicMock(pk=uuid.uuid4())
+        shard_tasks = [MagicMock(pk=uuid.uuid4()) for shard in range(3)]
+        with (
+            patch("pulp_rpm.app.tasks.synchronizing.TaskGroup") as task_group,
+            patch("pulp_rpm.app.tasks.synchronizing.dispatch") as dispatch,
+        ):
+            dispatch.side_effect = [*shard_tasks, MagicMock()]
+            dispatch_sharded_sync(
+                remote,
+                repository,
+                3,
+                sync_policy="additive",
+                skip_types=["srpm"],
+                optimize=True,
+                url=None,
+            )
+
+        self.assertEqual(4, dispatch.call_count)
+        for shard, shard_call in enumerate(dispatch.call_args_list[:3]):
+            self.assertEqual([remote, repository], shard_call.kwargs["shared_resources"])
+            self.assertIs(task_group.current.return_value, shard_call.kwargs["task_group"])
+            self.assertEqual(shard, shard_call.kwargs["kwargs"]["shard"])
+            self.assertEqual(3, shard_call.kwargs["kwargs"]["shards"])
+        sync_call = dispatch.call_args_list[3]
+        self.assertEqual([repository], sync_call.kwargs["exclusive_resources"])
+        self.assertIs(task_group.current.return_value, sync_call.kwargs["task_group"])
+        self.assertEqual(
+            [str(task.pk) for task in shard_tasks], sync_call.kwargs["kwargs"]["shard_task_pks"]
+        )
+        self.assertNotIn("shards", sync_call.kwargs["kwargs"])
+
+    def test_synchronize_finishes_task_group(self):
+        """Test that the task group of a sharded sync is finished however the first task ends."""
+        args = [str(uuid.uuid4()), str(uuid.uuid4()), "additive", [], True]
+        with (
+            patch("pulp_rpm.app.tasks.synchronizing.TaskGroup") as task_group,
+            patch("pulp_rpm.app.tasks.synchronizing._synchronize") as sync,
+        ):
+            # the shards were dispatched, or there was nothing to sync
+            sync.return_value = None
+            self.assertIsNone(synchronize(*args, shards=3))
+            task_group.current.return_value.finish.assert_called_once()
+
+            task_group.reset_mock()
+            sync.side_effect = SyncError("A remote must have a url specified to synchronize.")
+            with self.assertRaises(SyncError):
+                synchronize(*args, shards=3)
+            task_group.current.return_value.finish.assert_called_once()
+
+            # the sync which runs after the shards doesn't dispatch any more tasks
+            task_group.reset_mock()
+            sync.side_effect = None
+            synchronize(*args, shard_task_pks=[str(uuid.uuid4())])
+            task_group.current.assert_not_called()
+            task_group.current.return_value.finish.assert_not_called()
+
+    def test_create_repository_versions(self):
+        """Test that the versions are finalized in order, and none of them if any sync fails."""
+        exits = []
+
+        class NewVersion:
+            def __init__(self, name):
+                self.name = name
+                self.complete = False
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, exc_type, exc_value, traceback):
+                # like RepositoryVersion, which deletes itself if the sync failed
+                exits.append((self.name, exc_value is None))
+                self.complete = exc_value is None
+
+        def declarative_version(name):
+            dv = MagicMock()
+            dv.repository.new_version.side_effect = lambda: NewVersion(name)
+            dv.pipeline_stages.side_effect = lambda new_version: [name]
+            return dv
+
+        async def create_pipeline(stages):
+            name = stages[0]
+            if name == "b" and fail:
+                raise SyncError("b failed")
+            # "a" is still running when "b" fails
+            await asyncio.sleep(0.05 if name == "a" else 0)
+            finished.append(name)
+
+        self.use_event_loop()
+        declarative_versions = [declarative_version(name) for name in "abc"]
+        with (
+            patch("pulp_rpm.app.tasks.synchronizing.ContentAssociation"),
+            patch("pulp_rpm.app.tasks.synchronizing.EndStage"),
+            patch("pulp_rpm.app.tasks.synchronizing.create_pipeline", create_pipeline),
+        ):
+            fail = False
+            finished = []
+            new_versions = create_repository_versions(declarative_versions, max_concurrency=3)
+            self.assertEqual(["b", "c", "a"], finished)
+            self.assertEqual([("a", True), ("b", True), ("c", True)], exits)
+            self.assertTrue(all(new_versions))
+
+            fail = True
+            finished = []
+            exits.clear()
+            with self.assertRaises(SyncError):
+                create_repository_versions(declarative_versions, max_concurrency=3)
+            # the other syncs are cancelled, and no version is left behind
+            self.assertNotIn("a", finished)
+            self.assertEqual([("a", False), ("b", False), ("c", False)], exits)
+
+    def test_check_shard_tasks(self):
+        """Test that the sync fails if any of its shards didn't complete."""
+        with patch("pulp_rpm.app.tasks.synchronizing.Task") as task:
+            incomplete = task.objects.filter.return_value.exclude.return_value
+            incomplete.exists.return_value = False
+            check_shard_tasks(["a", "b"])
+
+            incomplete.exists.return_value = True
+            incomplete.count.return_value = 1
+            with self.assertRaisesRegex(SyncError, "1 of the 2 shards"):
+                check_shard_tasks(["a", "b"])
+
+    def test_first_stage_shard(self):
+        """Test that a shard only passes on the packages which belong to it."""
+        with patch("pulpcore.plugin.stages.api.get_domain"):
+            stage = RpmFirstStage(MagicMock(), MagicMock(), False, False, shard=(1, 2))
+        stage._out_q = asyncio.Queue()
+        items = [
+            SimpleNamespace(content=MagicMock(spec=Package, pkgId="00000000" + "0" * 56)),
+            SimpleNamespace(content=MagicMock(spec=Package, pkgId="00000001" + "0" * 56)),
+            SimpleNamespace(content=MagicMock()),
+        ]
+        for item in items:
+            asyncio.run(stage.put(item))
+
+        self.assertEqual(1, stage._out_q.qsize())
+        self.assertIs(items[1], stage._out_q.get_nowait())
+
+    def test_signing_key_extractor_failures(self):
+        """Test that packages whose header can't be fetched are passed on without signing keys."""
+        remote = MagicMock()
+        remote.get_downloader.return_value.run.side_effect = ClientConnectionError("offline")
+        items = []
+        for name in ["a", "b"]:
+            package = MagicMock(
+                spec=Package, signing_keys=None, rpm_header_end=100, filename=f"{name}.rpm"
+            )
+            package._state = SimpleNamespace(adding=True)
+            d_artifact = SimpleNamespace(artifact=MagicMock(), remote=remote, url=name)
+            d_artifact.artifact._state.adding = True
+            items.append(
+                SimpleNamespace(content=package, d_artifacts=[d_artifact], does_batch=True)
+            )
+
+        with patch("pulpcore.plugin.stages.api.get_domain"):
+            stage = RpmSigningKeyExtractor()
+        stage._in_q = asyncio.Queue()
+        stage._out_q = asyncio.Queue()
+        for item in [*items, None]:
+            stage._in_q.put_nowait(item)
+        with self.assertLogs("pulp_rpm.app.tasks.synchronizing", "WARNING") as logs:
+            asyncio.run(stage.run())
+
+        self.assertEqual(1, len(logs.records))
+        self.assertIn("signing keys of 2 packages", logs.output[0])
+        self.assertEqual(items, [stage._out_q.get_nowait() for item in items])
+        self.assertEqual([None, None], [item.content.signing_keys for item in items])
+
+    def test_content_saver_advisory_relations(self):
+        """Test that the relations of the advisories in a batch are saved once, in bulk."""
+        advisories = {}
+        for name in ["new", "saved"]:
+            advisory = MagicMock(spec=UpdateRecord, pk=uuid.uuid4(), digest=name)
+            collection = MagicMock(name=f"{name}-collection")
+            relations = {
+                "collections": {collection: [MagicMock(name=f"{name}-package")]},
+                "references": [MagicMock(name=f"{name}-reference")],
+            }
+            advisories[name] = (advisory, collection, relations)
+
+        new, new_collection, new_relations = advisories["new"]
+        saved = advisories["saved"][0]
+        package = SimpleNamespace(content=MagicMock(spec=Package), extra_data={})
+        batch = [
+            SimpleNamespace(content=new, extra_data=new_relations),
+            package,
+            # the same advisory twice in a batch shares its relations
+            SimpleNamespace(content=new, extra_data=new_relations),
+            SimpleNamespace(content=saved, extra_data=advisories["saved"][2]),
+            None,
+        ]
+        with patch("pulpcore.plugin.stages.api.get_domain"):
+            stage = RpmContentSaver()
+        with (
+            patch("pulp_rpm.app.tasks.synchronizing.UpdateCollection") as update_collection,
+            patch("pulp_rpm.app.tasks.synchronizing.UpdateCollectionPackage") as collection_package,
+            patch("pulp_rpm.app.tasks.synchronizing.UpdateReference") as update_reference,
+        ):
+            existing = update_collection.objects.filter.return_value.values_list.return_value
+            existing.union.return_value = [saved.pk]
+            stage._post_save(batch)
+
+        # which advisories already have relations is queried once for the whole batch
+        update_collection.objects.filter.assert_called_once_with(
+            update_record_id__in=[new.pk, new.pk, saved.pk]
+        )
+        update_reference.objects.filter.assert_called_once_with(
+            update_record_id__in=[new.pk, new.pk, saved.pk]
+        )
+        update_collection.objects.bulk_create.assert_called_once_with(
+            [new_collection], ignore_conflicts=True
+        )
+        collection_package.objects.bulk_create.assert_called_once_with(
+            new_relations["collections"][new_collection], ignore_conflicts=True
+        )
+        update_reference.objects.bulk_create.assert_called_once_with(
+            new_relations["references"], ignore_conflicts=True
+        )
+        self.assertIs(new, new_collection.update_record)
+        self.assertIs(new, new_relations["references"][0].update_record)
+
+    def test_mirroring_store(self):
+        """Test that the mirroring data is kept apart per repository."""
+        repo = SimpleNamespace(pk=uuid.uuid4())
+        sub_repo = SimpleNamespace(pk=uuid.uuid4())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with MirroringStore(directory=tmp_dir) as store:
+                store.add_metadata_file(repo, "/tmp/a", "repodata/repomd.xml")
+                store.add_metadata_file(repo, "/tmp/b", "repodata/repomd.xml")
+                store.add_metadata_file(sub_repo, "/tmp/c", "repodata/repomd.xml")
+                store.add_package(repo, "abc", "Packages/a/a.rpm")
+                store.add_package(repo, "abc", "Packages/a/a.rpm")
+                store.add_package(repo, "abc", "other/a.rpm")
+                store.add_package(sub_repo, "def", "Packages/d/d.rpm")
+
+                self.assertEqual({"repodata/repomd.xml": "/tmp/b"}, store.metadata_files(repo))
+                self.assertEqual(
+                    {"abc": {"Packages/a/a.rpm", "other/a.rpm"}},
+                    store.package_locations(repo, ["abc", "def"]),
+                )
+                self.assertEqual(
+                    {"def": {"Packages/d/d.rpm"}}, store.package_locations(sub_repo, ["def"])
+                )
+            self.assertEqual([], os.listdir(tmp_dir))
@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import createrepo_c as cr
+
+from pulpcore.plugin.download import DownloadResult
+
+from pulp_rpm.app.zchunk import (
+    ZchunkError,
+    ZchunkHeader,
+    assemble,
+    chunk_digest,
+    download_zchunk_delta,
+    missing_ranges,
+    read_compint,
+)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "zchunk")
+
+
+def compint(value):
+    """Encode a zchunk compressed integer."""
+    data = bytearray()
+    while True:
+        byte = value % 128
+        value //= 128
+        if not value:
+            data.append(byte + 128)
+            return bytes(data)
+        data.append(byte)
+
+
+def make_zchunk_file(chunks):
+    """Build a zchunk file out of the given (already compressed) chunks."""
+    index = compint(3) + compint(len(chunks) + 1)
+    for chunk in [b"", *chunks]:
+        index += chunk_digest(3, chunk) + compint(len(chunk)) + compint(len(chunk))
+    header = bytes(32) + compint(0) + compint(2) + compint(len(index)) + index + compint(0)
+    lead = b"\0ZCK1" + compint(1) + compint(len(header)) + bytes(32)
+    return lead + header + b"".join(chunks)
+
+
+class TestZchunk(TestCase):
+    """Test the incremental download of zchunk files."""
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._cwd = os.getcwd()
+        os.chdir(self._tmp_dir.name)
+        self.old_chunks = [bytes([number]) * 30000 for number in range(8)]
+        self.new_chunks = [*self.old_chunks[:3], b"changed" * 5000, *self.old_chunks[4:]]
+        self.old_data = make_zchunk_file(self.old_chunks)
+        self.new_data = make_zchunk_file(self.new_chunks)
+        with open("old.zck", "wb") as f:
+            f.write(self.old_data)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp_dir.cleanup()
+
+    def test_compint(self):
+        """Test that compressed integers are decoded."""
+        for value in [0, 1, 127, 128, 300, 2**32]:
+            self.assertEqual(
+                (value, len(compint(value)) + 1), read_compint(b"x" + compint(value), 1)
+            )
+        with self.assertRaises(ZchunkError):
+            read_compint(b"\x01\x02", 0)
+
+    def test_parse_header(self):
+        """Test that the chunks of a file are found in its header."""
+        header = ZchunkHeader.parse(self.new_data)
+
+        self.assertEqual(len(self.new_data), header.size)
+        self.assertEqual(len(self.new_chunks) + 1, len(header.chunks))
+        for (digest, offset, length), chunk in zip(header.chunks[1:], self.new_chunks):
+            self.assertEqual(chunk, self.new_data[offset : offset + length])
+            self.assertEqual(chunk_digest(3, chunk), digest)
+        with self.assertRaises(ZchunkError):
+            ZchunkHeader.parse(b"<?xml")
+
+    def test_missing_ranges(self):
+        """Test that only the chunks which changed are missing."""
+        header = ZchunkHeader.parse(self.new_data)
+        _, offset, length = header.chunks[4]
+
+        self.assertEqual(
+            [(offset, offset + length)],
+            missing_ranges(header, ZchunkHeader.parse(self.old_data)),
+        )
+        self.assertEqual([], missing_ranges(header, header))
+
+    def test_download_zchunk_delta(self):
+        """Test that a file is reassembled from the changed chunks and the previous version."""
+        requested_ranges = []
+
+        def get_downloader(url, **kwargs):
+            async def run(extra_data=None):
+                byte_range = extra_data["request_kwargs"]["headers"]["Range"]
+                start, end = map(int, re.match(r"bytes=(\d+)-(\d+)", byte_range).groups())
+                requested_ranges.append((start, end + 1))
+                path = tempfile.NamedTemporaryFile(dir=".", delete=False).name
+                with open(path, "wb") as f:
+                    f.write(self.new_data[start : end + 1])
+                return DownloadResult(url=url, artifact_attributes={}, path=path, headers={})
+
+            downloader = MagicMock()
+            downloader.run = run
+            return downloader
+
+        remote = MagicMock()
+        remote.get_downloader.side_effect = get_downloader
+        checksum = hashlib.sha256(self.new_data).hexdigest()
+        result = asyncio.run(
+            download_zchunk_delta(
+                remote,
+                "http://example.com/primary.xml.zck",
+                "old.zck",
+                "sha256",
+                checksum,
+                len(self.new_data),
+            )
+        )
+
+        with open(result.path, "rb") as f:
+            self.assertEqual(self.new_data, f.read())
+        self.assertEqual(
+            {"sha256": checksum, "size": len(self.new_data)}, result.artifact_attributes
+        )
+        header = ZchunkHeader.parse(self.new_data)
+        _, offset, length = header.chunks[4]
+        self.assertEqual([(0, 64 * 1024), (offset, offset + length)], requested_ranges)
+
+        with self.assertRaises(ZchunkError):
+            asyncio.run(
+                download_zchunk_delta(
+                    remote,
+                    "http://example.com/primary.xml.zck",
+                    "old.zck",
+                    "sha256",
+                    "0" * 64,
+                    len(self.new_data),
+                )
+            )
+
+    def test_zchunk_metadata(self):
+        """Test that a zchunk primary.xml is reassembled from the previous version of it."""
+        # Two versions of a primary.xml with 10 packages, one of which was updated in the second
+        old_path = os.path.join(FIXTURES_DIR, "primary.xml.zck")
+        new_path = os.path.join(FIXTURES_DIR, "primary-updated.xml.zck")
+        with open(new_path, "rb") as f:
+            new_data = f.read()
+        old_header = ZchunkHeader.from_file(old_path)
+        header = ZchunkHeader.from_file(new_path)
+
+        # The dictionary, the XML header, a chunk per package and the XML footer
+        self.assertEqual(13, len(header.chunks))
+        self.assertEqual(len(new_data), header.size)
+        for digest, offset, length in header.chunks:
+            chunk = new_data[offset : offset + length]
+            self.assertEqual(digest, chunk_digest(header.chunk_checksum_type, chunk))
+
+        ranges = missing_ranges(header, old_header)
+        _, offset, length = header.chunks[6]
+        self.assertEqual([(offset, offset + length)], ranges)
+        with open("range", "wb") as f:
+            f.write(new_data[offset : offset + length])
+        assemble(
+            "primary.xml.zck",
+            new_data[: header.length],
+            header,
+            old_path,
+            old_header,
+            {ranges[0]: "range"},
+        )
+        with open("primary.xml.zck", "rb") as f:
+            self.assertEqual(new_data, f.read())
+
+        # The chunks are zstd frames, which together make up the package metadata
+        with open("primary.xml.zst", "wb") as f:
+            f.write(new_data[header.length :])
+        cr.decompress_file("primary.xml.zst", "primary.xml", cr.ZSTD_COMPRESSION)
+        packages = []
+        cr.xml_parse_primary("primary.xml", pkgcb=packages.append, do_files=False)
+        self.assertEqual(10, len(packages))
+        self.assertEqual(("chimpanzee", "1.1"), (packages[4].name, packages[4].version))